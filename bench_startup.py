@@ -0,0 +1,145 @@
+'''
+Startup time benchmark for hdfs_wizard.py.
+
+Measures, in fresh interpreter processes,
+    - import latency: time to import the hdfs_wizard module.
+    - first prompt latency: time from launching "python hdfs_wizard.py" until the
+      main menu's "Choice:" prompt is shown.
+
+The benchmark fails if either median exceeds its fixed limit, which holds on any machine
+the wizard is expected to run on. Baselines are machine specific, so they aren't kept in
+the repository; a baseline saved on this machine is compared with too, and the benchmark
+also fails if either median regresses over it by more than the allowed tolerance.
+
+Usage:
+    python bench_startup.py                     # check limits, and compare with baseline if one exists
+    python bench_startup.py --save-baseline     # record current timings as the baseline
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+import simplejson as json
+
+
+BASELINE_FILE = 'bench_startup.json'
+
+# Limits of medians in ms, well above the tens of ms the wizard takes when heavy modules
+# and the plan catalog are loaded lazily.
+DEFAULT_MAX_IMPORT_MS = 150
+DEFAULT_MAX_FIRST_PROMPT_MS = 500
+
+WIZARD_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure_import(python):
+    '''
+    Returns seconds taken to import hdfs_wizard in a fresh interpreter.
+    '''
+    code = 'import time; t = time.time(); import hdfs_wizard; print(time.time() - t)'
+    output = subprocess.check_output([python, '-c', code], cwd = WIZARD_DIR)
+    return float(output.decode('utf-8').strip().splitlines()[-1])
+
+
+
+def measure_first_prompt(python, timeout = 30):
+    '''
+    Returns seconds from launching the wizard until its main menu prompt is shown.
+    '''
+    env = dict(os.environ, PYTHONUNBUFFERED = '1')
+
+    start = time.time()
+    proc = subprocess.Popen([python, 'hdfs_wizard.py'], cwd = WIZARD_DIR, env = env,
+        stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+
+    output = b''
+    try:
+        while b'Choice:' not in output:
+            if time.time() - start > timeout:
+                raise RuntimeError('No prompt within %d secs. Output: %s' % (timeout, output))
+
+            byte = proc.stdout.read(1)
+            if not byte:
+                raise RuntimeError('Wizard exited before prompting. Output: %s' % (output))
+            output += byte
+
+        elapsed = time.time() - start
+
+    finally:
+        try:
+            proc.stdin.write(b'q\n')
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        proc.stdout.close()
+        proc.wait()
+
+    return elapsed
+
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2.0
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Benchmark startup time of hdfs_wizard.py')
+    parser.add_argument('--runs', type = int, default = 10, help = 'Number of runs of each measurement')
+    parser.add_argument('--tolerance', type = float, default = 0.25,
+        help = 'Allowed regression over baseline, as a fraction. Default 0.25')
+    parser.add_argument('--max-import-ms', type = float, default = DEFAULT_MAX_IMPORT_MS,
+        help = 'Limit of import latency. Default %d' % (DEFAULT_MAX_IMPORT_MS))
+    parser.add_argument('--max-first-prompt-ms', type = float, default = DEFAULT_MAX_FIRST_PROMPT_MS,
+        help = 'Limit of first prompt latency. Default %d' % (DEFAULT_MAX_FIRST_PROMPT_MS))
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'Save timings as the new baseline')
+    parser.add_argument('--python', default = sys.executable, help = 'Python interpreter to run the wizard with')
+    args = parser.parse_args()
+
+    results = {
+        'import_secs' : median([measure_import(args.python) for i in range(args.runs)]),
+        'first_prompt_secs' : median([measure_first_prompt(args.python) for i in range(args.runs)])
+    }
+
+    for key in sorted(results.keys()):
+        print('%-20s %8.1f ms' % (key, results[key] * 1000))
+
+    regressed = False
+    limits = {'import_secs' : args.max_import_ms / 1000.0, 'first_prompt_secs' : args.max_first_prompt_ms / 1000.0}
+    for key in sorted(results.keys()):
+        if results[key] > limits[key]:
+            regressed = True
+            print('REGRESSION: %s is %.1f ms, over the limit of %.1f ms' %
+                (key, results[key] * 1000, limits[key] * 1000))
+
+    baseline_file = os.path.join(WIZARD_DIR, BASELINE_FILE)
+
+    if args.save_baseline:
+        with open(baseline_file, 'w') as f:
+            json.dump(results, f, indent = 4 * ' ')
+        print('Saved baseline to %s' % (baseline_file))
+        sys.exit(1 if regressed else 0)
+
+    if not os.path.isfile(baseline_file):
+        print('No baseline to compare with. Run with --save-baseline to record one.')
+        sys.exit(1 if regressed else 0)
+
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)
+
+    for key in sorted(results.keys()):
+        limit = baseline[key] * (1 + args.tolerance)
+        if results[key] > limit:
+            regressed = True
+            print('REGRESSION: %s is %.1f ms, baseline %.1f ms (limit %.1f ms)' %
+                (key, results[key] * 1000, baseline[key] * 1000, limit * 1000))
+
+    sys.exit(1 if regressed else 0)
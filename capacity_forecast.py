@@ -0,0 +1,272 @@
+'''
+Forecast of storage growth, and the node additions and costs it leads to.
+
+Growth is described as a list of segments, each starting at a month and following a model:
+
+    [
+        {'from_month' : 0, 'model' : 'linear', 'monthly_increase_mb' : 500 * 1024},
+        {'from_month' : 12, 'model' : 'compound', 'monthly_rate' : 0.04},
+        {'from_month' : 24, 'model' : 'series', 'history_mb' : [...], 'fit' : 'compound'}
+    ]
+
+'linear' adds a fixed size every month, 'compound' grows by a fixed rate every month, and
+'series' fits a linear or compound rate to a historical series of monthly sizes, oldest first.
+A single segment can also be given as a dict without 'from_month'.
+
+Month 0 is the initial capacity. Storage nodes are added with the cluster's expansion plan
+whenever total storage including copies would exceed the target utilization.
+
+CapacityForecaster remembers the previous forecast. When growth parameters change, only
+months starting from the first changed segment are recomputed.
+'''
+
+from __future__ import print_function
+
+import math
+
+import numpy as np
+
+
+class ForecastError(Exception):
+    pass
+
+
+
+class CapacityForecaster(object):
+
+    def __init__(self, sizing_engine, copies, nodes, expansion_plan_id = None,
+            max_utilization = 0.8, horizon_months = 36):
+        '''
+        Args:
+            sizing_engine - a plan_sizing.SizingEngine.
+            copies - number of additional copies of each file.
+            nodes - initial storage nodes, as saved in cluster['nodes'].
+            expansion_plan_id - plan of the nodes that are added as data grows. Defaults to
+                the plan with most initial nodes.
+            max_utilization - fraction of usable storage above which nodes are added.
+            horizon_months - number of months to forecast.
+        '''
+        self.engine = sizing_engine
+        self.copies = copies
+        self.max_utilization = float(max_utilization)
+        self.horizon_months = horizon_months
+
+        self.initial_count = 0
+        self.initial_usable_mb = 0
+        self.initial_monthly_cost = 0.0
+        largest = None
+        for n in nodes:
+            plan_id = int(n['plan'].split(':')[1])
+            i = self.engine.index_of[plan_id]
+            self.initial_count += n['count']
+            self.initial_usable_mb += n['count'] * int(self.engine.usable_storage_mb[i])
+            self.initial_monthly_cost += n['count'] * float(self.engine.monthly_price[i])
+            if largest is None or n['count'] > largest[1]:
+                largest = (plan_id, n['count'])
+
+        if expansion_plan_id is None:
+            if largest is None:
+                raise ForecastError('No initial storage nodes and no expansion plan')
+            expansion_plan_id = largest[0]
+
+        i = self.engine.index_of[expansion_plan_id]
+        self.expansion_plan_id = expansion_plan_id
+        self.expansion_usable_mb = int(self.engine.usable_storage_mb[i])
+        self.expansion_monthly_cost = float(self.engine.monthly_price[i])
+
+        # State of the previous forecast, for incremental recomputation.
+        self._initial_capacity_mb = None
+        self._segments = None
+        self._forecast = None
+
+
+    def forecast(self, initial_capacity_mb, growth):
+        '''
+        Forecasts storage needs for every month up to horizon_months.
+
+        Args:
+            initial_capacity_mb - capacity at month 0 in MB, not including copies.
+            growth - a growth segment dict or a list of them, as described in module documentation.
+
+        Returns:
+            A Forecast.
+        '''
+        segments = self._normalize(growth)
+
+        months = self.horizon_months + 1
+
+        # Find first month affected by a change since the previous forecast.
+        start_month = 0
+        if self._forecast is not None and self._initial_capacity_mb == initial_capacity_mb:
+            start_month = months
+            for j in range(max(len(segments), len(self._segments))):
+                old = self._segments[j] if j < len(self._segments) else None
+                new = segments[j] if j < len(segments) else None
+                if old != new:
+                    start_month = min((s['from_month'] for s in (old, new) if s is not None))
+                    break
+
+        if start_month >= months:
+            return self._forecast
+
+        if start_month == 0:
+            data_mb = np.empty(months, dtype = np.float64)
+            data_mb[0] = initial_capacity_mb
+            start_month = 1
+        else:
+            # Reuse everything before the first changed segment.
+            data_mb = self._forecast.data_mb.copy()
+
+        for j, segment in enumerate(segments):
+            end = segments[j + 1]['from_month'] if j + 1 < len(segments) else months - 1
+            end = min(end, months - 1)
+            first = max(segment['from_month'] + 1, start_month)
+            if first > end:
+                continue
+
+            steps = np.arange(first, end + 1) - segment['from_month']
+            base = data_mb[segment['from_month']]
+            data_mb[first:end + 1] = self._grow(segment, base, steps)
+
+        total_mb = data_mb * (self.copies + 1)
+
+        # Nodes never get removed, so node count is the running max of required nodes.
+        required_usable = total_mb / self.max_utilization
+        extra_required = np.maximum(0, np.ceil((required_usable - self.initial_usable_mb) / self.expansion_usable_mb))
+
+        if self._forecast is not None and start_month > 1:
+            extra_nodes = self._forecast.extra_nodes.copy()
+            extra_nodes[start_month:] = np.maximum.accumulate(
+                np.maximum(extra_required[start_month:], extra_nodes[start_month - 1]))
+        else:
+            extra_nodes = np.maximum.accumulate(extra_required)
+
+        extra_nodes = extra_nodes.astype(np.int64)
+        node_count = self.initial_count + extra_nodes
+        usable_mb = self.initial_usable_mb + extra_nodes * self.expansion_usable_mb
+        monthly_cost = self.initial_monthly_cost + extra_nodes * self.expansion_monthly_cost
+
+        self._initial_capacity_mb = initial_capacity_mb
+        self._segments = segments
+        self._forecast = Forecast(
+            forecaster = self,
+            data_mb = data_mb,
+            total_mb = total_mb,
+            extra_nodes = extra_nodes,
+            node_count = node_count,
+            nodes_added = np.diff(np.concatenate(([0], extra_nodes))),
+            utilization = total_mb / usable_mb,
+            monthly_cost = monthly_cost,
+            cumulative_cost = np.cumsum(monthly_cost))
+
+        return self._forecast
+
+
+
+    def _normalize(self, growth):
+        if isinstance(growth, dict):
+            growth = [ dict(growth, from_month = growth.get('from_month', 0)) ]
+
+        segments = sorted((dict(s) for s in growth), key = lambda s: s.get('from_month', 0))
+        if not segments or segments[0].get('from_month', 0) != 0:
+            raise ForecastError('Growth should start at month 0')
+
+        for s in segments:
+            s.setdefault('from_month', 0)
+            model = s.get('model')
+            if model == 'linear':
+                if 'monthly_increase_mb' not in s:
+                    raise ForecastError('linear growth needs monthly_increase_mb')
+
+            elif model == 'compound':
+                if 'monthly_rate' not in s or s['monthly_rate'] <= -1:
+                    raise ForecastError('compound growth needs monthly_rate greater than -1')
+
+            elif model == 'series':
+                history = s.get('history_mb') or []
+                if len(history) < 2:
+                    raise ForecastError('series growth needs at least 2 months of history_mb')
+                if s.get('fit', 'compound') not in ('linear', 'compound'):
+                    raise ForecastError("series fit should be 'linear' or 'compound'")
+                if s.get('fit', 'compound') == 'compound' and min(history) <= 0:
+                    raise ForecastError('compound fit needs positive history_mb')
+
+            else:
+                raise ForecastError("Growth model should be 'linear', 'compound' or 'series'")
+
+        return segments
+
+
+    def _grow(self, segment, base, steps):
+        model = segment['model']
+        if model == 'series':
+            model, rate = fit_growth(segment['history_mb'], segment.get('fit', 'compound'))
+            segment = {'monthly_increase_mb' : rate, 'monthly_rate' : rate}
+
+        if model == 'linear':
+            return np.maximum(0, base + steps * float(segment['monthly_increase_mb']))
+
+        return base * np.power(1.0 + segment['monthly_rate'], steps)
+
+
+
+class Forecast(object):
+    '''
+    Month by month forecast. All arrays are indexed by month, month 0 being the initial cluster.
+    '''
+
+    def __init__(self, forecaster, data_mb, total_mb, extra_nodes, node_count, nodes_added,
+            utilization, monthly_cost, cumulative_cost):
+        self.forecaster = forecaster
+        self.data_mb = data_mb
+        self.total_mb = total_mb
+        self.extra_nodes = extra_nodes
+        self.node_count = node_count
+        self.nodes_added = nodes_added
+        self.utilization = utilization
+        self.monthly_cost = monthly_cost
+        self.cumulative_cost = cumulative_cost
+
+
+    def rows(self, only_changes = False):
+        '''
+        Returns list of dicts with 'month', 'data_mb', 'total_mb', 'node_count', 'nodes_added',
+        'utilization', 'monthly_cost' and 'cumulative_cost' for each month. If only_changes is True,
+        only month 0, months in which nodes are added, and the last month are returned.
+        '''
+        rows = []
+        last = len(self.data_mb) - 1
+        for m in range(len(self.data_mb)):
+            if only_changes and m not in (0, last) and self.nodes_added[m] == 0:
+                continue
+
+            rows.append({
+                'month' : m,
+                'data_mb' : int(self.data_mb[m]),
+                'total_mb' : int(self.total_mb[m]),
+                'node_count' : int(self.node_count[m]),
+                'nodes_added' : int(self.nodes_added[m]),
+                'utilization' : float(self.utilization[m]),
+                'monthly_cost' : float(self.monthly_cost[m]),
+                'cumulative_cost' : float(self.cumulative_cost[m])
+            })
+        return rows
+
+
+
+def fit_growth(history_mb, fit = 'compound'):
+    '''
+    Fits a monthly growth to a historical series of monthly sizes, oldest first, by least squares.
+
+    Returns:
+        Tuple ('linear', monthly increase in MB) or ('compound', monthly rate).
+    '''
+    months = np.arange(len(history_mb), dtype = np.float64)
+    history_mb = np.asarray(history_mb, dtype = np.float64)
+
+    if fit == 'linear':
+        slope = np.polyfit(months, history_mb, 1)[0]
+        return ('linear', float(slope))
+
+    slope = np.polyfit(months, np.log(history_mb), 1)[0]
+    return ('compound', float(math.exp(slope) - 1.0))
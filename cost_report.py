@@ -0,0 +1,337 @@
+'''
+Cost of measured HDFS performance of every cluster configuration benchmarked by hdfsperftests.
+
+Benchmark results stored in hdfsperftests/hdfsperfdata/<cluster>/results.db record the plans and
+number of nodes of the cluster of each run. Runs on the same configuration - plans, node counts,
+HDFS settings and other Hadoop configuration overrides - are pooled, and what the configuration
+costs per month and per hour, by current plan prices, is divided by what it delivered:
+
+    $/(GB/s) write      - monthly cost per GB/s of sustained TestDFSIO write throughput
+    $/(GB/s) read       - monthly cost per GB/s of sustained TestDFSIO read throughput
+    $/M NN ops          - cost of running the cluster for as long as it takes the NameNode to
+                          do a million NNThroughputBenchmark operations
+    $/TB-month usable   - monthly cost per TB of HDFS storage, not including copies
+
+Sustained throughput is the aggregate of the whole cluster - MB processed by a TestDFSIO run
+divided by its execution time - not TestDFSIO's own "Throughput mb/sec", which is the average
+of each file's rate. Usable storage is based on the default disk allocation of the worker plans,
+as in the wizard, and dfs.replication of the runs.
+
+Usage:
+    python cost_report.py [--data-dir hdfsperftests/hdfsperfdata] [--by write] [--offline]
+'''
+
+from __future__ import print_function
+
+import os
+import os.path
+import glob
+import sqlite3
+import hashlib
+import argparse
+import collections
+
+import simplejson as json
+
+
+DEFAULT_DATA_DIR = os.path.join('hdfsperftests', 'hdfsperfdata')
+
+# Report columns: key of each configuration dict, title, and format.
+COST_COLUMNS = [
+    ('write', 'cost_per_write_gbps', '$/(GB/s)\nwrite', '{:,.2f}'),
+    ('read', 'cost_per_read_gbps', '$/(GB/s)\nread', '{:,.2f}'),
+    ('nn_ops', 'cost_per_million_nn_ops', '$/M NN\nops', '{:,.4f}'),
+    ('storage', 'cost_per_usable_tb_month', '$/TB-month\nusable', '{:,.2f}')
+]
+
+DEFAULT_REPLICATION = 3
+
+
+class CostReport(object):
+
+    def __init__(self, catalog):
+        '''
+        Args:
+            catalog - a plan_catalog.PlanCatalog with default disk allocations, for prices
+                and usable storage of plans.
+        '''
+        self.catalog = catalog
+
+        # Ranked configurations, and configurations with plans that aren't in the catalog.
+        self.configurations = []
+        self.unpriced = []
+
+
+    def load(self, data_dir = DEFAULT_DATA_DIR):
+        '''
+        Reads results of all clusters in data_dir, and computes costs of every configuration.
+
+        Returns:
+            self, with configurations ranked by cost per GB/s of write throughput.
+        '''
+        groups = collections.OrderedDict()
+        for db_path in sorted(glob.glob(os.path.join(data_dir, '*', 'results.db'))):
+            for run in read_runs(db_path):
+                key = configuration_key(run['spec'])
+                group = groups.setdefault(key, {'spec' : run['spec'], 'runs' : [], 'clusters' : set(), 'values' : {}})
+                group['runs'].append(run['run_id'])
+                group['clusters'].add(run['cluster'])
+                for name, values in run['values'].items():
+                    group['values'].setdefault(name, []).extend(values)
+
+        self.configurations = []
+        self.unpriced = []
+        for key, group in groups.items():
+            c = self.configuration(group['spec'], group['values'])
+            if c is None:
+                self.unpriced.append(group['spec'])
+                continue
+
+            c['runs'] = group['runs']
+            c['clusters'] = sorted([name for name in group['clusters'] if name])
+            self.configurations.append(c)
+
+        self.configurations = rank(self.configurations)
+        return self
+
+
+    def configuration(self, spec, values):
+        '''
+        Returns cost, measured performance and cost of performance of a configuration, or
+        None if any of its plans isn't in the catalog or its node plans weren't recorded.
+
+        Args:
+            spec - cluster spec of its runs, as returned by hdfs_perf.cluster_spec().
+            values - dict of 'write_mbps', 'read_mbps' and 'nn_ops_per_sec' -> list of values
+                of repetitions, as returned by read_runs().
+        '''
+        master = self.catalog.by_id(spec['master_plan_id']) if spec.get('master_plan_id') is not None else None
+        workers = []
+        for plan_id, count in sorted(spec.get('worker_plans', {}).items()):
+            plan = self.catalog.by_id(plan_id) if plan_id != 'None' else None
+            if plan is None:
+                return None
+            workers.append((plan, count))
+
+        if master is None or not workers:
+            return None
+
+        replication = replication_of(spec)
+
+        c = collections.OrderedDict()
+        c['master_plan_id'] = master['PLANID']
+        c['worker_plans'] = [(p['PLANID'], count) for p, count in workers]
+        c['workers'] = sum([count for p, count in workers])
+        c['replication'] = replication
+        c['hadoop_conf'] = spec.get('hadoop_conf') or {}
+        c['conf_key'] = hashlib.sha256(json.dumps(c['hadoop_conf'], sort_keys = True).encode('utf-8')).hexdigest()[:8]
+        c['label'] = ' + '.join(['1 x %s' % (master['LABEL'])] + ['%d x %s' % (count, p['LABEL']) for p, count in workers])
+
+        c['monthly_cost'] = master['PRICE'] + sum([p['PRICE'] * count for p, count in workers])
+        c['hourly_cost'] = master['HOURLY'] + sum([p['HOURLY'] * count for p, count in workers])
+
+        usable_gb = sum([self.catalog.disk_plan(p['PLANID'])[2] * count for p, count in workers]) / float(replication)
+        c['usable_tb'] = usable_gb / 1024.0
+
+        c['write_gbps'] = mean_of(values.get('write_mbps'), 1 / 1024.0)
+        c['read_gbps'] = mean_of(values.get('read_mbps'), 1 / 1024.0)
+        c['nn_ops_per_sec'] = mean_of(values.get('nn_ops_per_sec'))
+        c['repetitions'] = dict([(name, len(v)) for name, v in values.items()])
+
+        c['cost_per_write_gbps'] = c['monthly_cost'] / c['write_gbps'] if c['write_gbps'] else None
+        c['cost_per_read_gbps'] = c['monthly_cost'] / c['read_gbps'] if c['read_gbps'] else None
+        c['cost_per_million_nn_ops'] = (c['hourly_cost'] / (c['nn_ops_per_sec'] * 3600 / 1e6)
+            if c['nn_ops_per_sec'] else None)
+        c['cost_per_usable_tb_month'] = c['monthly_cost'] / c['usable_tb'] if c['usable_tb'] else None
+        return c
+
+
+    def for_plan(self, plan_id, count, replication = None):
+        '''
+        Returns the measured configuration closest to a cluster of count storage nodes of a
+        single plan, or None if no such configuration was benchmarked. Configurations
+        without Hadoop configuration overrides, and with the given replication, are preferred
+        to those of the nearest node count.
+        '''
+        candidates = [c for c in self.configurations
+            if len(c['worker_plans']) == 1 and c['worker_plans'][0][0] == plan_id]
+        if not candidates:
+            return None
+
+        return min(candidates, key = lambda c: (has_overrides(c), replication is not None and c['replication'] != replication,
+            abs(c['workers'] - count)))
+
+
+
+def read_runs(db_path):
+    '''
+    Reads runs of a results database of hdfsperftests/results_store.py, with the values of
+    their successful, measured repetitions that cost is computed from.
+
+    Returns:
+        list of dicts with 'run_id', 'cluster', 'spec', and 'values', a dict of 'write_mbps',
+        'read_mbps' and 'nn_ops_per_sec' -> list of values, one per repetition.
+    '''
+    db = sqlite3.connect(db_path)
+    try:
+        runs = collections.OrderedDict()
+        for run_id, cluster, spec in db.execute('select run_id, cluster, spec from runs order by started'):
+            runs[run_id] = {'run_id' : run_id, 'cluster' : cluster, 'spec' : json.loads(spec), 'values' : {}}
+
+        # Metrics of each repetition of each benchmark, to combine metrics of a repetition.
+        repetitions = collections.OrderedDict()
+        for run_id, benchmark, type, params, repetition, metric, value in db.execute('''
+                select run_id, benchmark, type, params, repetition, metric, value from measurements
+                where warmup = 0 and ok = 1 and type in ('testdfsio', 'nnthroughput')
+                order by run_id, benchmark, params_key, repetition'''):
+            r = repetitions.setdefault((run_id, benchmark, params, repetition),
+                {'type' : type, 'params' : json.loads(params), 'metrics' : {}})
+            r['metrics'][metric] = value
+    finally:
+        db.close()
+
+    for (run_id, benchmark, params, repetition), r in repetitions.items():
+        if run_id not in runs:
+            continue
+
+        name, value = repetition_value(r['type'], r['params'], r['metrics'])
+        if value is not None:
+            runs[run_id]['values'].setdefault(name, []).append(value)
+
+    return list(runs.values())
+
+
+
+def repetition_value(type, params, metrics):
+    '''
+    Returns (name, value) of the figure cost is computed from, of one repetition of a benchmark.
+    Value is None if it couldn't be parsed from the benchmark's output.
+    '''
+    if type == 'nnthroughput':
+        return 'nn_ops_per_sec', metrics.get('ops_per_sec')
+
+    name = 'read_mbps' if params.get('mode', 'write') == 'read' else 'write_mbps'
+    if metrics.get('total_mb') and metrics.get('exec_secs'):
+        return name, metrics['total_mb'] / metrics['exec_secs']
+
+    # Without execution time, every file is assumed to be read or written at the average rate.
+    if metrics.get('throughput_mb_sec') and metrics.get('files'):
+        return name, metrics['throughput_mb_sec'] * metrics['files']
+
+    return name, None
+
+
+
+def configuration_key(spec):
+    '''
+    Returns what runs of the same configuration have in common - plans and node counts, and
+    Hadoop configuration - as a hashable value. Hadoop version isn't part of it.
+    '''
+    return json.dumps([spec.get('master_plan_id'), spec.get('worker_plans'), spec.get('hdfs_site'),
+        spec.get('hadoop_conf')], sort_keys = True)
+
+
+
+def has_overrides(configuration):
+    '''
+    Returns True if a configuration has Hadoop configuration overrides other than dfs.replication.
+    '''
+    conf = dict(configuration['hadoop_conf'])
+    hdfs_site = dict(conf.pop('hdfs-site', {}))
+    hdfs_site.pop('dfs.replication', None)
+    return bool(hdfs_site) or any(conf.values())
+
+
+
+def replication_of(spec):
+    try:
+        return int(spec.get('hdfs_site', {}).get('dfs.replication', DEFAULT_REPLICATION))
+    except ValueError:
+        return DEFAULT_REPLICATION
+
+
+
+def mean_of(values, scale = 1.0):
+    if not values:
+        return None
+    return sum(values) / float(len(values)) * scale
+
+
+
+def rank(configurations, by = 'write'):
+    '''
+    Ranks configurations by each cost in COST_COLUMNS, cheapest first, into their 'ranks'
+    dict, and returns them sorted by the cost named by.
+    Configurations that weren't measured for a cost have no rank for it.
+    '''
+    for column, key, title, fmt in COST_COLUMNS:
+        measured = sorted([c for c in configurations if c[key] is not None], key = lambda c: c[key])
+        for i, c in enumerate(measured):
+            c.setdefault('ranks', {})[column] = i + 1
+
+    key = dict([(column, key) for column, key, title, fmt in COST_COLUMNS])[by]
+    return sorted(configurations, key = lambda c: (c[key] is None, c[key]))
+
+
+
+def print_report(configurations, by = 'write'):
+    '''
+    Prints configurations with their measured performance and its cost, and the rank of
+    each cost, in the order of the list.
+    '''
+    from terminaltables import SingleTable
+
+    table_data = [
+        ['Configuration', 'Conf', 'Repl', '$/month', '$/hour', 'Write\nGB/s', 'Read\nGB/s', 'NN\nops/s', 'Usable\nTB'] +
+        [title + (' *' if column == by else '') for column, key, title, fmt in COST_COLUMNS]
+    ]
+
+    for c in configurations:
+        row = [
+            c['label'],
+            c['conf_key'] if c['hadoop_conf'] else '-',
+            c['replication'],
+            '{:,.2f}'.format(c['monthly_cost']),
+            '{:,.3f}'.format(c['hourly_cost']),
+            '{:,.3f}'.format(c['write_gbps']) if c['write_gbps'] is not None else '-',
+            '{:,.3f}'.format(c['read_gbps']) if c['read_gbps'] is not None else '-',
+            '{:,.0f}'.format(c['nn_ops_per_sec']) if c['nn_ops_per_sec'] is not None else '-',
+            '{:,.2f}'.format(c['usable_tb'])
+        ]
+        for column, key, title, fmt in COST_COLUMNS:
+            row.append((fmt + ' (#{:d})').format(c[key], c['ranks'][column]) if c[key] is not None else '-')
+        table_data.append(row)
+
+    print(SingleTable(table_data).table)
+    print('*Ranked by this cost, cheapest first. (#N) is the rank of each cost among all configurations.')
+    print('Conf: fingerprint of Hadoop configuration overrides, if any. See --show-conf.')
+
+
+
+if __name__ == '__main__':
+
+    from hdfs_wizard import ClusterCreationWizard
+
+    parser = argparse.ArgumentParser(description = 'Cost of measured performance of benchmarked HDFS clusters')
+    parser.add_argument('--data-dir', default = DEFAULT_DATA_DIR, help = 'Directory of hdfsperftests cluster data')
+    parser.add_argument('--by', choices = [column for column, key, title, fmt in COST_COLUMNS], default = 'write',
+        help = 'Cost to rank configurations by')
+    parser.add_argument('--show-conf', action = 'store_true', help = 'Print Hadoop configuration overrides of configurations')
+    parser.add_argument('--offline', action = 'store_true',
+        help = 'Use only the recorded plan snapshot (plans.snapshot.json) or cached plans, without calling the Linode API')
+    args = parser.parse_args()
+
+    report = CostReport(ClusterCreationWizard(offline = args.offline).catalog).load(args.data_dir)
+    if not report.configurations:
+        parser.exit(1, 'No benchmark results with known plans in %s\n' % (args.data_dir))
+
+    configurations = rank(report.configurations, args.by)
+    print_report(configurations, args.by)
+
+    if args.show_conf:
+        for c in configurations:
+            if c['hadoop_conf']:
+                print('%s  %s' % (c['conf_key'], json.dumps(c['hadoop_conf'], sort_keys = True)))
+
+    if report.unpriced:
+        print('%d configurations skipped, with plans that are unknown or not in the catalog' % (len(report.unpriced)))
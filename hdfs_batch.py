@@ -0,0 +1,452 @@
+'''
+Headless sizing of HDFS clusters from cluster specs, without any prompts.
+
+Specs go through the same validators and sizing logic as the interactive wizard, and
+the result of each one is the cluster dict the wizard would have created.
+
+A cluster spec is a JSON or YAML dict like:
+
+    {
+        "name" : "analytics",               # optional, copied to the result
+        "initial_capacity" : "10 TB",       # same formats as the wizard's capacity prompt
+        "copies" : 2,
+        "storage_plan" : 7,                 # a PLANID, or "mix" for the cheapest mix of plans, or
+                                            # {"mix" : {...}} with constraints as keyword arguments
+                                            # of MixedPlanSolver.solve()
+        "growth" : {                        # optional forecast of node additions as data grows
+            "model" : {"model" : "linear", "monthly_increase_mb" : 102400},
+                                            # a growth segment or list of them, as described
+                                            # in capacity_forecast
+            "max_utilization" : 0.8,
+            "horizon_months" : 36,
+            "expansion_plan" : 7            # optional, plan of the added nodes
+        },
+        "namespace" : {                     # optional expected namespace size. If given,
+            "file_count" : 10000000,        # NameNode plans must be able to hold it, and
+            "avg_file_size" : "64 MB",      # can be "auto" for the cheapest plan that can.
+            "block_size" : "128 MB"
+        },
+        "namenodes" : {
+            "type" : "single",              # "single" or "ha_qjm"
+
+            "primary" : 4,                  # plans for "single"; secondary is optional
+            "secondary" : 2,
+
+            "namenode_plan" : 7,            # plans and JournalNode count for "ha_qjm"
+            "journal_node_count" : 3,
+            "journal_node_plan" : 1
+        }
+    }
+
+Usage:
+
+    python hdfs_batch.py spec.yaml              # a single spec, or a list of them
+    python hdfs_batch.py specs.jsonl            # one spec per line
+    cat specs.jsonl | python hdfs_batch.py -
+
+One JSON result line is written to stdout for every spec, in input order.
+'''
+
+from __future__ import print_function
+
+import sys
+import argparse
+import collections
+
+import simplejson as json
+
+from hdfs_wizard import ClusterCreationWizard, ValidatorUtils, MIN_COPIES, MAX_COPIES, MIN_JN_COUNT, MAX_JN_COUNT
+from plan_solver import MixedPlanSolver
+from capacity_forecast import ForecastError
+
+
+class SpecError(Exception):
+    pass
+
+
+
+class HeadlessClusterSizer(ClusterCreationWizard):
+    '''
+    A cluster creation wizard that takes all its answers from a cluster spec instead of prompts.
+    The plan catalog and sizing engine are loaded once and reused for every spec.
+    '''
+
+    def size(self, spec):
+        '''
+        Sizes a cluster for given spec.
+
+        Args:
+            spec - cluster spec dict, as described in module documentation.
+
+        Returns:
+            The cluster dict, with an additional 'cost' entry summarizing total monthly and hourly
+            cost of all nodes, and a 'performance' entry with estimated storage node throughput.
+
+        Raises:
+            SpecError if spec is invalid.
+        '''
+        if not isinstance(spec, dict):
+            raise SpecError('Cluster spec should be a dict')
+
+        self.cluster = collections.OrderedDict()
+        if 'name' in spec:
+            self.cluster['name'] = spec['name']
+
+        capacity = spec.get('initial_capacity', '1 TB')
+        if not isinstance(capacity, int):
+            capacity = str(capacity)
+        capacity_info = self._validate('initial_capacity', ValidatorUtils.validate_storage_size, capacity, None)
+        if capacity_info['size_in_mb'] <= 0:
+            raise SpecError('initial_capacity: should be greater than 0')
+
+        copies = self._validate('copies', ValidatorUtils.validate_int, spec.get('copies', 2), (MIN_COPIES, MAX_COPIES))
+
+        self.set_cluster_capacity(capacity_info, copies)
+
+        self._size_storage_nodes(spec.get('storage_plan'))
+
+        self.namenode_sizing = None
+        if spec.get('namespace') is not None:
+            self._size_namespace(spec['namespace'])
+
+        self._size_namenodes(spec.get('namenodes'))
+
+        if spec.get('growth') is not None:
+            self._forecast_growth(spec['growth'])
+
+        self.cluster['cost'] = self.estimate_cost()
+
+        self.cluster['performance'] = self.throughput.for_nodes(self.cluster['nodes'],
+            self.cluster['total_initial_capacity'], self.cluster['copies'])
+
+        return self.cluster
+
+
+    def estimate_cost(self):
+        '''
+        Returns dict with total 'monthly' and 'hourly' cost of storage nodes and NameNode setup
+        of current cluster.
+        '''
+        plan_counts = collections.defaultdict(int)
+        for n in self.cluster['nodes']:
+            plan_counts[ int(n['plan'].split(':')[1]) ] += n['count']
+
+        nn = self.cluster['namenodes']['details']
+        if self.cluster['namenodes']['type'] == 'single':
+            plan_counts[nn['primary']] += 1
+            if nn['secondary'] is not None:
+                plan_counts[nn['secondary']] += 1
+
+        else:
+            plan_counts[nn['active']] += 1
+            plan_counts[nn['standby']] += 1
+            plan_counts[nn['journal_nodes']['plan']] += nn['journal_nodes']['count']
+
+        cost = {'monthly' : 0.0, 'hourly' : 0.0}
+        for plan_id, count in plan_counts.items():
+            p = self.catalog.by_id(plan_id)
+            cost['monthly'] += count * p['PRICE']
+            cost['hourly'] += count * p['HOURLY']
+
+        return cost
+
+
+
+    def _size_storage_nodes(self, storage_plan):
+
+        if storage_plan is None:
+            raise SpecError('storage_plan: missing')
+
+        if storage_plan == 'mix' or isinstance(storage_plan, dict):
+            constraints = {}
+            if isinstance(storage_plan, dict):
+                if set(storage_plan.keys()) != set(['mix']) or not isinstance(storage_plan['mix'], dict):
+                    raise SpecError('storage_plan: should be a plan ID, "mix" or {"mix" : {constraints}}')
+                constraints = storage_plan['mix']
+
+            try:
+                mix = MixedPlanSolver(self.sizing).solve(self.cluster['total_initial_capacity'], **constraints)
+            except TypeError as e:
+                raise SpecError('storage_plan: invalid mix constraints: %s' % (e))
+
+            if mix is None:
+                raise SpecError('storage_plan: no mix of plans satisfies the constraints')
+
+            self.cluster['nodes'] = [ {"plan" : "id:%d" % (n['plan_id']), "count" : n['count']} for n in mix['nodes'] ]
+            return
+
+        plan_id = self._validate_plan('storage_plan', storage_plan)
+
+        sizing = self.sizing.evaluate(self.cluster['initial_capacity']['size_in_mb'], self.cluster['copies'])
+        count = int(sizing.node_count[0, 0, self.sizing.index_of[plan_id]])
+
+        self.cluster['nodes'] = [ {"plan" : "id:%d" % (plan_id), "count" : count} ]
+
+
+    def _forecast_growth(self, growth):
+
+        if not isinstance(growth, dict) or 'model' not in growth:
+            raise SpecError('growth: should be a dict with model, and optional max_utilization and horizon_months')
+
+        model = growth['model']
+        if not (isinstance(model, dict) or (isinstance(model, list) and model and all(isinstance(s, dict) for s in model))):
+            raise SpecError('growth.model: should be a growth segment dict or a list of them')
+
+        horizon_months = growth.get('horizon_months', 36)
+        if not isinstance(horizon_months, int) or isinstance(horizon_months, bool) or horizon_months < 1:
+            raise SpecError('growth.horizon_months: should be a positive integer')
+
+        max_utilization = growth.get('max_utilization', 0.8)
+        if not isinstance(max_utilization, (int, float)) or isinstance(max_utilization, bool) or not 0 < max_utilization <= 1:
+            raise SpecError('growth.max_utilization: should be a number greater than 0 and at most 1')
+
+        expansion_plan = growth.get('expansion_plan')
+        if expansion_plan is not None:
+            expansion_plan = self._validate_plan('growth.expansion_plan', expansion_plan)
+
+        # Specs with the same storage nodes and forecast settings share a forecaster, which
+        # only recomputes months from the first growth segment that differs.
+        try:
+            forecaster = self.growth_forecaster(expansion_plan, max_utilization, horizon_months)
+            forecast = forecaster.forecast(self.cluster['initial_capacity']['size_in_mb'], model)
+        except (ForecastError, TypeError, ValueError) as e:
+            raise SpecError('growth: %s' % (e))
+
+        self.cluster['growth'] = growth
+        self.cluster['forecast'] = forecast.rows(only_changes = True)
+
+
+    def _size_namespace(self, namespace):
+
+        if not isinstance(namespace, dict):
+            raise SpecError('namespace: should be a dict with file_count, avg_file_size and block_size')
+
+        file_count = self._validate('namespace.file_count', ValidatorUtils.validate_int,
+            namespace.get('file_count'), (1, 10**12))
+        avg_file_size = self._validate('namespace.avg_file_size', ValidatorUtils.validate_storage_size,
+            str(namespace.get('avg_file_size', '64 MB')), None)
+        block_size = self._validate('namespace.block_size', ValidatorUtils.validate_storage_size,
+            str(namespace.get('block_size', '128 MB')), None)
+
+        if avg_file_size['size_in_mb'] <= 0:
+            raise SpecError('namespace.avg_file_size: should be greater than 0')
+        if block_size['size_in_mb'] <= 0:
+            raise SpecError('namespace.block_size: should be greater than 0')
+
+        self.set_namespace_size(file_count, avg_file_size['size_in_mb'], block_size['size_in_mb'])
+
+
+    def _namenode_plan(self, field, plan_id, role):
+        '''
+        Validates a NameNode plan. If namespace size is known, the plan should be able to hold it,
+        and "auto" selects the cheapest plan that can.
+        '''
+        nn_sizing = self.namenode_sizing
+
+        if plan_id == 'auto':
+            if nn_sizing is None:
+                raise SpecError('%s: "auto" needs a namespace entry in the spec' % (field))
+
+            for p in self.catalog.by_price():
+                if nn_sizing.plan_fits(p, self.default_disk_plans[p['DISK']], role):
+                    return p['PLANID']
+
+            raise SpecError('%s: no plan can hold the namespace' % (field))
+
+        plan_id = self._validate_plan(field, plan_id)
+
+        if nn_sizing is not None:
+            p = self.catalog.by_id(plan_id)
+            if not nn_sizing.plan_fits(p, self.default_disk_plans[p['DISK']], role):
+                req = nn_sizing.requirements(role)
+                raise SpecError('%s: plan %d is too small for the namespace, which needs %d MB RAM and %d MB disk' %
+                    (field, plan_id, req['ram_mb'], req['disk_mb']))
+
+        return plan_id
+
+
+    def _size_namenodes(self, namenodes):
+
+        if not isinstance(namenodes, dict):
+            raise SpecError('namenodes: missing')
+
+        nn_type = namenodes.get('type')
+        if nn_type == 'single':
+            nn_plan = self._namenode_plan('namenodes.primary', namenodes.get('primary'), 'namenode')
+
+            secondary_nn_plan = namenodes.get('secondary')
+            if secondary_nn_plan is not None:
+                secondary_nn_plan = self._namenode_plan('namenodes.secondary', secondary_nn_plan, 'secondary')
+
+            self.set_single_nn(nn_plan, secondary_nn_plan)
+
+        elif nn_type == 'ha_qjm':
+            nn_plan = self._namenode_plan('namenodes.namenode_plan', namenodes.get('namenode_plan'), 'standby')
+            jn_count = self._validate('namenodes.journal_node_count', ValidatorUtils.validate_odd,
+                namenodes.get('journal_node_count', 3), (MIN_JN_COUNT, MAX_JN_COUNT))
+            jn_plan = self._validate_plan('namenodes.journal_node_plan', namenodes.get('journal_node_plan'))
+
+            self.set_nn_ha_qjm(nn_plan, jn_count, jn_plan)
+
+        else:
+            raise SpecError("namenodes.type: should be 'single' or 'ha_qjm'")
+
+
+    def _validate_plan(self, field, plan_id):
+        all_plan_ids = [ str(p['PLANID']) for p in self.plans ]
+        return int(self._validate(field, ValidatorUtils.validate_set, str(plan_id), all_plan_ids))
+
+
+    def _validate(self, field, validator, value, validator_args):
+        try:
+            ret = validator(value, validator_args)
+        except (TypeError, ValueError):
+            raise SpecError('%s: invalid value %r' % (field, value))
+
+        if not ret[0]:
+            raise SpecError('%s: %s' % (field, ret[2]))
+        return ret[1]
+
+
+
+def read_specs(stream, spec_format):
+    '''
+    Generator that yields specs from stream one at a time, so that files with thousands of specs
+    are never fully loaded into memory in 'jsonl' format.
+
+    Args:
+        stream - file like object.
+        spec_format - 'jsonl' for one JSON spec per line, 'json' for a JSON spec or list of specs,
+            or 'yaml' for YAML documents each containing a spec or list of specs.
+
+    Yields:
+        A spec dict, or a SpecError instance if a spec could not be parsed. A whole file that
+        can't be parsed yields a single SpecError.
+    '''
+    if spec_format == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line, object_pairs_hook = collections.OrderedDict)
+            except ValueError as e:
+                yield SpecError('Invalid JSON: %s' % (e))
+        return
+
+    if spec_format == 'json':
+        try:
+            docs = [ json.load(stream, object_pairs_hook = collections.OrderedDict) ]
+        except ValueError as e:
+            yield SpecError('Invalid JSON: %s' % (e))
+            return
+
+        for spec in _specs_of(docs):
+            yield spec
+
+    elif spec_format == 'yaml':
+        try:
+            import yaml
+        except ImportError:
+            yield SpecError('PyYAML is required for YAML specs')
+            return
+
+        # Documents are parsed as they are read, so an invalid one ends the stream after the
+        # specs of the documents before it.
+        try:
+            for spec in _specs_of(yaml.safe_load_all(stream)):
+                yield spec
+        except yaml.YAMLError as e:
+            yield SpecError('Invalid YAML: %s' % (e))
+
+    else:
+        yield SpecError('Unknown spec format %s' % (spec_format))
+
+
+
+def _specs_of(docs):
+    for doc in docs:
+        for spec in (doc if isinstance(doc, list) else [doc]):
+            yield spec
+
+
+
+def guess_format(filename):
+    if filename == '-' or filename.endswith('.jsonl') or filename.endswith('.ndjson'):
+        return 'jsonl'
+
+    if filename.endswith('.yaml') or filename.endswith('.yml'):
+        return 'yaml'
+
+    return 'json'
+
+
+
+def run(stream, spec_format, out, offline = False):
+    '''
+    Sizes every spec in stream and writes one JSON result line per spec to out.
+
+    Returns:
+        Number of specs that failed.
+    '''
+    sizer = HeadlessClusterSizer(offline = offline)
+
+    catalog_info = {
+        'version' : sizer.catalog.version,
+        'stale' : sizer.catalog.is_stale(),
+        'skipped_plans' : [p['PLANID'] for p in sizer.catalog.skipped_plans]
+    }
+
+    failures = 0
+    for index, spec in enumerate(read_specs(stream, spec_format)):
+        result = collections.OrderedDict()
+        result['index'] = index
+        if isinstance(spec, dict) and 'name' in spec:
+            result['name'] = spec['name']
+
+        try:
+            if isinstance(spec, SpecError):
+                raise spec
+
+            result['cluster'] = sizer.size(spec)
+            result['ok'] = True
+
+        except SpecError as e:
+            result['ok'] = False
+            result['error'] = str(e)
+            failures += 1
+
+        except Exception as e:
+            # A spec that slipped past validation shouldn't stop the rest of the batch.
+            result.pop('cluster', None)
+            result['ok'] = False
+            result['error'] = 'Could not size cluster: %s: %s' % (type(e).__name__, e)
+            failures += 1
+
+        result['plan_catalog'] = catalog_info
+        out.write(json.dumps(result) + '\n')
+
+    out.flush()
+    return failures
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Size HDFS clusters from cluster specs without prompts')
+    parser.add_argument('spec_file', help = "File with cluster specs, or '-' for stdin")
+    parser.add_argument('--format', choices = ['json', 'jsonl', 'yaml'],
+        help = 'Format of spec_file. Guessed from its extension by default, jsonl for stdin.')
+    parser.add_argument('--offline', action = 'store_true',
+        help = 'Use only the recorded plan snapshot or cached plans, without calling the Linode API')
+    args = parser.parse_args()
+
+    spec_format = args.format or guess_format(args.spec_file)
+
+    if args.spec_file == '-':
+        failures = run(sys.stdin, spec_format, sys.stdout, args.offline)
+    else:
+        with open(args.spec_file, 'r') as f:
+            failures = run(f, spec_format, sys.stdout, args.offline)
+
+    sys.exit(1 if failures else 0)
@@ -6,19 +6,26 @@ from __future__ import print_function
 
 import sys
 import re
-import math
-import os
-from os import path
-import simplejson as json
-import collections
+import argparse
 
 from linodecommon import logger
-from linodecommon import linode_api
-from terminaltables import AsciiTable, SingleTable
+
+# Modules for sizing, plan catalog and table rendering (and NumPy through them) are imported
+# only where they are used, so that the main menu appears without waiting for them.
+
+# Limits on number of additional copies of each file. Replication factor is copies + 1.
+MIN_COPIES = 0
+MAX_COPIES = 511 # https://hadoop.apache.org/docs/current/hadoop-project-dist/hadoop-hdfs/hdfs-default.xml
+
+# Limits on number of JournalNodes in a QJM HA setup.
+MIN_JN_COUNT = 3
+MAX_JN_COUNT = 19 # This is an arbitrary max limit, not an official one.
 
 class MainWizard(object):
     
-    def __init__(self):
+    def __init__(self, offline = False):
+        
+        self.offline = offline
         
         self.main_menu = Menu('HDFS Cluster Manager', actions = [
             {'selector' : '1', 'title' : 'Create new HDFS cluster', 'callback' : MainWizard.create_new_cluster},
@@ -34,7 +41,7 @@ class MainWizard(object):
         
         
     def create_new_cluster(self):
-        create_wizard = ClusterCreationWizard()
+        create_wizard = ClusterCreationWizard(offline = self.offline)
         create_wizard.start()
         
     
@@ -52,22 +59,13 @@ class MainWizard(object):
         
 class ClusterCreationWizard(object):
     
-    def __init__(self):
+    def __init__(self, offline = False):
+        '''
+        Args:
+            offline - if True, plans come only from the recorded snapshot or cache, and the Linode API is never called.
+        '''
         self.cluster = {}
         
-        # Get plan information either saved previously or directly from API.
-        # plan['DISK'] is in GB, plan['RAM'] is in MB, plan['HOURLY'] is the hourly rate,
-        # plan['PRICE'] is the monthly rate
-        # plan['XFER']is in GB
-        plan_info_file = 'plans.json'
-        if os.path.exists(plan_info_file):
-            with open(plan_info_file, 'r') as f:
-                self.plans = json.load(f, object_pairs_hook = collections.OrderedDict)
-        else:
-            self.plans = linode_api.get_plans()
-            with open(plan_info_file, 'w') as f:
-                json.dump(self.plans, f, indent=4 * ' ')
-        
         # Default disk allocations for each plan ID.
         # The list entries are boot, swap, hdfsdata - all in GB.
         # key is the DISK entry of each plan
@@ -82,6 +80,101 @@ class ClusterCreationWizard(object):
             1536 : [20,8,1508],
             1920 : [20,8,1892]
         }
+        
+        # Get plan information from the plan catalog cache. It's refreshed from API in background
+        # if it's stale, so startup doesn't wait on the API unless there's no usable cache at all.
+        # plan['DISK'] is in GB, plan['RAM'] is in MB, plan['HOURLY'] is the hourly rate,
+        # plan['PRICE'] is the monthly rate
+        # plan['XFER']is in GB
+        self.offline = offline
+        self._catalog = None
+        
+        self._sizing = None
+        
+        # Forecaster of the current storage nodes, kept between growth forecasts.
+        self._forecaster = None
+        
+        # Costs of measured performance of benchmarked clusters, if any. See cost_report.
+        self._measured_costs = None
+        
+        # Set once namespace size is known, to recommend NameNode plans.
+        self.namenode_sizing = None
+    
+    
+    @property
+    def catalog(self):
+        '''
+        The plan catalog, loaded the first time it's needed.
+        '''
+        if self._catalog is None:
+            from plan_catalog import PlanCatalog
+            
+            self._catalog = PlanCatalog('plans.json', snapshot_file = 'plans.snapshot.json',
+                offline = self.offline, disk_plans = self.default_disk_plans).load()
+                
+        return self._catalog
+        
+        
+    @property
+    def plans(self):
+        return self.catalog.plans
+        
+        
+    @property
+    def sizing(self):
+        '''
+        Sizing engine for the current plan catalog. Node counts and costs of every plan are computed
+        in one batched pass by the sizing engine. It's rebuilt if a background refresh changed the catalog.
+        '''
+        if self._sizing is None or self._sizing_version != self.catalog.version:
+            from plan_sizing import SizingEngine
+            from throughput_model import ThroughputModel
+            
+            self._sizing = SizingEngine(self.catalog.plans, self.default_disk_plans)
+            self._sizing_version = self.catalog.version
+            self._throughput = ThroughputModel(self._sizing)
+            
+        return self._sizing
+        
+        
+    @property
+    def throughput(self):
+        '''
+        Throughput model for the current plan catalog.
+        '''
+        self.sizing
+        return self._throughput
+        
+        
+    @property
+    def measured_costs(self):
+        '''
+        cost_report.CostReport of clusters benchmarked by hdfsperftests, or None if there are no
+        results of any configuration with plans in the catalog. Rebuilt if a background refresh
+        changed the catalog.
+        '''
+        if self._measured_costs is None or self._measured_costs_version != self.catalog.version:
+            from cost_report import CostReport
+            
+            self._measured_costs = CostReport(self.catalog).load()
+            self._measured_costs_version = self.catalog.version
+            
+        return self._measured_costs if self._measured_costs.configurations else None
+        
+        
+    def warn_if_stale_plans(self):
+        '''
+        Warns that costs may be out of date if plans couldn't be refreshed within the catalog's TTL,
+        and about plans that can't be offered because they have no default disk allocation.
+        '''
+        if self.catalog.is_stale():
+            logger.warn_msg('Plan prices were fetched %.1f hours ago and may be out of date.' % (self.catalog.age() / 3600.0))
+            if self.catalog.last_refresh_error is not None:
+                logger.warn_msg('Could not refresh plans: %s' % (self.catalog.last_refresh_error))
+                
+        for p in self.catalog.skipped_plans:
+            logger.warn_msg('Plan %s (%s) is not offered. It has no default disk allocation for its %d GB disk.' %
+                (p['PLANID'], p['LABEL'], p['DISK']))
     
     
     def start(self):
@@ -101,6 +194,12 @@ class ClusterCreationWizard(object):
         # Get plan for storage nodes.
         self.get_storage_plans()
         
+        # Optionally forecast node additions as data grows.
+        self.get_growth_forecast()
+        
+        # Estimate namespace size to recommend NameNode plans.
+        self.get_namespace_size()
+        
         # Get NameNode strategy.
         self.get_namenode_strategy()
         
@@ -116,29 +215,38 @@ class ClusterCreationWizard(object):
         storage_capacity = InputUtils.get(
             'How much storage capacity do you want to start with ' + 
             ' (not including copies)? [default=%s] : ' % (storage_capacity), 
-            ValidatorUtils.validate_storage_size, None, storage_capacity)
+            ValidatorUtils.validate_positive_storage_size, None, storage_capacity)
             
-        self.cluster['initial_capacity'] = storage_capacity[1]
-        
         # Get replication factor. number of copies = Replication factor - 1
         copies = 2
-        min_copies = 0
-        max_copies = 511 # https://hadoop.apache.org/docs/current/hadoop-project-dist/hadoop-hdfs/hdfs-default.xml
         copies = InputUtils.get(
             'How many additional copies of each file should be stored? [%d-%d, default=%d] : ' 
-            % (min_copies, max_copies, copies), 
-            ValidatorUtils.validate_int, (min_copies, max_copies), copies)
+            % (MIN_COPIES, MAX_COPIES, copies), 
+            ValidatorUtils.validate_int, (MIN_COPIES, MAX_COPIES), copies)
             
-        self.cluster['copies'] = copies[1]
+        self.set_cluster_capacity(storage_capacity[1], copies[1])
+        
+        logger.warn_msg('Total Storage capacity: ' + self.cluster['total_initial_capacity_display'])
+        
+        
+        
+    def set_cluster_capacity(self, capacity_info, copies):
+        '''
+        Saves initial capacity and copies to cluster, along with the total capacity including copies.
+        
+        Args:
+            capacity_info - conversion info dict returned by ValidatorUtils.validate_storage_size()
+            copies - number of additional copies of each file
+        '''
+        self.cluster['initial_capacity'] = capacity_info
+        self.cluster['copies'] = copies
         
         # Calculate total storage capacity = initial_capacity * (copies+1)
-        total_capacity_mb = storage_capacity[1]['size_in_mb'] * (copies[1] + 1)
+        total_capacity_mb = capacity_info['size_in_mb'] * (copies + 1)
         total_capacity_str = Utils.mb_to_units(total_capacity_mb)
         self.cluster['total_initial_capacity'] = total_capacity_mb
         self.cluster['total_initial_capacity_display'] = total_capacity_str
         
-        logger.warn_msg('Total Storage capacity: ' + total_capacity_str)
-        
         
         
     def get_storage_plans(self):
@@ -151,92 +259,335 @@ class ClusterCreationWizard(object):
         # allocation. Once user selects the plans, ask if disk allocation 
         # should be changed, and if so, update costs with new allocation.
         
+        self.warn_if_stale_plans()
+        
         table_data = [
             ['ID','Plan','Storage/node\nGB *','Nodes','$/node', '$/month','$/hour',
-             'Cores', 'RAM(GB)', 'Excess\nStorage GB','Free Outgoing\nTB/month']
+             'Cores', 'RAM(GB)', 'Excess\nStorage GB','Free Outgoing\nTB/month',
+             'Write\nMB/s **', 'Read\nMB/s **', 'Re-replicate\nhours ***']
         ]
+        sizing = self.sizing.evaluate(self.cluster['initial_capacity']['size_in_mb'], self.cluster['copies'])
+        perf = self.throughput.evaluate(sizing)
+        
+        measured = self.measured_costs
+        if measured is not None:
+            from cost_report import COST_COLUMNS
+            
+            table_data[0] += ['Measured\nnodes ****'] + [title for column, key, title, fmt in COST_COLUMNS]
+        
         all_plan_ids = []
         plan_info = {}
-        for p in self.plans[-1::-1]:
-            plan_id = p['PLANID']
+        rows = sizing.rows()
+        for i in range(len(rows) - 1, -1, -1):
+            row = rows[i]
+            plan_id = row['plan_id']
             all_plan_ids.append(str(plan_id))
             
-            plan_storage_gb = p['DISK']
-            
-            disk_plan = self.default_disk_plans[plan_storage_gb]
-            
-            usable_storage = disk_plan[2] * 1024 # GB to MBs
-            
-            node_count = int( math.ceil( self.cluster['total_initial_capacity'] / float(usable_storage) ) )
-            
-            total_monthly_cost = node_count * p['PRICE']
-            total_hourly_cost = node_count * p['HOURLY']
-            
-            storage = '{:d} ({:s})'.format(p['DISK'], '+'.join( str(d) for d in disk_plan ))
-            
-            cores = p['CORES']
-            ram = p['RAM'] / 1024
-            
-            # Excess storage says by how much the total usable storage of all nodes exceeds the requested storage capacity.
-            # At max, it'll be around the usable storage of 1 node.
-            excess_storage = (node_count * usable_storage - self.cluster['total_initial_capacity']) / (1024)
+            storage = '{:d} ({:s})'.format(row['disk_gb'], '+'.join( str(d) for d in row['disk_plan'] ))
             
             plan_info[plan_id] = {
-                'plan_name' : p['LABEL'],
-                'count' : node_count,
-                'total_monthly_cost' : total_monthly_cost,
-                'total_hourly_cost' : total_hourly_cost
+                'plan_name' : row['plan_name'],
+                'count' : row['count'],
+                'total_monthly_cost' : row['total_monthly_cost'],
+                'total_hourly_cost' : row['total_hourly_cost']
             }
             
             table_data.append( [
-                p['PLANID'], 
-                p['LABEL'], 
+                plan_id, 
+                row['plan_name'], 
                 storage, 
-                node_count, 
-                p['PRICE'],
-                '{:,.2f}'.format(total_monthly_cost), 
-                '{:,.2f}'.format(total_hourly_cost),
-                '{:,d}'.format(cores),
-                '{:,d}'.format(ram),
-                '{:,d}'.format(excess_storage),
-                '{:,d}'.format(node_count * p['XFER']/1024)
+                row['count'], 
+                row['monthly_cost'],
+                '{:,.2f}'.format(row['total_monthly_cost']), 
+                '{:,.2f}'.format(row['total_hourly_cost']),
+                '{:,d}'.format(row['cores']),
+                '{:,d}'.format(row['ram_gb']),
+                '{:,d}'.format(row['excess_storage_gb']),
+                '{:,d}'.format(row['total_egress_tb']),
+                '{:,.0f}'.format(perf['write_mbps'][0, 0, i]),
+                '{:,.0f}'.format(perf['read_mbps'][0, 0, i]),
+                '{:,.2f}'.format(perf['re_replication_hours'][0, 0, i]) if self.cluster['copies'] > 0 and row['count'] > 1 else '-'
             ])
+            
+            if measured is not None:
+                table_data[-1] += self.measured_cost_cells(measured.for_plan(plan_id, row['count'], self.cluster['copies'] + 1))
 
-        table = SingleTable(table_data)
-        print(table.table)
+        Utils.print_table(table_data)
         print('*Storage: Total storage available and its allocation (Boot + Swap + HDFS storage)')
-        
-        # TODO It's possible to allow mixed plans input here by asking for plan + count
-        # multiple times, and calculating remaining capacity at each step.
+        print('**Write/Read: Estimated aggregate client throughput through the replication pipeline, limited by network and disk')
+        print('***Re-replicate: Estimated time to restore all copies after losing one node of a full cluster')
+        if measured is not None:
+            print('****Measured: Costs of benchmarked throughput and storage of the benchmarked cluster of this plan ' + 
+                'closest to the number of nodes, with current prices. See cost_report.py')
         
         selection_confirmed = False
         while not selection_confirmed:
             ret = InputUtils.get(
-                '\nSelect a plan and type its ID: ', 
-                ValidatorUtils.validate_set, all_plan_ids, None)
+                "\nSelect a plan and type its ID, or type 'm' to get the cheapest mix of plans: ", 
+                ValidatorUtils.validate_set, all_plan_ids + ['m'], None)
                 
-            storage_plan_id = int(ret[1])
+            if ret[1] == 'm':
+                mix = self.get_mixed_storage_plan()
+                if mix is None:
+                    continue
+                    
+                selected_nodes = [ {"plan" : "id:%d" % (n['plan_id']), "count" : n['count']} for n in mix['nodes'] ]
+                summary = ', '.join('{:d} {:s}'.format(n['count'], n['plan_name']) for n in mix['nodes'])
+                total_monthly_cost = mix['total_monthly_cost']
+                total_hourly_cost = mix['total_hourly_cost']
+                
+            else:
+                storage_plan_id = int(ret[1])
+                selected_nodes = [ {"plan" : "id:%d" % (storage_plan_id), "count" : plan_info[storage_plan_id]['count']} ]
+                summary = '{:d} {:s}'.format(plan_info[storage_plan_id]['count'], plan_info[storage_plan_id]['plan_name'])
+                total_monthly_cost = plan_info[storage_plan_id]['total_monthly_cost']
+                total_hourly_cost = plan_info[storage_plan_id]['total_hourly_cost']
 
             ret = InputUtils.get(
-                ('\nThe cluster will have {:d} {:s} storage nodes.\n' + 
+                ('\nThe cluster will have {:s} storage nodes.\n' + 
                 'Total monthly cost: ${:,.2f}. Total hourly cost: ${:,.2f}. Continue with this selection? (y/n) (default=y): ').format(
-                    plan_info[storage_plan_id]['count'],
-                    plan_info[storage_plan_id]['plan_name'],
-                    plan_info[storage_plan_id]['total_monthly_cost'],
-                    plan_info[storage_plan_id]['total_hourly_cost']
-                ),
+                    summary, total_monthly_cost, total_hourly_cost),
                 ValidatorUtils.validate_yesno, None, 'y')
                 
             selection_confirmed = ret[1]
         
         
-        # Save the selected node plan.
-        self.cluster['nodes'] = [
-              {
-                "plan" : "id:%d" % (storage_plan_id),
-                "count" : plan_info[storage_plan_id]
-              }
-            ]
+        # Save the selected node plans.
+        self.cluster['nodes'] = selected_nodes
+        
+        
+    def measured_cost_cells(self, configuration):
+        '''
+        Returns table cells of a cost_report configuration for the storage plans table, or
+        '-' cells if there's none.
+        '''
+        if configuration is None:
+            return ['-'] * 5
+            
+        from cost_report import COST_COLUMNS
+        
+        cells = ['{:d}'.format(configuration['workers'])]
+        for column, key, title, fmt in COST_COLUMNS:
+            cells.append(fmt.format(configuration[key]) if configuration[key] is not None else '-')
+        return cells
+        
+        
+    def get_mixed_storage_plan(self):
+        '''
+        Asks for optional constraints and finds the cheapest mix of plans that can store
+        the total initial capacity.
+        
+        Returns:
+            The solution dict returned by MixedPlanSolver.solve(), or None if no mix satisfies the constraints.
+        '''
+        constraints = {}
+        
+        ret = InputUtils.get(
+            '\nDo you want to constrain node count, cores, RAM or budget of the mix? (y/n, default n): ',
+            ValidatorUtils.validate_yesno, None, 'n')
+            
+        if ret[1]:
+            # 0 means no constraint for all of these.
+            max_int = 10000
+            ret = InputUtils.get('Minimum number of storage nodes [0-%d, default=0] : ' % (max_int),
+                ValidatorUtils.validate_int, (0, max_int), 0)
+            constraints['min_nodes'] = ret[1] or None
+            
+            ret = InputUtils.get('Maximum number of storage nodes [0-%d, default=0 for no limit] : ' % (max_int),
+                ValidatorUtils.validate_int, (0, max_int), 0)
+            constraints['max_nodes'] = ret[1] or None
+            
+            ret = InputUtils.get('Minimum cores per TB of total storage [default=0] : ',
+                ValidatorUtils.validate_float, (0, max_int), 0)
+            constraints['min_cores_per_tb'] = ret[1] or None
+            
+            ret = InputUtils.get('Minimum RAM in GB per TB of total storage [default=0] : ',
+                ValidatorUtils.validate_float, (0, max_int * 1024), 0)
+            constraints['min_ram_gb_per_tb'] = ret[1] or None
+            
+            ret = InputUtils.get('Maximum total monthly cost in $ [default=0 for no limit] : ',
+                ValidatorUtils.validate_float, (0, float('inf')), 0)
+            constraints['max_monthly_cost'] = ret[1] or None
+            
+        from plan_solver import MixedPlanSolver
+        
+        mix = MixedPlanSolver(self.sizing).solve(self.cluster['total_initial_capacity'], **constraints)
+        if mix is None:
+            logger.error_msg('No mix of plans satisfies these constraints.')
+            return None
+            
+        table_data = [ ['ID','Plan','Nodes','$/month','$/hour'] ]
+        for n in mix['nodes']:
+            p = self.catalog.by_id(n['plan_id'])
+            table_data.append([
+                n['plan_id'],
+                n['plan_name'],
+                n['count'],
+                '{:,.2f}'.format(n['count'] * p['PRICE']),
+                '{:,.2f}'.format(n['count'] * p['HOURLY'])
+            ])
+        table_data.append([ '', 'Total', mix['count'], 
+            '{:,.2f}'.format(mix['total_monthly_cost']), '{:,.2f}'.format(mix['total_hourly_cost']) ])
+        
+        Utils.print_table(table_data)
+        print('Usable storage: {:s}, Cores: {:d}, RAM: {:d} GB'.format(
+            Utils.mb_to_units(mix['total_usable_mb']), mix['total_cores'], mix['total_ram_gb']))
+        
+        return mix
+        
+        
+    def growth_forecaster(self, expansion_plan_id = None, max_utilization = 0.8, horizon_months = 36):
+        '''
+        Returns a capacity_forecast.CapacityForecaster for the current storage nodes and copies.
+        The same forecaster is returned until any of them or the arguments change, so that
+        forecasts of different growth reuse months that didn't change.
+        
+        Raises:
+            capacity_forecast.ForecastError if the nodes can't be forecast.
+        '''
+        from capacity_forecast import CapacityForecaster
+        
+        key = (self.sizing, self.cluster['copies'], tuple((n['plan'], n['count']) for n in self.cluster['nodes']),
+            expansion_plan_id, max_utilization, horizon_months)
+        if self._forecaster is None or self._forecaster_key != key:
+            self._forecaster = CapacityForecaster(self.sizing, self.cluster['copies'], self.cluster['nodes'],
+                expansion_plan_id = expansion_plan_id, max_utilization = max_utilization,
+                horizon_months = horizon_months)
+            self._forecaster_key = key
+            
+        return self._forecaster
+        
+        
+    def get_growth_forecast(self):
+        '''
+        Asks for a growth model and shows a month by month forecast of node additions,
+        utilization and cost for the selected storage nodes.
+        '''
+        ret = InputUtils.get(
+            '\nDo you want a forecast of node additions and cost as data grows? (y/n, default n): ',
+            ValidatorUtils.validate_yesno, None, 'n')
+        if not ret[1]:
+            return
+            
+        from capacity_forecast import ForecastError
+        
+        # Growth parameters can be changed and the forecast shown again. The forecaster is kept,
+        # so only months from the first changed growth segment are recomputed.
+        try_again = True
+        while try_again:
+            ret = InputUtils.get('Growth model - linear, compound or series (of past monthly sizes)? [default=linear] : ',
+                ValidatorUtils.validate_set, ['linear', 'compound', 'series'], 'linear')
+            model = ret[1]
+            
+            if model == 'linear':
+                ret = InputUtils.get('How much data is added every month (not including copies)? [default=100 GB] : ',
+                    ValidatorUtils.validate_storage_size, None, '100 GB')
+                growth = {'model' : 'linear', 'monthly_increase_mb' : ret[1]['size_in_mb']}
+                
+            elif model == 'compound':
+                ret = InputUtils.get('By what percentage does data grow every month? [default=5] : ',
+                    ValidatorUtils.validate_float, (-99, 1000), 5)
+                growth = {'model' : 'compound', 'monthly_rate' : ret[1] / 100.0}
+                
+            else:
+                ret = InputUtils.get('Enter past monthly data sizes, oldest first, separated by commas (like 400GB, 450GB, 520GB) : ',
+                    ValidatorUtils.validate_storage_sizes, None, None)
+                growth = {'model' : 'series', 'history_mb' : ret[1], 'fit' : 'compound' if min(ret[1]) > 0 else 'linear'}
+                
+            ret = InputUtils.get('How many months should be forecast? [1-120, default=36] : ',
+                ValidatorUtils.validate_int, (1, 120), 36)
+            horizon_months = ret[1]
+            
+            ret = InputUtils.get('Add nodes when storage utilization exceeds what percentage? [1-100, default=80] : ',
+                ValidatorUtils.validate_int, (1, 100), 80)
+            max_utilization = ret[1] / 100.0
+            
+            try:
+                forecaster = self.growth_forecaster(max_utilization = max_utilization, horizon_months = horizon_months)
+                forecast = forecaster.forecast(self.cluster['initial_capacity']['size_in_mb'], growth)
+                
+            except ForecastError as e:
+                logger.error_msg(str(e))
+                forecast = None
+                
+            if forecast is not None:
+                self.show_growth_forecast(forecast, forecaster.expansion_plan_id)
+                self.cluster['growth'] = {
+                    'model' : growth,
+                    'horizon_months' : horizon_months,
+                    'max_utilization' : max_utilization
+                }
+                
+            ret = InputUtils.get('Do you want to try other growth parameters? (y/n, default n): ',
+                ValidatorUtils.validate_yesno, None, 'n')
+            try_again = ret[1]
+            
+            
+    def show_growth_forecast(self, forecast, expansion_plan_id):
+        '''
+        Prints the months of a capacity_forecast.Forecast in which nodes are added.
+        '''
+        table_data = [
+            ['Month', 'Data', 'Total storage\nwith copies', 'Nodes', 'Nodes\nadded', 'Utilization %', '$/month', 'Total $']
+        ]
+        for row in forecast.rows(only_changes = True):
+            table_data.append([
+                row['month'],
+                Utils.mb_to_units(row['data_mb']),
+                Utils.mb_to_units(row['total_mb']),
+                row['node_count'],
+                row['nodes_added'],
+                '{:.1f}'.format(row['utilization'] * 100),
+                '{:,.2f}'.format(row['monthly_cost']),
+                '{:,.2f}'.format(row['cumulative_cost'])
+            ])
+            
+        Utils.print_table(table_data)
+        print('Only months in which nodes are added are shown. Added nodes are of plan %d.' % (expansion_plan_id))
+        
+        
+    def get_namespace_size(self):
+        '''
+        Asks for expected number and size of files, and estimates NameNode heap, RAM and disk
+        needed to hold the namespace.
+        '''
+        ret = InputUtils.get(
+            '\nDo you want NameNode plans recommended based on expected number of files? (y/n, default y): ',
+            ValidatorUtils.validate_yesno, None, 'y')
+        if not ret[1]:
+            return
+            
+        ret = InputUtils.get('How many files do you expect to store? [default=1000000] : ',
+            ValidatorUtils.validate_int, (1, 10**12), 1000000)
+        file_count = ret[1]
+        
+        ret = InputUtils.get('What is the average file size? [default=64 MB] : ',
+            ValidatorUtils.validate_positive_storage_size, None, '64 MB')
+        avg_file_size_mb = ret[1]['size_in_mb']
+        
+        ret = InputUtils.get('What is the HDFS block size? [default=128 MB] : ',
+            ValidatorUtils.validate_positive_storage_size, None, '128 MB')
+        block_size_mb = ret[1]['size_in_mb']
+        
+        self.set_namespace_size(file_count, avg_file_size_mb, block_size_mb)
+        
+        estimate = self.namenode_sizing.estimate
+        logger.msg('Estimated {:,d} inodes, {:,d} blocks, {:,d} MB fsimage. NameNode heap: {:,d} MB including {:,d} MB GC headroom.'.format(
+            estimate['inode_count'], estimate['block_count'], estimate['fsimage_mb'], estimate['heap_mb'], estimate['gc_headroom_mb']))
+        
+        
+    def set_namespace_size(self, file_count, avg_file_size_mb, block_size_mb):
+        
+        from namenode_sizing import NamenodeSizing
+        
+        self.namenode_sizing = NamenodeSizing(file_count, avg_file_size_mb, block_size_mb, self.cluster['copies'] + 1)
+        
+        self.cluster['namespace'] = {
+            'file_count' : file_count,
+            'avg_file_size_mb' : avg_file_size_mb,
+            'block_size_mb' : block_size_mb,
+            'estimate' : self.namenode_sizing.estimate
+        }
         
         
     def get_namenode_strategy(self):
@@ -273,7 +624,7 @@ class ClusterCreationWizard(object):
         # Select plan for namenode
         # Deploy secondary namenode? If yes, select plan for secondary NN
         
-        nn_plan = self.select_plan('\nSelect a plan for the NameNode and type its ID: ')
+        nn_plan = self.select_plan('\nSelect a plan for the NameNode and type its ID: ', 'namenode')
         
         ret = InputUtils.get(
                 ('\nDeploy a secondary NameNode? Its purpose is to take transaction log updation load off the primary NameNode.\n' +
@@ -283,8 +634,13 @@ class ClusterCreationWizard(object):
         deploy_secondary_nn = ret[1]
         secondary_nn_plan = None
         if deploy_secondary_nn:
-            secondary_nn_plan = self.select_plan('\nSelect a plan for the Secondary NameNode and type its ID: ')
+            secondary_nn_plan = self.select_plan('\nSelect a plan for the Secondary NameNode and type its ID: ', 'secondary')
             
+        self.set_single_nn(nn_plan, secondary_nn_plan)
+        
+        
+    def set_single_nn(self, nn_plan, secondary_nn_plan):
+        
         self.cluster['namenodes'] = {
             'type' : 'single',
             'details' : {
@@ -301,23 +657,36 @@ class ClusterCreationWizard(object):
         # Plan for Journal Nodes
         # Create a new Zookeeper cluster? or select an existing one? or deploy on same nodes as journal nodes?
         nn_plan = self.select_plan('\nSelect a plan for the Active and Standby NameNodes.\n' + 
-            'For filesystem with large number of small files, select a high RAM server. Now type the selected plan ID: ')
+            'For filesystem with large number of small files, select a high RAM server. Now type the selected plan ID: ', 'standby')
         
-        min_jn_count = 3
-        max_jn_count = 19 # This is an arbitrary max limit, not an official one.
         jn_count = 3
         jn_count = InputUtils.get(
             '\nSelect number of Journal nodes. There should be an ODD number of journal nodes. \n' + 
             'Since only the two NameNodes talk to Journal nodes, there need not be many of them, just enough to ensure reliability. \n' + 
             'With N JournalNodes, the cluster can function normally with upto (N - 1)/2 journal node failures. [%d-%d, default=%d] : ' 
-            % (min_jn_count, max_jn_count, jn_count), 
-            ValidatorUtils.validate_odd, (min_jn_count, max_jn_count), jn_count)
+            % (MIN_JN_COUNT, MAX_JN_COUNT, jn_count), 
+            ValidatorUtils.validate_odd, (MIN_JN_COUNT, MAX_JN_COUNT), jn_count)
             
         jn_count = jn_count[1]
         
         jn_plan = self.select_plan('\nSelect a plan for the Journal nodes, and type its ID:')
         
-        pass
+        self.set_nn_ha_qjm(nn_plan, jn_count, jn_plan)
+        
+        
+    def set_nn_ha_qjm(self, nn_plan, jn_count, jn_plan):
+        
+        self.cluster['namenodes'] = {
+            'type' : 'ha_qjm',
+            'details' : {
+                'active' : nn_plan,
+                'standby' : nn_plan,
+                'journal_nodes' : {
+                    'count' : jn_count,
+                    'plan' : jn_plan
+                }
+            }
+        }
 
 
 
@@ -327,48 +696,70 @@ class ClusterCreationWizard(object):
         
         
         
-    def select_plan(self, prompt):
+    def select_plan(self, prompt, namenode_role = None):
+        '''
+        Shows all plans and gets user's selection.
+        
+        Args:
+            prompt - prompt to show for selection.
+            namenode_role - if the plan is for a NameNode and the namespace size has been estimated,
+                one of the roles accepted by NamenodeSizing.requirements(). Only plans that can hold the
+                namespace are then accepted, if there are any.
+                
+        Returns:
+            Selected plan ID.
+        '''
+        self.warn_if_stale_plans()
+        
+        nn_sizing = self.namenode_sizing if namenode_role is not None else None
         
         table_data = [
             ['ID','Plan','Storage/node\nGB *','Cores','RAM(GB)','$/month','$/hour',
              'Free Outgoing\nTB/month']
         ]
+        if nn_sizing is not None:
+            table_data[0].append('Fits\nnamespace')
+            
         all_plan_ids = []
-        plan_info = {}
-        for p in self.plans[-1::-1]:
-            plan_id = p['PLANID']
+        fitting_plan_ids = []
+        for row in self.sizing.per_node()[-1::-1]:
+            plan_id = row['plan_id']
             all_plan_ids.append(str(plan_id))
             
-            plan_storage_gb = p['DISK']
-            
-            disk_plan = self.default_disk_plans[plan_storage_gb]
-            
-            usable_storage = disk_plan[2] * 1024 # GB to MBs
-            
-            monthly_cost = p['PRICE']
-            hourly_cost = p['HOURLY']
-            
-            storage = '{:d} ({:s})'.format(p['DISK'], '+'.join( str(d) for d in disk_plan ))
-            
-            cores = p['CORES']
-            ram = p['RAM'] / 1024
+            storage = '{:d} ({:s})'.format(row['disk_gb'], '+'.join( str(d) for d in row['disk_plan'] ))
             
             table_data.append( [
-                p['PLANID'], 
-                p['LABEL'], 
+                plan_id, 
+                row['plan_name'], 
                 storage, 
-                '{:,d}'.format(cores),
-                '{:,d}'.format(ram),
-                '{:,.2f}'.format(monthly_cost), 
-                '{:,.2f}'.format(hourly_cost),
-                '{:,d}'.format(p['XFER']/1024)
+                '{:,d}'.format(row['cores']),
+                '{:,d}'.format(row['ram_gb']),
+                '{:,.2f}'.format(row['monthly_cost']), 
+                '{:,.2f}'.format(row['hourly_cost']),
+                '{:,d}'.format(row['egress_tb'])
             ])
+            
+            if nn_sizing is not None:
+                fits = nn_sizing.plan_fits(self.catalog.by_id(plan_id), row['disk_plan'], namenode_role)
+                table_data[-1].append('yes' if fits else 'no')
+                if fits:
+                    fitting_plan_ids.append(str(plan_id))
 
-        table = SingleTable(table_data)
-        print(table.table)
+        Utils.print_table(table_data)
         print('*Storage: Total storage available and its allocation (Boot + Swap + HDFS storage)')
         
-        ret = InputUtils.get(prompt, ValidatorUtils.validate_set, all_plan_ids, None)
+        valid_plan_ids = all_plan_ids
+        if nn_sizing is not None:
+            req = nn_sizing.requirements(namenode_role)
+            logger.msg('The namespace needs about {:,d} MB of NameNode heap ({:s}), {:,d} MB RAM and {:,d} MB of disk for checkpoints.'.format(
+                nn_sizing.estimate['heap_mb'], nn_sizing.heap_setting(), req['ram_mb'], req['disk_mb']))
+                
+            if fitting_plan_ids:
+                valid_plan_ids = fitting_plan_ids
+            else:
+                logger.warn_msg('No plan can hold the namespace with margin. Consider NameNode Federation or larger block sizes.')
+        
+        ret = InputUtils.get(prompt, ValidatorUtils.validate_set, valid_plan_ids, None)
         
         selected_plan = int(ret[1])
         
@@ -537,6 +928,50 @@ class ValidatorUtils(object):
             
         return ret
 
+    @staticmethod
+    def validate_positive_storage_size(size, args):
+        '''
+        Like validate_storage_size(), but a size of 0 MB is invalid.
+        '''
+        ret = ValidatorUtils.validate_storage_size(size, args)
+        if ret[0] and ret[1]['size_in_mb'] <= 0:
+            ret[0] = False
+            ret[2] = 'Size should be greater than 0 MB'
+            
+        return ret
+
+    @staticmethod
+    def validate_storage_sizes(sizes, args):
+        '''
+        Converts a comma separated list of human readable disk sizes like "400GB, 1.2 TB" to a list
+        of numerical sizes in MB.
+        
+        Args:
+            - sizes : comma separated sizes, each in a format accepted by validate_storage_size()
+            - args: ignored
+                
+        Returns:
+            Tuple of ( is_valid:boolean, sizes_in_mb:list, error) where is_valid indicates validity
+            , sizes_in_mb is the list of sizes in MB,
+            and error is an error string if is_valid is False
+        '''
+        ret = [False, [], None]
+        
+        for size in sizes.split(','):
+            size_ret = ValidatorUtils.validate_storage_size(size.strip(), None)
+            if not size_ret[0]:
+                ret[2] = size_ret[2]
+                return ret
+            ret[1].append(size_ret[1]['size_in_mb'])
+            
+        if len(ret[1]) < 2:
+            ret[2] = 'Enter at least 2 sizes'
+            return ret
+            
+        ret[0] = True
+        return ret
+        
+        
     @staticmethod
     def validate_int(value, args):
         '''
@@ -567,11 +1002,48 @@ class ValidatorUtils(object):
             
         else:
             if value < min_value or value > max_value:
+                ret[0] = False
                 ret[2] = 'Invalid value. Should be an integer in range [%d, %d]' % (min_value, max_value)
         
         return ret
 
 
+    @staticmethod
+    def validate_float(value, args):
+        '''
+        Validates that value is a number in a given range.
+        
+        Args:
+           value - the value to validate.
+           args - tuple (min_value, max_value) of valid range for value
+
+        Returns:
+            Tuple of ( is_valid:boolean, value:float, error) where is_valid indicates validity
+            , value is the input value as a float,
+            and error is an error string if is_valid is False
+        '''
+        
+        min_value = args[0]
+        max_value = args[1]
+        
+        ret = [False, value, None]
+        
+        try:
+            value = float(value)
+            ret[1] = value
+            ret[0] = True
+            
+        except ValueError:
+            ret[2] = 'Invalid value. Should be a number in range [%s, %s]' % (min_value, max_value)
+            
+        else:
+            if value < min_value or value > max_value:
+                ret[0] = False
+                ret[2] = 'Invalid value. Should be a number in range [%s, %s]' % (min_value, max_value)
+        
+        return ret
+
+
     @staticmethod
     def validate_odd(value, args):
         '''
@@ -602,9 +1074,11 @@ class ValidatorUtils(object):
             
         else:
             if value < min_value or value > max_value:
+                ret[0] = False
                 ret[2] = 'Invalid value. Should be an odd integer in range [%d, %d]' % (min_value, max_value)
                 
             elif value % 2 == 0:
+                ret[0] = False
                 ret[2] = 'Invalid value. Should be an odd integer in range [%d, %d]' % (min_value, max_value)
                 
         return ret
@@ -667,6 +1141,17 @@ class ValidatorUtils(object):
         
 class Utils(object):
     
+    @staticmethod
+    def print_table(table_data):
+        '''
+        Prints a list of rows, the first being the header, as a table.
+        '''
+        from terminaltables import SingleTable
+        
+        table = SingleTable(table_data)
+        print(table.table)
+        
+    
     @staticmethod
     def mb_to_units(mbs):
         
@@ -691,7 +1176,21 @@ class Utils(object):
             
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description = 'HDFS cluster creation wizard')
+    parser.add_argument('--offline', action = 'store_true',
+        help = 'Use only the recorded plan snapshot (plans.snapshot.json) or cached plans, without calling the Linode API')
+    parser.add_argument('--record-snapshot', action = 'store_true',
+        help = 'Refresh plans from the Linode API, unless --offline, and record them to plans.snapshot.json for offline use')
+    args = parser.parse_args()
     
-    wizard = MainWizard()
+    if args.record_snapshot:
+        catalog = ClusterCreationWizard(offline = args.offline).catalog
+        if not args.offline:
+            catalog.refresh(block = True)
+        catalog.record_snapshot('plans.snapshot.json')
+        logger.success_msg('Recorded %d plans from %s to plans.snapshot.json' % (len(catalog.plans), catalog.source))
+        sys.exit(0)
+        
+    wizard = MainWizard(offline = args.offline)
     wizard.start()
     
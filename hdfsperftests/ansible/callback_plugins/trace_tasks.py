@@ -0,0 +1,67 @@
+# Ansible callback plugin that times every task on every host, for tracing.py.
+#
+# Playbooks in this directory load it automatically. It does nothing unless the
+# HDFSPERF_TRACE_FILE environment variable is set, in which case it appends a JSON line
+# per task and host to that file, with the task's name, start and end time, and status.
+# ansible_batch.AnsibleBatchProvisioner sets the variable and turns the lines into spans.
+#
+# Tasks of the default linear strategy start on all hosts together, so a task's start
+# time is taken as its start time on every host.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import json
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'trace_tasks'
+    CALLBACK_NEEDS_WHITELIST = False
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.trace_file = os.environ.get('HDFSPERF_TRACE_FILE')
+        self.playbook = None
+        self.task = None
+        self.task_start = None
+
+    def v2_playbook_on_start(self, playbook):
+        self.playbook = os.path.basename(playbook._file_name)
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self.task = task.get_name().strip()
+        self.task_start = time.time()
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self.v2_playbook_on_task_start(task, False)
+
+    def v2_runner_on_ok(self, result):
+        self._record(result, 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors = False):
+        self._record(result, 'ignored' if ignore_errors else 'failed')
+
+    def v2_runner_on_unreachable(self, result):
+        self._record(result, 'unreachable')
+
+    def _record(self, result, status):
+        if not self.trace_file or self.task_start is None:
+            return
+
+        line = json.dumps({
+            'host' : result._host.get_name(),
+            'playbook' : self.playbook,
+            'task' : self.task,
+            'start' : self.task_start,
+            'end' : time.time(),
+            'status' : status
+        })
+        with open(self.trace_file, 'a') as f:
+            f.write(line + '\n')
@@ -0,0 +1,201 @@
+'''
+Runs a playbook once for many hosts, instead of once per host.
+
+AnsibleProvisioner.exec_playbook runs ansible-playbook separately for every host, so
+every run pays for Ansible startup, inventory parsing, SSH connection setup and fact
+gathering. AnsibleBatchProvisioner writes one inventory for all hosts of a provisioning
+phase, with per host variables in host_vars files, and runs the playbook once with
+enough forks to cover all of them. SSH connections are reused between phases, and
+facts are cached, so later phases don't gather them again.
+
+Results are read from the PLAY RECAP, so each host's success or failure is known even
+though they share one run. Every run is traced with tracing.py, along with the time of
+each of its tasks on each host, as timed by ansible/callback_plugins/trace_tasks.py.
+'''
+
+from __future__ import print_function
+
+import os
+import os.path
+import re
+import subprocess
+import collections
+
+import simplejson as json
+
+import tracing
+
+
+# Matches a PLAY RECAP line like
+#   hdpworker-1.cluster  : ok=12   changed=3    unreachable=0    failed=0
+RECAP_LINE = re.compile(r'^(?P<host>\S+)\s+:\s+(?P<counts>(?:\w+=\d+\s*)+)$')
+
+
+class AnsibleBatchProvisioner(object):
+
+    def __init__(self, work_dir, forks = 20, remote_user = 'root', private_key_file = None,
+            ansible_playbook = 'ansible-playbook'):
+        '''
+        Args:
+            work_dir - directory for generated inventories, fact cache and SSH control sockets.
+            forks - maximum number of hosts Ansible works on in parallel.
+            remote_user - SSH user on the hosts.
+            private_key_file - SSH private key for the hosts. Defaults to SSH's default keys.
+            ansible_playbook - ansible-playbook executable.
+        '''
+        self.work_dir = os.path.abspath(work_dir)
+        self.forks = forks
+        self.remote_user = remote_user
+        self.private_key_file = private_key_file
+        self.ansible_playbook = ansible_playbook
+
+        if not os.path.exists(self.work_dir):
+            os.makedirs(self.work_dir)
+
+
+    def run_phase(self, playbook, hosts, common_vars = None, phase = None):
+        '''
+        Runs a playbook once on all hosts.
+
+        Args:
+            playbook - path of the playbook.
+            hosts - dict of inventory host name -> dict of host variables. Each host needs
+                'ansible_host', its IP address.
+            common_vars - variables that are the same for all hosts. They're passed as extra
+                vars, so they override host variables with the same names.
+            phase - name of the phase, used for the inventory directory. Defaults to playbook's name.
+
+        Returns:
+            An OrderedDict of host name -> dict with 'succeeded' (True if the host had no failed
+            or unreachable tasks) and the PLAY RECAP counts of the host, like 'ok' and 'changed'.
+        '''
+        if not hosts:
+            return collections.OrderedDict()
+
+        phase = phase or os.path.splitext(os.path.basename(playbook))[0]
+        inventory = self._write_inventory(phase, hosts)
+
+        trace_file = os.path.join(self.work_dir, phase, 'trace.jsonl')
+        if os.path.exists(trace_file):
+            os.remove(trace_file)
+
+        cmd = [self.ansible_playbook, '-i', inventory, '--forks', str(min(self.forks, len(hosts))), playbook]
+
+        if common_vars:
+            vars_file = os.path.join(self.work_dir, phase, 'extra_vars.json')
+            with open(vars_file, 'w') as f:
+                json.dump(common_vars, f, indent = 4 * ' ')
+            cmd.extend(['--extra-vars', '@' + vars_file])
+
+        with tracing.span('ansible: ' + phase, phase = phase, playbook = playbook, hosts = len(hosts)):
+            proc = subprocess.Popen(cmd, env = self._env(playbook, trace_file), stdout = subprocess.PIPE,
+                stderr = subprocess.STDOUT, universal_newlines = True)
+
+            # Show progress as it happens, and keep the output for parsing the recap.
+            lines = []
+            for line in iter(proc.stdout.readline, ''):
+                print(line, end = '')
+                lines.append(line.rstrip('\n'))
+            proc.wait()
+
+        self._trace_tasks(trace_file, phase)
+
+        return self._results(hosts, lines, proc.returncode)
+
+
+    def _write_inventory(self, phase, hosts):
+        phase_dir = os.path.join(self.work_dir, phase)
+        host_vars_dir = os.path.join(phase_dir, 'host_vars')
+        if not os.path.exists(host_vars_dir):
+            os.makedirs(host_vars_dir)
+
+        # Remove host variables left from an earlier run of this phase.
+        for f in os.listdir(host_vars_dir):
+            os.remove(os.path.join(host_vars_dir, f))
+
+        inventory = os.path.join(phase_dir, 'hosts')
+        with open(inventory, 'w') as f:
+            f.write('[all]\n')
+            for name in hosts:
+                f.write(name + '\n')
+
+        # JSON is valid YAML, so host_vars files can be written as JSON.
+        for name, host_vars in hosts.items():
+            with open(os.path.join(host_vars_dir, name + '.yml'), 'w') as f:
+                json.dump(host_vars, f, indent = 4 * ' ')
+
+        return inventory
+
+
+    def _env(self, playbook, trace_file):
+        env = dict(os.environ)
+
+        control_path_dir = os.path.join(self.work_dir, 'cp')
+        if not os.path.exists(control_path_dir):
+            os.makedirs(control_path_dir)
+
+        env.update({
+            'ANSIBLE_HOST_KEY_CHECKING' : 'False',
+            'ANSIBLE_REMOTE_USER' : self.remote_user,
+
+            # Fewer SSH operations per task, and one SSH connection per host for all phases.
+            'ANSIBLE_SSH_PIPELINING' : 'True',
+            'ANSIBLE_SSH_ARGS' : '-o ControlMaster=auto -o ControlPersist=300s',
+            'ANSIBLE_SSH_CONTROL_PATH' : os.path.join(control_path_dir, '%%h-%%r'),
+
+            # Gather facts of a host only in the first phase that needs them.
+            'ANSIBLE_GATHERING' : 'smart',
+            'ANSIBLE_CACHE_PLUGIN' : 'jsonfile',
+            'ANSIBLE_CACHE_PLUGIN_CONNECTION' : os.path.join(self.work_dir, 'facts'),
+            'ANSIBLE_CACHE_PLUGIN_TIMEOUT' : '3600',
+
+            'ANSIBLE_RETRY_FILES_ENABLED' : 'False',
+
+            # Time every task on every host.
+            'ANSIBLE_CALLBACK_PLUGINS' : os.pathsep.join([p for p in [env.get('ANSIBLE_CALLBACK_PLUGINS'),
+                os.path.join(os.path.dirname(os.path.abspath(playbook)), 'callback_plugins')] if p]),
+            'HDFSPERF_TRACE_FILE' : trace_file
+        })
+
+        if self.private_key_file:
+            env['ANSIBLE_PRIVATE_KEY_FILE'] = self.private_key_file
+
+        return env
+
+
+    def _trace_tasks(self, trace_file, phase):
+        if not os.path.isfile(trace_file):
+            return
+
+        with open(trace_file, 'r') as f:
+            for line in f:
+                try:
+                    t = json.loads(line)
+                except ValueError:
+                    continue
+                tracing.record('%s: %s' % (os.path.splitext(t['playbook'] or phase)[0], t['task']),
+                    t['start'], t['end'], node = t['host'], phase = phase, playbook = t['playbook'],
+                    status = t['status'])
+
+
+    def _results(self, hosts, lines, returncode):
+        results = collections.OrderedDict()
+
+        in_recap = False
+        for line in lines:
+            if line.startswith('PLAY RECAP'):
+                in_recap = True
+                continue
+
+            m = RECAP_LINE.match(line.strip()) if in_recap else None
+            if m and m.group('host') in hosts:
+                counts = dict([(k, int(v)) for k, v in re.findall(r'(\w+)=(\d+)', m.group('counts'))])
+                counts['succeeded'] = counts.get('failed', 0) == 0 and counts.get('unreachable', 0) == 0
+                results[m.group('host')] = counts
+
+        # Hosts missing from the recap, like when ansible-playbook itself fails, didn't succeed.
+        for name in hosts:
+            if name not in results:
+                results[name] = {'succeeded' : False, 'returncode' : returncode}
+
+        return results
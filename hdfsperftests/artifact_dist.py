@@ -0,0 +1,199 @@
+'''
+Distributes large artifacts, like the Hadoop and ZooKeeper tarballs, to many nodes without
+uploading them from the controller to every node.
+
+The controller uploads an artifact to one node, unless some nodes already have it. Then
+distribution proceeds in waves: every node that has the artifact serves it over the private
+network, and each one is assigned up to 'fanout' nodes that download it from it in the next
+wave. So the number of nodes that have the artifact multiplies with every wave, and the
+controller's uplink carries the artifact only once.
+
+Artifacts are identified by their SHA-256 checksum. On nodes they're saved under a directory
+named after the checksum, and downloads are verified against it, so a node that already has
+an artifact isn't sent it again.
+'''
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import math
+import hashlib
+import argparse
+import collections
+
+
+DEFAULT_REMOTE_DIR = '/var/cache/hdfsperf/artifacts'
+DEFAULT_PORT = 8900
+
+_checksums = {}
+
+
+def artifact_checksum(local_path):
+    '''
+    Returns SHA-256 hex digest of a local file. Digests are remembered as long as file's
+    size and modification time don't change.
+    '''
+    st = os.stat(local_path)
+    key = (os.path.abspath(local_path), st.st_size, st.st_mtime)
+    if key not in _checksums:
+        sha = hashlib.sha256()
+        with open(local_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        _checksums[key] = sha.hexdigest()
+
+    return _checksums[key]
+
+
+
+class ArtifactDistributor(object):
+
+    def __init__(self, batch_prov, fanout = 2, seeds = 1, port = DEFAULT_PORT, remote_dir = DEFAULT_REMOTE_DIR,
+            playbook = 'ansible/distribute_artifact.yaml'):
+        '''
+        Args:
+            batch_prov - an ansible_batch.AnsibleBatchProvisioner.
+            fanout - number of nodes each node serves the artifact to in a wave.
+            seeds - number of nodes the controller uploads the artifact to, if no node has it yet.
+            port - port on which nodes serve artifacts to other nodes.
+            remote_dir - directory where artifacts are saved on nodes.
+            playbook - path of distribute_artifact.yaml.
+        '''
+        self.batch_prov = batch_prov
+        self.fanout = fanout
+        self.seeds = seeds
+        self.port = port
+        self.remote_dir = remote_dir
+        self.playbook = playbook
+
+
+    def remote_path(self, local_path):
+        '''
+        Returns path of the artifact on nodes.
+        '''
+        return '%s/%s/%s' % (self.remote_dir, artifact_checksum(local_path), os.path.basename(local_path))
+
+
+    def distribute(self, local_path, nodes, seeded = ()):
+        '''
+        Gets the artifact to all nodes.
+
+        Args:
+            local_path - path of the artifact on the controller.
+            nodes - list of node dicts with 'fqdn', 'public_ip' and 'private_ip'.
+            seeded - node dicts of nodes known to have the artifact already, in nodes or not.
+                They aren't sent it again, and serve it to the other nodes.
+
+        Returns:
+            OrderedDict of FQDN -> True if the node has the artifact, False if it couldn't get it.
+        '''
+        checksum = artifact_checksum(local_path)
+        remote_path = self.remote_path(local_path)
+        url_path = remote_path[len(self.remote_dir):]
+
+        by_fqdn = collections.OrderedDict([(n['fqdn'], n) for n in list(seeded) + list(nodes)])
+        have = [n['fqdn'] for n in seeded]
+        pending = [n['fqdn'] for n in nodes if n['fqdn'] not in have]
+        serving = []
+
+        common_vars = {
+            'artifact_local' : os.path.abspath(local_path),
+            'artifact_dir' : self.remote_dir,
+            'artifact_dest' : remote_path,
+            'artifact_checksum' : 'sha256:' + checksum,
+            'artifact_port' : self.port
+        }
+
+        def host_vars(fqdn, **variables):
+            variables['ansible_host'] = by_fqdn[fqdn]['public_ip']
+            variables['private_ip'] = by_fqdn[fqdn]['private_ip']
+            return variables
+
+        def run(hosts, phase):
+            results = self.batch_prov.run_phase(self.playbook, hosts, common_vars = common_vars, phase = phase)
+            return [fqdn for fqdn, r in results.items() if r['succeeded']]
+
+        print('Distributing %s (sha256 %s) to %d nodes, %d already have it' %
+            (os.path.basename(local_path), checksum[:12], len(pending), len(have)))
+
+        # Start serving from enough nodes that have the artifact, or upload it to some nodes.
+        # Checksum is verified on nodes that are supposed to have it already, and it's uploaded if
+        # it turns out to be missing.
+        if pending:
+            if have:
+                servers = have[:int(math.ceil(len(pending) / float(self.fanout)))]
+            else:
+                servers = pending[:self.seeds]
+                pending = pending[self.seeds:]
+
+            ok = run(collections.OrderedDict([(fqdn, host_vars(fqdn, artifact_src = '', artifact_serve = True))
+                for fqdn in servers]), 'artifact_seed')
+            have = [fqdn for fqdn in have if fqdn not in servers] + ok
+            serving = list(ok)
+
+        # Each wave, every serving node serves up to fanout nodes.
+        wave = 0
+        retried = set()
+        while pending and serving:
+            wave += 1
+            targets = pending[:len(serving) * self.fanout]
+            pending = pending[len(targets):]
+
+            hosts = collections.OrderedDict()
+            for i, fqdn in enumerate(targets):
+                server = by_fqdn[serving[i % len(serving)]]
+                hosts[fqdn] = host_vars(fqdn,
+                    artifact_src = 'http://%s:%d%s' % (server['private_ip'], self.port, url_path),
+                    # Nodes of the last wave don't need to serve.
+                    artifact_serve = len(pending) > 0)
+
+            print('Artifact wave %d: %d nodes downloading from %d nodes' % (wave, len(targets), len(serving)))
+            ok = run(hosts, 'artifact_wave')
+
+            have.extend(ok)
+            if pending:
+                serving.extend(ok)
+
+            # Give nodes that failed one more try in a later wave, possibly from another node.
+            for fqdn in targets:
+                if fqdn not in ok:
+                    if fqdn not in retried:
+                        retried.add(fqdn)
+                        pending.append(fqdn)
+
+        if serving:
+            run(collections.OrderedDict([(fqdn, host_vars(fqdn, artifact_stop = True)) for fqdn in serving]),
+                'artifact_stop')
+
+        return collections.OrderedDict([(n['fqdn'], n['fqdn'] in have) for n in nodes])
+
+
+
+if __name__ == '__main__':
+
+    # Distributes an artifact to nodes of an inventory outside hdfs_perf clusters, like ZooKeeper
+    # hosts, and prints its path on the nodes for use as zk_artifact or hadoop_artifact.
+    from ansible_batch import AnsibleBatchProvisioner
+
+    parser = argparse.ArgumentParser(description = 'Distribute an artifact to nodes')
+    parser.add_argument('artifact', help = 'Local path of artifact')
+    parser.add_argument('nodes', nargs = '+', help = 'Nodes as public_ip:private_ip')
+    parser.add_argument('--fanout', type = int, default = 2)
+    parser.add_argument('--work-dir', default = './hdfsperfdata/artifacts')
+    args = parser.parse_args()
+
+    nodes = []
+    for n in args.nodes:
+        public_ip, private_ip = n.split(':')
+        nodes.append({'fqdn' : public_ip, 'public_ip' : public_ip, 'private_ip' : private_ip})
+
+    distributor = ArtifactDistributor(AnsibleBatchProvisioner(args.work_dir), fanout = args.fanout)
+    results = distributor.distribute(args.artifact, nodes)
+
+    for fqdn, ok in results.items():
+        print('%s: %s' % (fqdn, 'ok' if ok else 'FAILED'))
+    print(distributor.remote_path(args.artifact))
+
+    sys.exit(0 if all(results.values()) else 1)
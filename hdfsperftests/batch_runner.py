@@ -0,0 +1,116 @@
+'''
+Runs a per-node task for many nodes concurrently in a bounded thread pool.
+
+A failure of one node doesn't abort the others. Failed tasks are retried with a delay,
+and the result reports which nodes succeeded, which failed and why, along with the
+wall-clock time of the batch versus the summed time of every node's task.
+'''
+
+from __future__ import print_function
+
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+
+def run_batch(items, task, max_workers = 8, retries = 2, retry_delay = 10, label = 'node'):
+    '''
+    Args:
+        items - list of task arguments, one per node, like worker indexes.
+        task - function that takes one item and returns a result. It should raise an exception on failure.
+        max_workers - maximum number of tasks running at the same time.
+        retries - number of times a failed task is retried.
+        retry_delay - seconds to wait before retrying a failed task.
+        label - what an item is called in progress messages.
+
+    Returns:
+        A dict with
+            'results' : dict of item -> task result for succeeded items,
+            'failures' : dict of item -> error message of last attempt for failed items,
+            'node_secs' : dict of item -> seconds spent on the item including retries,
+            'wall_secs' : wall-clock seconds of the whole batch,
+            'total_node_secs' : sum of node_secs.
+    '''
+    return run_stream([(item, None) for item in items], task, max_workers, retries, retry_delay, label)
+
+
+
+def run_stream(stream, task, max_workers = 8, retries = 2, retry_delay = 10, label = 'node'):
+    '''
+    Like run_batch(), but items come from an iterable that can yield them over time, like
+    ssh_ready.SshReadinessWaiter.wait(). Each item's task starts as soon as the item is
+    yielded, without waiting for the rest.
+
+    Args:
+        stream - iterable of (item, error). If error is not None, the item isn't run and is
+            reported as failed with that error.
+    '''
+    def attempt(item):
+        start = time.time()
+        error = None
+        for attempt_no in range(retries + 1):
+            if attempt_no > 0:
+                print('Retrying %s %s (attempt %d of %d) after error: %s' % (label, item, attempt_no + 1, retries + 1, error))
+                time.sleep(retry_delay)
+            try:
+                return (item, True, task(item), time.time() - start)
+
+            except Exception as e:
+                error = '%s: %s' % (type(e).__name__, e)
+                traceback.print_exc()
+
+        return (item, False, error, time.time() - start)
+
+
+    batch_start = time.time()
+
+    batch = {
+        'results' : {},
+        'failures' : {},
+        'node_secs' : {},
+        'wall_secs' : 0.0,
+        'total_node_secs' : 0.0
+    }
+
+    pool = ThreadPool(processes = max(1, max_workers))
+    try:
+        pending = []
+        for item, error in stream:
+            if error is not None:
+                batch['failures'][item] = error
+                batch['node_secs'][item] = time.time() - batch_start
+                continue
+            pending.append(pool.apply_async(attempt, (item,)))
+
+        outcomes = [p.get() for p in pending]
+    finally:
+        pool.close()
+        pool.join()
+
+    batch['wall_secs'] = time.time() - batch_start
+
+    for item, succeeded, value, secs in outcomes:
+        if succeeded:
+            batch['results'][item] = value
+        else:
+            batch['failures'][item] = value
+        batch['node_secs'][item] = secs
+
+    batch['total_node_secs'] = sum(batch['node_secs'].values())
+
+    return batch
+
+
+
+def print_batch_report(batch, title, label = 'node'):
+    '''
+    Prints succeeded and failed items of a batch, and its wall-clock time versus summed per-item time.
+    '''
+    print('%s: %d succeeded, %d failed' % (title, len(batch['results']), len(batch['failures'])))
+
+    for item in sorted(batch['failures'].keys()):
+        print('  %s %s failed: %s' % (label, item, batch['failures'][item]))
+
+    speedup = batch['total_node_secs'] / batch['wall_secs'] if batch['wall_secs'] > 0 else 0
+    print('  Wall-clock time: %.1f secs. Sum of per-%s times: %.1f secs. Speedup: %.1fx' %
+        (batch['wall_secs'], label, batch['total_node_secs'], speedup))
@@ -0,0 +1,449 @@
+'''
+Runs HDFS benchmarks on a provisioned cluster, and parses their outputs into structured results.
+
+A suite is declared in a JSON file, like suites/standard.json, so that a run can be repeated
+exactly. It lists benchmarks with their parameters, and how many warm-up runs, measured
+repetitions and seconds of cool-down between runs each one gets:
+
+    {
+        "name" : "standard",
+        "warmup" : 1,
+        "repetitions" : 3,
+        "cooldown_secs" : 30,
+        "setup" : ["commands run on master before the benchmarks"],
+        "benchmarks" : [
+            {"name" : "dfsio_write", "type" : "testdfsio", "params" : {"mode" : "write", "files" : 16, "file_size" : "1GB"}},
+            {"name" : "nn_create", "type" : "nnthroughput", "params" : {"op" : "create", "threads" : 16, "files" : 100000}},
+            ...
+        ]
+    }
+
+A benchmark can override warmup, repetitions and cooldown_secs of the suite. Supported types
+are testdfsio, nnthroughput, teragen and terasort - see BENCHMARK_TYPES.
+
+Benchmarks run on the master node over SSH. Raw output of every run is saved in the run's
+output directory, and results of all runs, along with the suite itself, in results.json.
+
+Usage:
+    python benchmarks.py results.json
+
+prints the summary of a run's results.
+'''
+
+from __future__ import print_function
+
+import os
+import os.path
+import re
+import sys
+import time
+import subprocess
+import contextlib
+import collections
+
+import simplejson as json
+
+import tracing
+
+
+HADOOP_VERSION = '2.7.0'
+
+DEFAULT_HADOOP_HOME = '/opt/hadoop-2.7.0'
+
+# Suite settings that benchmarks inherit unless they set their own.
+SUITE_DEFAULTS = collections.OrderedDict([
+    ('warmup', 1),
+    ('repetitions', 3),
+    ('cooldown_secs', 30),
+    ('timeout_secs', 3600)
+])
+
+
+def load_suite(path):
+    '''
+    Loads a suite from a JSON file, and checks that its benchmarks are of known types.
+    Raises ValueError if they aren't.
+    '''
+    with open(path, 'r') as f:
+        suite = json.load(f, object_pairs_hook = collections.OrderedDict)
+
+    suite.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    for key, value in SUITE_DEFAULTS.items():
+        suite.setdefault(key, value)
+
+    names = set()
+    for b in suite['benchmarks']:
+        if b.get('type') not in BENCHMARK_TYPES:
+            raise ValueError('Benchmark %s has unknown type %s. Known types are %s' %
+                (b.get('name'), b.get('type'), ', '.join(sorted(BENCHMARK_TYPES.keys()))))
+        if b['name'] in names:
+            raise ValueError('Benchmark name %s is used more than once' % (b['name']))
+        names.add(b['name'])
+
+    return suite
+
+
+
+class BenchmarkRunner(object):
+
+    def __init__(self, master_ip, master_fqdn, out_dir, hadoop_home = DEFAULT_HADOOP_HOME,
+            ssh_user = 'root', ssh_options = ('-o', 'BatchMode=yes', '-o', 'StrictHostKeyChecking=no'),
+            sampler = None):
+        '''
+        Args:
+            master_ip - public IP address of the master node, where benchmarks are launched.
+            master_fqdn - FQDN of the master node, for the HDFS URL.
+            out_dir - local directory for raw outputs and results.
+            hadoop_home - Hadoop install directory on the master node.
+            sampler - metrics_sampler.MetricsSampler whose samples are tagged with the
+                benchmark run they're taken in, if metrics are sampled.
+        '''
+        self.master_ip = master_ip
+        self.master_fqdn = master_fqdn
+        self.out_dir = out_dir
+        self.hadoop_home = hadoop_home
+        self.ssh_user = ssh_user
+        self.ssh_options = list(ssh_options)
+        self.sampler = sampler
+
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+
+    def run_suite(self, suite, cluster = None):
+        '''
+        Runs every benchmark of the suite: warm-up runs, then measured repetitions, with a
+        cool-down after each run.
+
+        Args:
+            cluster - cluster details, saved along with results to record what they were measured on.
+
+        Returns:
+            dict with the 'suite', 'cluster', and 'runs' - a list with a dict per run of a
+            benchmark with 'benchmark', 'type', 'repetition', 'warmup', 'ok', 'started',
+            'elapsed_secs', 'metrics' parsed from its output, and 'log_file' of the raw output.
+        '''
+        results = collections.OrderedDict([
+            ('suite', suite),
+            ('cluster', cluster),
+            ('started', time.strftime('%Y-%m-%d %H:%M:%S')),
+            ('runs', [])
+        ])
+
+        for command in suite.get('setup', []):
+            self.ssh(command, os.path.join(self.out_dir, 'setup.log'), suite['timeout_secs'])
+
+        for b in suite['benchmarks']:
+            settings = dict([(k, b.get(k, suite[k])) for k in SUITE_DEFAULTS])
+            runs = [(True, i + 1) for i in range(settings['warmup'])] + \
+                [(False, i + 1) for i in range(settings['repetitions'])]
+
+            for warmup, repetition in runs:
+                run = self.run_benchmark(b, repetition, warmup, settings['timeout_secs'])
+                results['runs'].append(run)
+                self.save(results)
+
+                if settings['cooldown_secs']:
+                    time.sleep(settings['cooldown_secs'])
+
+        for command in suite.get('teardown', []):
+            self.ssh(command, os.path.join(self.out_dir, 'teardown.log'), suite['timeout_secs'])
+
+        results['finished'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.save(results)
+        return results
+
+
+    def run_benchmark(self, benchmark, repetition, warmup = False, timeout_secs = 3600):
+        '''
+        Runs a benchmark once, cleaning up what earlier runs left in HDFS first.
+        '''
+        kind = BENCHMARK_TYPES[benchmark['type']]
+        params = benchmark.get('params', {})
+        label = '%s-%s%d' % (benchmark['name'], 'warmup' if warmup else 'rep', repetition)
+        log_file = os.path.join(self.out_dir, label + '.log')
+
+        print('Running benchmark %s' % (label))
+
+        cleanup = kind['cleanup'](self, params)
+        if cleanup:
+            self.ssh(cleanup, os.path.join(self.out_dir, label + '-cleanup.log'), timeout_secs)
+
+        started = time.time()
+        with tracing.span('benchmark: ' + benchmark['name'], phase = 'benchmark', repetition = repetition,
+                warmup = warmup), self.sample_phase(label):
+            returncode = self.ssh(kind['command'](self, params), log_file, timeout_secs)
+        elapsed = time.time() - started
+
+        with open(log_file, 'r') as f:
+            output = f.read()
+
+        metrics = kind['parse'](output, params, elapsed)
+        ok = returncode == 0 and bool(metrics)
+        if not ok:
+            print('Benchmark %s failed with exit code %s. See %s' % (label, returncode, log_file))
+
+        return collections.OrderedDict([
+            ('benchmark', benchmark['name']),
+            ('type', benchmark['type']),
+            ('params', params),
+            ('repetition', repetition),
+            ('warmup', warmup),
+            ('ok', ok),
+            ('started', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))),
+            ('elapsed_secs', elapsed),
+            ('metrics', metrics),
+            ('log_file', os.path.abspath(log_file))
+        ])
+
+
+    def ssh(self, command, log_file, timeout_secs):
+        '''
+        Runs a command on the master node, and saves its output to log_file.
+        Returns the command's exit code.
+        '''
+        cmd = ['ssh'] + self.ssh_options + ['%s@%s' % (self.ssh_user, self.master_ip),
+            'timeout %d bash -c %s' % (timeout_secs, shell_quote(command))]
+
+        with open(log_file, 'a') as f:
+            f.write('$ %s\n' % (command))
+            f.flush()
+            return subprocess.call(cmd, stdout = f, stderr = subprocess.STDOUT)
+
+
+    def sample_phase(self, label):
+        if self.sampler is None:
+            return no_phase()
+        return self.sampler.phase(label)
+
+
+    def hadoop(self, args):
+        return '%s/bin/hadoop %s' % (self.hadoop_home, args)
+
+
+    def jar(self, path):
+        return '%s/share/hadoop/%s' % (self.hadoop_home, path % {'version' : HADOOP_VERSION})
+
+
+    def hdfs_url(self):
+        return 'hdfs://%s:9000' % (self.master_fqdn)
+
+
+    def save(self, results):
+        with open(os.path.join(self.out_dir, 'results.json'), 'w') as f:
+            json.dump(results, f, indent = 4 * ' ')
+
+
+
+@contextlib.contextmanager
+def no_phase():
+    yield
+
+
+
+def shell_quote(s):
+    return "'" + s.replace("'", "'\"'\"'") + "'"
+
+
+
+def find_number(pattern, output):
+    '''
+    Returns the number captured by the first group of the last match of pattern in output,
+    or None. Numbers may have thousands separators.
+    '''
+    matches = re.findall(pattern, output)
+    if not matches:
+        return None
+    return float(matches[-1].replace(',', ''))
+
+
+
+def metrics_of(**values):
+    # Leaves out metrics that weren't found in the output.
+    return collections.OrderedDict([(k, v) for k, v in sorted(values.items()) if v is not None])
+
+
+
+# TestDFSIO: HDFS read and write throughput of many files, a map task per file.
+
+def testdfsio_command(runner, params):
+    return runner.hadoop('jar %s TestDFSIO -%s -nrFiles %d -fileSize %s -resFile /tmp/TestDFSIO_results.log' % (
+        runner.jar('mapreduce/hadoop-mapreduce-client-jobclient-%(version)s-tests.jar'),
+        params.get('mode', 'write'), params.get('files', 16), params.get('file_size', '1GB')))
+
+
+
+def testdfsio_cleanup(runner, params):
+    # A read benchmark reads the files of the last write benchmark, so they're left alone.
+    if params.get('mode', 'write') == 'write':
+        return runner.hadoop('jar %s TestDFSIO -clean' % (
+            runner.jar('mapreduce/hadoop-mapreduce-client-jobclient-%(version)s-tests.jar')))
+    return None
+
+
+
+def parse_testdfsio(output, params, elapsed):
+    # Like "INFO fs.TestDFSIO:      Throughput mb/sec: 45.72"
+    return metrics_of(
+        files = find_number(r'Number of files:\s*([\d,.]+)', output),
+        total_mb = find_number(r'Total MBytes processed:\s*([\d,.]+)', output),
+        throughput_mb_sec = find_number(r'Throughput mb/sec:\s*([\d,.]+)', output),
+        avg_io_rate_mb_sec = find_number(r'Average IO rate mb/sec:\s*([\d,.]+)', output),
+        io_rate_std_dev = find_number(r'IO rate std deviation:\s*([\d,.]+)', output),
+        exec_secs = find_number(r'Test exec time sec:\s*([\d,.]+)', output))
+
+
+
+# NNThroughputBenchmark: NameNode operations per second, with no data transfer. Hadoop 2.7
+# runs it against a NameNode it starts in its own process on the master. Set param 'remote'
+# to true with Hadoop 2.8 or later to run it against the cluster's NameNode.
+
+def nnthroughput(runner, params, args):
+    if params.get('remote'):
+        args = '-fs %s %s' % (runner.hdfs_url(), args)
+    return 'HADOOP_CLASSPATH=%s %s' % (runner.jar('hdfs/hadoop-hdfs-%(version)s-tests.jar'),
+        runner.hadoop('org.apache.hadoop.hdfs.server.namenode.NNThroughputBenchmark ' + args))
+
+
+
+def nnthroughput_command(runner, params):
+    args = '-op %s -threads %d -files %d' % (params.get('op', 'create'), params.get('threads', 16),
+        params.get('files', 100000))
+    if 'files_per_dir' in params:
+        args += ' -filesPerDir %d' % (params['files_per_dir'])
+    return nnthroughput(runner, params, args)
+
+
+
+def nnthroughput_cleanup(runner, params):
+    return nnthroughput(runner, params, '-op clean') if params.get('remote') else None
+
+
+
+def parse_nnthroughput(output, params, elapsed):
+    # Stats of the requested op come after "--- <op> stats  ---".
+    op = params.get('op', 'create')
+    stats = output.split('--- %s stats' % (op))[-1] if ('--- %s stats' % (op)) in output else ''
+    return metrics_of(
+        operations = find_number(r'# operations:\s*([\d,.]+)', stats),
+        elapsed_ms = find_number(r'Elapsed Time:\s*([\d,.]+)', stats),
+        ops_per_sec = find_number(r'Ops per sec:\s*([\d,.]+)', stats),
+        avg_latency_ms = find_number(r'Average Time:\s*([\d,.]+)', stats))
+
+
+
+# TeraGen and TeraSort: MapReduce jobs that write, then sort, 100 byte rows.
+
+def teragen_command(runner, params):
+    return runner.hadoop('jar %s teragen %s %d %s' % (
+        runner.jar('mapreduce/hadoop-mapreduce-examples-%(version)s.jar'), job_options(params),
+        params.get('rows', 10000000), params.get('output', '/benchmarks/terasort-input')))
+
+
+
+def teragen_cleanup(runner, params):
+    return runner.hadoop('fs -rm -r -f -skipTrash %s' % (params.get('output', '/benchmarks/terasort-input')))
+
+
+
+def terasort_command(runner, params):
+    return runner.hadoop('jar %s terasort %s %s %s' % (
+        runner.jar('mapreduce/hadoop-mapreduce-examples-%(version)s.jar'), job_options(params),
+        params.get('input', '/benchmarks/terasort-input'), params.get('output', '/benchmarks/terasort-output')))
+
+
+
+def terasort_cleanup(runner, params):
+    return runner.hadoop('fs -rm -r -f -skipTrash %s' % (params.get('output', '/benchmarks/terasort-output')))
+
+
+
+def job_options(params):
+    return ' '.join(['-D%s=%s' % (k, v) for k, v in sorted(params.get('job_conf', {}).items())])
+
+
+
+def parse_mapreduce_job(output, params, elapsed):
+    # Job counters, like "HDFS: Number of bytes written=1000000000". Throughput is over the
+    # wall-clock time of the whole job, as seen from the controller.
+    if not re.search(r'Job job_\S+ completed successfully', output):
+        return metrics_of()
+
+    bytes_read = find_number(r'HDFS: Number of bytes read=(\d+)', output)
+    bytes_written = find_number(r'HDFS: Number of bytes written=(\d+)', output)
+    processed = max(bytes_read or 0, bytes_written or 0)
+
+    return metrics_of(
+        hdfs_bytes_read = bytes_read,
+        hdfs_bytes_written = bytes_written,
+        map_tasks = find_number(r'Launched map tasks=(\d+)', output),
+        reduce_tasks = find_number(r'Launched reduce tasks=(\d+)', output),
+        job_secs = elapsed,
+        throughput_mb_sec = processed / (1024.0 * 1024) / elapsed if elapsed > 0 else None)
+
+
+
+BENCHMARK_TYPES = {
+    'testdfsio' : {'command' : testdfsio_command, 'cleanup' : testdfsio_cleanup, 'parse' : parse_testdfsio},
+    'nnthroughput' : {'command' : nnthroughput_command, 'cleanup' : nnthroughput_cleanup, 'parse' : parse_nnthroughput},
+    'teragen' : {'command' : teragen_command, 'cleanup' : teragen_cleanup, 'parse' : parse_mapreduce_job},
+    'terasort' : {'command' : terasort_command, 'cleanup' : terasort_cleanup, 'parse' : parse_mapreduce_job}
+}
+
+
+# Metric shown for each benchmark type in summaries, and whether higher is better.
+PRIMARY_METRICS = {
+    'testdfsio' : ('throughput_mb_sec', True),
+    'nnthroughput' : ('ops_per_sec', True),
+    'teragen' : ('throughput_mb_sec', True),
+    'terasort' : ('throughput_mb_sec', True)
+}
+
+
+
+def summarize(results):
+    '''
+    Returns an OrderedDict of benchmark name -> dict with the 'metric' and its 'values' in
+    measured runs that succeeded, 'mean', 'min', 'max' and number of 'failed' runs.
+    '''
+    summary = collections.OrderedDict()
+    for run in results['runs']:
+        if run['warmup']:
+            continue
+        metric = PRIMARY_METRICS[run['type']][0]
+        s = summary.setdefault(run['benchmark'], {'metric' : metric, 'values' : [], 'failed' : 0})
+        if run['ok'] and metric in run['metrics']:
+            s['values'].append(run['metrics'][metric])
+        else:
+            s['failed'] += 1
+
+    for s in summary.values():
+        values = s['values']
+        s['mean'] = sum(values) / len(values) if values else None
+        s['min'] = min(values) if values else None
+        s['max'] = max(values) if values else None
+
+    return summary
+
+
+
+def print_summary(summary, title = 'Benchmark results'):
+    print('%s:' % (title))
+    print('  %-24s %-20s %5s %12s %12s %12s %7s' % ('Benchmark', 'Metric', 'Runs', 'Mean', 'Min', 'Max', 'Failed'))
+    for name, s in summary.items():
+        if s['values']:
+            print('  %-24s %-20s %5d %12.2f %12.2f %12.2f %7d' % (name, s['metric'], len(s['values']),
+                s['mean'], s['min'], s['max'], s['failed']))
+        else:
+            print('  %-24s %-20s %5d %12s %12s %12s %7d' % (name, s['metric'], 0, '-', '-', '-', s['failed']))
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2 or not os.path.isfile(sys.argv[1]):
+        print('Usage: python benchmarks.py results.json')
+        sys.exit(1)
+
+    with open(sys.argv[1], 'r') as f:
+        print_summary(summarize(json.load(f)), os.path.dirname(os.path.abspath(sys.argv[1])))
@@ -0,0 +1,313 @@
+'''
+Cluster state store that's safe to update from many provisioning threads and processes.
+
+State of a cluster is kept in two files in hdfsperfdata/<name>/:
+    - <name>.json: snapshot of the whole cluster, in the same format as before.
+    - <name>.journal: append-only log of node updates made since the snapshot, one JSON
+      record per line.
+
+Updating one node appends a small record to the journal, instead of rewriting the whole
+cluster. Reads apply journal records to the snapshot. A store caches the cluster and
+only reads journal records appended since its last read, so reading a single node is
+cheap. When the journal grows long, it's compacted into a new snapshot.
+
+All changes are made under an exclusive lock on <name>.lock, shared by threads of this
+process through a per cluster store object, and with other processes through flock().
+Snapshots are written to a temporary file and renamed, so a crash never leaves a half
+written snapshot. A journal record cut short by a crash is ignored.
+
+Every snapshot has a new 'journal_epoch', and journal records carry the epoch of the
+snapshot they apply to. A crash after a compaction renamed the new snapshot, but before it
+emptied the journal, leaves records that are already in the snapshot; those are skipped,
+since their epoch doesn't match.
+'''
+
+from __future__ import print_function
+
+import os
+import os.path
+import uuid
+import errno
+import threading
+import contextlib
+import collections
+
+import simplejson as json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Journal records after which the journal is compacted into the snapshot.
+COMPACT_AFTER_RECORDS = 200
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def cluster_store(conf_dir, name):
+    '''
+    Returns the ClusterStore of a cluster. All callers in a process share the same store.
+    '''
+    key = (os.path.abspath(conf_dir), name)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ClusterStore(conf_dir, name)
+        return _stores[key]
+
+
+
+def ensure_dir(path):
+    '''
+    Creates a directory if it doesn't exist. Safe when many threads create it at once.
+    '''
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+
+class ClusterStore(object):
+
+    def __init__(self, conf_dir, name):
+        self.name = name
+        self.dir = os.path.join(conf_dir, name)
+        self.snapshot_file = os.path.join(self.dir, name + '.json')
+        self.journal_file = os.path.join(self.dir, name + '.journal')
+        self.lock_file = os.path.join(self.dir, name + '.lock')
+
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_fd = None
+
+        # Cached state, and what it was read from.
+        self._cluster = None
+        self._snapshot_stamp = None
+        self._epoch = None
+        self._journal_offset = 0
+        self._journal_records = 0
+
+
+    def exists(self):
+        return os.path.isfile(self.snapshot_file)
+
+
+    def load(self):
+        '''
+        Returns the whole cluster, or None if it doesn't exist. The returned cluster is a copy
+        that the caller can change freely.
+        '''
+        with self._locked():
+            cluster = self._refresh()
+            return _copy(cluster) if cluster is not None else None
+
+
+    def get_node(self, fqdn):
+        '''
+        Returns a copy of the node with given FQDN - master or a worker - or None if there's none.
+        '''
+        with self._locked():
+            cluster = self._refresh()
+            if cluster is None:
+                return None
+
+            node = _find_node(cluster, fqdn)
+            return _copy(node) if node is not None else None
+
+
+    def save(self, cluster):
+        '''
+        Replaces the whole cluster with a new snapshot.
+        '''
+        with self._locked():
+            ensure_dir(self.dir)
+            self._write_snapshot(cluster)
+
+
+    def put_node(self, node):
+        '''
+        Saves a node, replacing the master or worker with the same FQDN. A node that's not in
+        the cluster yet is added as a worker, in order of its 'index'.
+        '''
+        self._append({'op' : 'put_node', 'node' : node})
+
+
+    def update_node(self, fqdn, **fields):
+        '''
+        Sets some fields of the master or worker with given FQDN.
+        '''
+        self._append({'op' : 'update_node', 'fqdn' : fqdn, 'fields' : fields})
+
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''
+        Context manager for changes that involve the whole cluster. Yields the latest cluster,
+        and saves it as a new snapshot if the block completes without an exception. No other
+        thread or process can change the cluster in the meanwhile.
+        '''
+        with self._locked():
+            cluster = self.load()
+            if cluster is None:
+                raise ValueError('Cluster %s does not exist' % (self.name))
+            yield cluster
+            self._write_snapshot(cluster)
+
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # Reentrant across threads of this process, exclusive across processes.
+        with self._thread_lock:
+            if self._lock_depth == 0 and fcntl is not None and os.path.isdir(self.dir):
+                self._lock_fd = open(self.lock_file, 'a')
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_fd is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                    self._lock_fd.close()
+                    self._lock_fd = None
+
+
+    def _append(self, record):
+        with self._locked():
+            cluster = self._refresh()
+            if cluster is None:
+                raise ValueError('Cluster %s does not exist' % (self.name))
+
+            # Drop a record cut short by a crash, so that the new record starts on a line of its own.
+            if os.path.isfile(self.journal_file) and os.path.getsize(self.journal_file) > self._journal_offset:
+                with open(self.journal_file, 'r+') as f:
+                    f.truncate(self._journal_offset)
+
+            # Copy, so that later changes to the caller's objects don't change the cache.
+            record = _copy(record)
+            record['epoch'] = self._epoch
+            line = json.dumps(record) + '\n'
+            with open(self.journal_file, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+            _apply(cluster, record)
+            self._journal_offset += len(line.encode('utf-8'))
+            self._journal_records += 1
+
+            if self._journal_records >= COMPACT_AFTER_RECORDS:
+                self._write_snapshot(cluster)
+
+
+    def _refresh(self):
+        # Brings the cache up to date with the files, reading only what changed since last time.
+        stamp = _stamp(self.snapshot_file)
+        if stamp is None:
+            self._cluster = None
+            self._snapshot_stamp = None
+            return None
+
+        if stamp != self._snapshot_stamp:
+            with open(self.snapshot_file, 'r') as f:
+                self._cluster = json.load(f, object_pairs_hook = collections.OrderedDict)
+            # Snapshots from before epochs have none, and neither have their journal records.
+            self._epoch = self._cluster.pop('journal_epoch', None)
+            self._snapshot_stamp = stamp
+            self._journal_offset = 0
+            self._journal_records = 0
+
+        if os.path.isfile(self.journal_file):
+            with open(self.journal_file, 'rb') as f:
+                f.seek(self._journal_offset)
+                for line in f:
+                    # A record without a newline was cut short by a crash, or is still being written.
+                    if not line.endswith(b'\n'):
+                        break
+                    self._journal_offset += len(line)
+                    try:
+                        record = json.loads(line.decode('utf-8'), object_pairs_hook = collections.OrderedDict)
+                    except ValueError:
+                        continue
+                    if record.get('epoch') != self._epoch:
+                        continue
+                    _apply(self._cluster, record)
+                    self._journal_records += 1
+
+        return self._cluster
+
+
+    def _write_snapshot(self, cluster):
+        epoch = uuid.uuid4().hex
+        snapshot = collections.OrderedDict(cluster)
+        snapshot['journal_epoch'] = epoch
+
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(snapshot, f, indent = 4 * ' ')
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_file, self.snapshot_file)
+
+        # Journal records are all in the new snapshot now.
+        with open(self.journal_file, 'w') as f:
+            pass
+
+        self._cluster = _copy(cluster)
+        self._cluster.pop('journal_epoch', None)
+        self._snapshot_stamp = _stamp(self.snapshot_file)
+        self._epoch = epoch
+        self._journal_offset = 0
+        self._journal_records = 0
+
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+
+
+def _copy(obj):
+    return json.loads(json.dumps(obj), object_pairs_hook = collections.OrderedDict)
+
+
+
+def _find_node(cluster, fqdn):
+    if cluster['master'].get('fqdn') == fqdn:
+        return cluster['master']
+    for w in cluster['workers']:
+        if w['fqdn'] == fqdn:
+            return w
+    return None
+
+
+
+def _apply(cluster, record):
+    if record['op'] == 'put_node':
+        node = record['node']
+        if cluster['master'].get('fqdn') == node['fqdn']:
+            cluster['master'] = node
+            return
+
+        workers = cluster['workers']
+        positions = [i for i, w in enumerate(workers) if w['fqdn'] == node['fqdn']]
+        if positions:
+            workers[positions[0]] = node
+        else:
+            position = len(workers)
+            while position > 0 and workers[position - 1].get('index', 0) > node.get('index', 0):
+                position -= 1
+            workers.insert(position, node)
+
+    elif record['op'] == 'update_node':
+        node = _find_node(cluster, record['fqdn'])
+        if node is not None:
+            node.update(record['fields'])
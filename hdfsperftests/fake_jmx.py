@@ -0,0 +1,201 @@
+'''
+Fake of the JMX servlet of a NameNode or DataNode, serving the beans metrics_sampler.py
+reads, for running the sampler without a cluster.
+
+Counters, like bytes written and GC time, grow at steady rates with some noise, and gauges
+vary around fixed values. Like the real servlet, /jmx?qry= takes a bean name pattern with *
+wildcards, and keep-alive connections are supported.
+
+Usage:
+    python fake_jmx.py [--role namenode|datanode] [--port 50070] [--latency 0.01]
+
+then sample it with metrics_sampler.JmxSource('fake', 'http://localhost:50070', metrics_sampler.NAMENODE_BEANS).
+'''
+
+from __future__ import print_function
+
+import time
+import random
+import fnmatch
+import argparse
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+import simplejson as json
+
+
+# Bean name -> attribute -> (kind, value, or rate per second of a counter).
+BEANS = {
+    'namenode' : {
+        'Hadoop:service=NameNode,name=RpcActivityForPort9000' : {
+            'RpcQueueTimeAvgTime' : ('gauge', 0.5),
+            'RpcProcessingTimeAvgTime' : ('gauge', 1.5),
+            'RpcQueueTimeNumOps' : ('counter', 2000),
+            'CallQueueLength' : ('gauge', 3),
+            'NumOpenConnections' : ('gauge', 20)
+        },
+        'Hadoop:service=NameNode,name=FSNamesystem' : {
+            'FilesTotal' : ('counter', 100),
+            'BlocksTotal' : ('counter', 100),
+            'PendingReplicationBlocks' : ('gauge', 0)
+        },
+        'Hadoop:service=NameNode,name=JvmMetrics' : {
+            'GcTimeMillis' : ('counter', 20),
+            'GcCount' : ('counter', 2),
+            'MemHeapUsedM' : ('gauge', 600),
+            'ThreadsBlocked' : ('gauge', 0)
+        }
+    },
+    'datanode' : {
+        'Hadoop:service=DataNode,name=DataNodeActivity-localhost-50010' : {
+            'BytesRead' : ('counter', 40 * 1048576),
+            'BytesWritten' : ('counter', 30 * 1048576),
+            'BlocksRead' : ('counter', 0.3),
+            'BlocksWritten' : ('counter', 0.25),
+            'ReadBlockOpAvgTime' : ('gauge', 800),
+            'WriteBlockOpAvgTime' : ('gauge', 1200)
+        },
+        'Hadoop:service=DataNode,name=JvmMetrics' : {
+            'GcTimeMillis' : ('counter', 5),
+            'GcCount' : ('counter', 0.5),
+            'MemHeapUsedM' : ('gauge', 200),
+            'ThreadsBlocked' : ('gauge', 0)
+        }
+    }
+}
+
+
+class FakeJmx(object):
+
+    def __init__(self, role = 'namenode', port = 0, latency = 0.0):
+        '''
+        Args:
+            role - 'namenode' or 'datanode'.
+            port - port to listen on. 0 picks a free port.
+            latency - seconds added to every request.
+        '''
+        self.beans = BEANS[role]
+        self.latency = latency
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.stats = {'connections' : 0, 'requests' : 0}
+
+        # Counters grow from where they were at the last request, so their rates are noisy
+        # but they never go backwards.
+        self.counters = {}
+        self.last_request = self.started
+
+        jmx = self
+
+        class Handler(JmxRequestHandler):
+            fake = jmx
+
+        self.server = ThreadedHTTPServer(('127.0.0.1', port), Handler)
+        self.port = self.server.server_address[1]
+        self.url = 'http://127.0.0.1:%d' % (self.port)
+        self.thread = None
+
+
+    def start(self):
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def query(self, pattern):
+        '''
+        Returns the JMX servlet's response to a query, as a dict.
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.stats['requests'] += 1
+            now = time.time()
+            elapsed, self.last_request = now - self.last_request, now
+
+            beans = []
+            for name in sorted(self.beans):
+                if pattern and not fnmatch.fnmatchcase(name, pattern):
+                    continue
+                bean = {'name' : name}
+                for attribute, (kind, value) in self.beans[name].items():
+                    if kind == 'counter':
+                        key = (name, attribute)
+                        self.counters[key] = self.counters.get(key, 0) + value * elapsed * random.uniform(0.8, 1.2)
+                        bean[attribute] = int(self.counters[key])
+                    else:
+                        bean[attribute] = value * random.uniform(0.8, 1.2)
+                beans.append(bean)
+
+        return {'beans' : beans}
+
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+
+class JmxRequestHandler(BaseHTTPRequestHandler):
+
+    # Required for keep-alive connections.
+    protocol_version = 'HTTP/1.1'
+
+    fake = None
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.fake.lock:
+            self.fake.stats['connections'] += 1
+
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/jmx':
+            self.send_error(404)
+            return
+
+        pattern = parse_qs(url.query).get('qry', [None])[0]
+        content = json.dumps(self.fake.query(pattern)).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Fake NameNode or DataNode JMX servlet')
+    parser.add_argument('--role', choices = sorted(BEANS.keys()), default = 'namenode')
+    parser.add_argument('--port', type = int, default = 50070)
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'Seconds added to every request')
+    args = parser.parse_args()
+
+    fake = FakeJmx(args.role, args.port, args.latency)
+    print('Fake %s JMX listening at %s' % (args.role, fake.url))
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        print(fake.stats)
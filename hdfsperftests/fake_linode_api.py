@@ -0,0 +1,347 @@
+'''
+In-memory fake of the Linode API v3 calls used by linode_client.py, for running it
+without creating real linodes.
+
+It serves single and batch requests over keep-alive HTTP, can add latency to every
+request, and can enforce a rate limit by failing requests with the API's rate limit
+error. Chosen requests can be made to fail, like requests for linodes the API would
+refuse, and responses can be lost after their requests were applied. Counters of connections and requests show how well a client pools connections
+and batches requests.
+
+Usage:
+    python fake_linode_api.py [--port 8090] [--latency 0.2] [--rate-limit 20]
+
+then set LINODE_API_ENDPOINT=http://localhost:8090/ for linode_client.LinodeApiClient.
+'''
+
+from __future__ import print_function
+
+import time
+import argparse
+import threading
+import itertools
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+
+import simplejson as json
+
+
+DISTRIBUTIONS = [
+    {'DISTRIBUTIONID' : 124, 'LABEL' : 'Ubuntu 14.04 LTS', 'IS64BIT' : 1},
+    {'DISTRIBUTIONID' : 146, 'LABEL' : 'Ubuntu 16.04 LTS', 'IS64BIT' : 1}
+]
+
+KERNELS = [
+    {'KERNELID' : 138, 'LABEL' : 'Latest 64 bit (4.5.5-x86_64-linode69)', 'ISXEN' : 0},
+    {'KERNELID' : 137, 'LABEL' : 'Latest 32 bit (4.5.5-x86-linode84)', 'ISXEN' : 0}
+]
+
+
+class FakeLinodeApi(object):
+
+    def __init__(self, port = 0, latency = 0.0, requests_per_sec = None):
+        '''
+        Args:
+            port - port to listen on. 0 picks a free port.
+            latency - seconds added to every HTTP request.
+            requests_per_sec - if set, API requests beyond this many in a second fail with ERRORCODE 14.
+        '''
+        self.latency = latency
+        self.requests_per_sec = requests_per_sec
+
+        self.linodes = {}
+        self.images = {}
+        self.ids = itertools.count(1000)
+        self.lock = threading.Lock()
+
+        self.stats = {'connections' : 0, 'http_requests' : 0, 'api_requests' : 0, 'rate_limited' : 0}
+        self.window = [0, 0]    # [second, requests in that second]
+        self.failures = []
+        self.lost = []
+
+        api = self
+
+        class Handler(ApiRequestHandler):
+            fake = api
+
+        self.server = ThreadedHTTPServer(('127.0.0.1', port), Handler)
+        self.port = self.server.server_address[1]
+        self.endpoint = 'http://127.0.0.1:%d/' % (self.port)
+        self.thread = None
+
+
+    def start(self):
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def fail_when(self, action, predicate, code = 8, message = 'Request failed'):
+        '''
+        Makes requests of action for which predicate(request) is true fail with given error code.
+        '''
+        self.failures.append((action, predicate, code, message))
+
+
+    def lose_responses(self, action, count = 1):
+        '''
+        Makes the next count HTTP requests that include action fail with HTTP 502, after
+        their API requests were applied.
+        '''
+        self.lost.append([action, count])
+
+
+    def handle(self, params):
+        '''
+        Handles one HTTP request, and returns its HTTP status and its response as a dict or list of dicts.
+        '''
+        with self.lock:
+            self.stats['http_requests'] += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if params.get('api_action') == 'batch':
+            requests = json.loads(params['api_requestArray'])
+            response = [self.dispatch(r) for r in requests]
+        else:
+            requests = [params]
+            response = self.dispatch(params)
+
+        with self.lock:
+            for lost in self.lost:
+                if lost[1] > 0 and lost[0] in [r.get('api_action') for r in requests]:
+                    lost[1] -= 1
+                    return 502, error('batch', 0, 'Bad Gateway')
+
+        return 200, response
+
+
+    def dispatch(self, request):
+        action = request.get('api_action')
+        with self.lock:
+            self.stats['api_requests'] += 1
+
+            if self.requests_per_sec:
+                second = int(time.time())
+                if self.window[0] != second:
+                    self.window = [second, 0]
+                self.window[1] += 1
+                if self.window[1] > self.requests_per_sec:
+                    self.stats['rate_limited'] += 1
+                    return error(action, 14, 'API rate limit exceeded')
+
+            method = getattr(self, 'do_' + action.replace('.', '_'), None)
+            if method is None:
+                return error(action, 9, 'Method Not Implemented')
+
+            linode_id = request.get('LinodeID')
+            if linode_id is not None and int(linode_id) not in self.linodes:
+                return error(action, 5, 'Object not found')
+
+            for failing_action, predicate, code, message in self.failures:
+                if action == failing_action and predicate(request):
+                    return error(action, code, message)
+
+            return {'ACTION' : action, 'ERRORARRAY' : [], 'DATA' : method(request)}
+
+
+    def linode(self, request):
+        return self.linodes[int(request['LinodeID'])]
+
+
+    def do_avail_distributions(self, request):
+        return DISTRIBUTIONS
+
+
+    def do_avail_kernels(self, request):
+        return KERNELS
+
+
+    def do_linode_create(self, request):
+        linode_id = next(self.ids)
+        self.linodes[linode_id] = {
+            'LINODEID' : linode_id,
+            'DATACENTERID' : int(request['DatacenterID']),
+            'PLANID' : int(request['PlanID']),
+            'LABEL' : 'linode%d' % (linode_id),
+            'STATUS' : 0,
+            'disks' : [],
+            'configs' : [],
+            'ips' : [{'IPADDRESSID' : next(self.ids), 'ISPUBLIC' : 1,
+                      'IPADDRESS' : '203.0.113.%d' % (linode_id % 250 + 1)}]
+        }
+        return {'LinodeID' : linode_id}
+
+
+    def do_linode_list(self, request):
+        keys = ['LINODEID', 'DATACENTERID', 'PLANID', 'LABEL', 'STATUS']
+        return [dict([(k, l[k]) for k in keys]) for l in self.linodes.values()]
+
+
+    def do_linode_update(self, request):
+        linode = self.linode(request)
+        linode['LABEL'] = request.get('Label', linode['LABEL'])
+        return {'LinodeID' : linode['LINODEID']}
+
+
+    def do_linode_delete(self, request):
+        return {'LinodeID' : self.linodes.pop(int(request['LinodeID']))['LINODEID']}
+
+
+    def do_linode_ip_addprivate(self, request):
+        linode = self.linode(request)
+        ip = {'IPADDRESSID' : next(self.ids), 'ISPUBLIC' : 0,
+              'IPADDRESS' : '192.168.%d.%d' % (linode['LINODEID'] // 250 % 250, linode['LINODEID'] % 250 + 1)}
+        linode['ips'].append(ip)
+        return {'IPAddressID' : ip['IPADDRESSID'], 'IPAddress' : ip['IPADDRESS']}
+
+
+    def do_linode_ip_list(self, request):
+        linode = self.linode(request)
+        return [dict(ip, LINODEID = linode['LINODEID']) for ip in linode['ips']]
+
+
+    def do_linode_disk_createfromdistribution(self, request):
+        return self._create_disk(request, 'ext4')
+
+
+    def do_linode_disk_create(self, request):
+        return self._create_disk(request, request['Type'])
+
+
+    def do_linode_config_create(self, request):
+        config_id = next(self.ids)
+        self.linode(request)['configs'].append({'ConfigID' : config_id, 'DiskList' : request['DiskList']})
+        return {'ConfigID' : config_id}
+
+
+    def do_linode_boot(self, request):
+        self.linode(request)['STATUS'] = 1
+        return {'JobID' : self._job(request, 'linode.boot')}
+
+
+    def do_linode_shutdown(self, request):
+        self.linode(request)['STATUS'] = 2
+        return {'JobID' : self._job(request, 'linode.shutdown')}
+
+
+    def do_linode_job_list(self, request):
+        jobs = self.linode(request)['jobs']
+        if request.get('JobID'):
+            jobs = [j for j in jobs if j['JOBID'] == int(request['JobID'])]
+        return jobs
+
+
+    def do_linode_disk_createfromimage(self, request):
+        # The API's own response uses upper case here.
+        disk = self._create_disk(request, 'ext4')
+        return {'DISKID' : disk['DiskID'], 'JOBID' : disk['JobID']}
+
+
+    def do_linode_disk_imagize(self, request):
+        image_id = next(self.ids)
+        self.images[image_id] = {'IMAGEID' : image_id, 'LABEL' : request.get('Label', ''),
+            'DESCRIPTION' : request.get('Description', ''), 'STATUS' : 'available',
+            'CREATE_DT' : time.strftime('%Y-%m-%d %H:%M:%S'), 'TYPE' : 'manual'}
+        return {'JobID' : self._job(request, 'linode.disk.imagize'), 'ImageID' : image_id}
+
+
+    def do_image_list(self, request):
+        if request.get('ImageID'):
+            image = self.images.get(int(request['ImageID']))
+            return [image] if image else []
+        return list(self.images.values())
+
+
+    def do_image_delete(self, request):
+        return self.images.pop(int(request['ImageID']))
+
+
+    def _job(self, request, action):
+        # Jobs of the fake finish at once.
+        job_id = next(self.ids)
+        self.linode(request).setdefault('jobs', []).append({'JOBID' : job_id, 'ACTION' : action,
+            'HOST_FINISH_DT' : time.strftime('%Y-%m-%d %H:%M:%S'), 'HOST_SUCCESS' : 1, 'HOST_MESSAGE' : ''})
+        return job_id
+
+
+    def _create_disk(self, request, disk_type):
+        disk_id = next(self.ids)
+        self.linode(request)['disks'].append({'DiskID' : disk_id, 'Type' : disk_type,
+            'Label' : request['Label'], 'Size' : int(request['Size'])})
+        return {'DiskID' : disk_id, 'JobID' : next(self.ids)}
+
+
+
+def error(action, code, message):
+    return {'ACTION' : action, 'ERRORARRAY' : [{'ERRORCODE' : code, 'ERRORMESSAGE' : message}], 'DATA' : {}}
+
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+
+    # Required for keep-alive connections.
+    protocol_version = 'HTTP/1.1'
+
+    fake = None
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.fake.lock:
+            self.fake.stats['connections'] += 1
+
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        params = dict([(k, v[0]) for k, v in parse_qs(body).items()])
+
+        status, response = self.fake.handle(params)
+        content = json.dumps(response).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Fake Linode API server')
+    parser.add_argument('--port', type = int, default = 8090)
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'Seconds added to every request')
+    parser.add_argument('--rate-limit', type = int, default = None, help = 'API requests allowed per second')
+    args = parser.parse_args()
+
+    fake = FakeLinodeApi(args.port, args.latency, args.rate_limit)
+    print('Fake Linode API listening at %s' % (fake.endpoint))
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stats['linodes'] = len(fake.linodes)
+        print(fake.stats)
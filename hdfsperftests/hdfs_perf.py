@@ -9,16 +9,43 @@ from __future__ import print_function
 
 import os
 import os.path
+import re
+import glob
+import time
+import hashlib
 import collections
 
-from linode_core import Core, Linode
+from linode_core import Core
 from provisioners import AnsibleProvisioner
+import batch_runner
+import linode_client
+import membership
+import ssh_ready
+import pipeline
+import tracing
+import artifact_dist
+import benchmarks
+import results_store
+import sweep
+import metrics_sampler
+from cluster_state import cluster_store, ensure_dir
+from ansible_batch import AnsibleBatchProvisioner
 
 import simplejson as json
 
 import logger
 
 
+# Hadoop tarball, relative to the directory hdfs_perf runs in.
+HADOOP_DISTRIBUTION = 'ansible/hadoop-2.7.0.tar.gz'
+
+# Golden images are labeled with this prefix and the fingerprint of their inputs.
+GOLDEN_IMAGE_PREFIX = 'hdfsperf-'
+
+# Port of the apt caching proxy set up by apt_cache_server.yaml.
+APT_CACHE_PORT = 3142
+
+
 def create_cluster(name, datacenter):
     
     test_cluster = load_cluster(name)
@@ -58,7 +85,7 @@ def add_master_node(name):
                                         {
                                             'label' : 'hdfs',
                                             'disk_size' : 21 * 1024,
-                                            'type' : 'ext4'
+                                            'type' : 'raw'
                                         }
                                         ]
                             
@@ -78,13 +105,15 @@ def add_master_node(name):
     master['private_ip'] = linode.private_ip
     master['fqdn'] = 'hdpmaster.' + cluster['name']
     master['shortname'] = 'hdpmaster'
+    master['data_disk_mb'] = master_linode_spec['disks']['others'][0]['disk_size']
+    master['plan_id'] = master_linode_spec['plan_id']
     
     cluster['master'] = master
     
     save_cluster(cluster)
     
     
-def provision_master_node(name):
+def provision_master_node(name, data_fstype = None):
     
     cluster = load_cluster(name)
     master = cluster['master']
@@ -94,34 +123,52 @@ def provision_master_node(name):
     master_ip = master['public_ip']
     
     # Wait for SSH service on linode to come up.
-    temp = Linode()
-    temp.public_ip = [ master_ip ]
-    if not prov.wait_for_ping(temp, 60, 10):
-        print("Unable to reach %s over SSH" % (master_ip))
+    error = wait_for_ssh([master])[master_ip]
+    if error:
+        print("Unable to reach %s over SSH: %s" % (master_ip, error))
         return None
     
     print('Provisioning master node')
     
     # Set the node's hostname. No underscrores allowed in hostname.
     master['hostname'] = 'hdpmasterlocal'
-    prov.exec_playbook(master_ip, 'ansible/change_hostname.yaml',
+    exec_playbook(prov, master, 'ansible/change_hostname.yaml',
         variables = {
             'new_hostname' : master['hostname']
         })
+        
+    # Set up the apt caching proxy before master installs packages itself, so that they're cached.
+    apt_cache = cluster.get('apt_cache')
+    if apt_cache is not None and apt_cache['host'] == master['fqdn']:
+        exec_playbook(prov, master, 'ansible/apt_cache_server.yaml',
+            variables = {
+                'private_ip' : master['private_ip'],
+                'apt_cache_port' : APT_CACHE_PORT
+            })
+    elif apt_cache is not None:
+        exec_playbook(prov, master, 'ansible/apt_proxy.yaml', variables = {'apt_proxy' : apt_cache['url']})
 
     pubkey_dir = os.path.join(conf_dir(), cluster['name'], 'pubkeys') 
-    if not os.path.exists(pubkey_dir):
-        os.makedirs(pubkey_dir)
+    ensure_dir(pubkey_dir)
     
     pubkey_file = os.path.abspath( os.path.join(pubkey_dir, master['fqdn'] + '.pub' ) )
-    prov.exec_playbook(master_ip, 'ansible/hadoop.yaml',
-        variables = {
+    data_fs_report_file = data_fs_report_path(cluster, master)
+    
+    variables = {
             # If path does not end with a /, this becomes the name of the downloaded file
             # instead of the directory under which it should be saved.
             'master_node_fqdn' : master['fqdn'],
             'worker_node_fqdn' : '',
-            'local_pubkey_file' : pubkey_file
-        })
+            'local_pubkey_file' : pubkey_file,
+            'data_fs_report_file' : data_fs_report_file
+        }
+    variables.update(data_filesystem_vars(master.get('data_disk_mb', 21 * 1024), data_fstype))
+    if cluster.get('hadoop_conf'):
+        variables['hadoop_conf'] = cluster['hadoop_conf']
+    
+    exec_playbook(prov, master, 'ansible/hadoop.yaml', variables = variables)
+    
+    load_data_fs_report(master, data_fs_report_file)
 
     if os.path.isfile(pubkey_file):
         with open(pubkey_file, 'r') as f:
@@ -134,28 +181,180 @@ def provision_master_node(name):
     
     # The master node should be able to SSH to itself, because some of the hadoop
     # start/stop scripts require it.
-    prov.exec_playbook(master_ip, 'ansible/add_authorized_keys.yaml',
+    exec_playbook(prov, master, 'ansible/add_authorized_keys.yaml',
         variables = {
             'keys' : master['pubkey'] + '\n',
             'cluster' : cluster['name']
         })
 
     
-    save_cluster(cluster)
+    save_node(name, master)
         
     
+class NodeError(Exception):
+    pass
+    
+    
+
 def add_worker_node(name):
     
     cluster = load_cluster(name)
     
+    worker_index = next_worker_index(cluster)
+    
+    try:
+        worker = create_worker(cluster, worker_index)
+    except NodeError as e:
+        logger.error_msg(str(e))
+        return None
+    
+    save_node(name, worker)
+    
+    
+    
+def add_worker_nodes(name, count, max_workers = 8, retries = 2, api_client = None, golden_image = False):
+    '''
+    Creates count worker nodes concurrently, at most max_workers at a time.
+    
+    Each worker is saved to the cluster file as soon as it's created, so workers created
+    before a failure aren't lost. A worker whose creation fails is retried, and if it still
+    fails, the other workers are created anyway and its index is left unused.
+    
+    Args:
+        api_client - a linode_client.LinodeApiClient. If given, all workers are created
+            together with batched API calls, instead of separately with linode_core.Core.
+        golden_image - boot workers from the golden image, baking it first if there's none
+            for the current software. Requires api_client.
+    
+    Returns:
+        the batch result of batch_runner.run_batch(), with worker indexes as items.
+    '''
+    cluster = load_cluster(name)
+    
+    first_index = next_worker_index(cluster)
+    worker_indexes = list(range(first_index, first_index + count))
+    
+    if golden_image and api_client is None:
+        raise ValueError('Creating workers from golden image requires an API client')
+        
+    if api_client is not None:
+        image = ensure_golden_image(cluster['dc'], api_client) if golden_image else None
+        batch = create_workers_batched(cluster, worker_indexes, api_client, retries, image = image)
+        
+    else:
+        def create(worker_index):
+            worker = create_worker(cluster, worker_index)
+            save_node(name, worker)
+            return worker['id']
+            
+        batch = batch_runner.run_batch(worker_indexes, create, max_workers = max_workers,
+            retries = retries, label = 'worker')
+    
+    batch_runner.print_batch_report(batch, 'Created worker nodes', label = 'worker')
+    
+    return batch
+    
+    
+    
+def next_worker_index(cluster):
+    '''
+    Returns the index of the next worker, after the highest index in use. Indexes of workers
+    that failed to be created are left unused, so the count of workers can't be used.
+    '''
+    return max([w.get('index', i + 1) for i, w in enumerate(cluster['workers'])] + [0]) + 1
+    
+    
+    
+def create_workers_batched(cluster, worker_indexes, api_client, retries = 2, image = None):
+    '''
+    Creates linodes of all workers together using linode_client.LinodeCreator, and saves
+    each created worker. Workers that fail are retried together.
+    
+    Args:
+        image - a golden image, as returned by ensure_golden_image(), to boot workers from.
+            Workers record its fingerprint as 'image', so that provisioning skips installing
+            what's already in the image.
+    
+    Returns:
+        a batch result like batch_runner.run_batch(). Per node time is the time spent
+        on all workers, since they're created together.
+    '''
+    creator = linode_client.LinodeCreator(api_client)
+    
+    batch = {'results' : {}, 'failures' : {}, 'node_secs' : {}, 'wall_secs' : 0.0, 'total_node_secs' : 0.0}
+    start = time.time()
+    
+    pending = list(worker_indexes)
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+            
+        specs = [worker_linode_spec(cluster, i) for i in pending]
+        if image is not None:
+            for spec in specs:
+                spec['image'] = image['id']
+                
+        attempt_start = time.time()
+        with tracing.span('create_linodes', phase = 'create', nodes = len(specs)):
+            try:
+                linodes = creator.create_linodes(specs)
+            except Exception as e:
+                # Nothing is left of the attempt, so every worker in it failed with the same error.
+                linodes = [e] * len(specs)
+        for spec in specs:
+            tracing.record('create_linode', attempt_start, time.time(),
+                node = '%s.%s' % (spec['label'], cluster['name']), phase = 'create',
+                image = image is not None)
+        
+        failed = []
+        for worker_index, spec, linode in zip(pending, specs, linodes):
+            if isinstance(linode, Exception):
+                batch['failures'][worker_index] = '%s: %s' % (type(linode).__name__, linode)
+                failed.append(worker_index)
+                continue
+                
+            worker = worker_details(cluster, worker_index, spec, linode)
+            if image is not None:
+                worker['image'] = image['fingerprint']
+            save_node(cluster['name'], worker)
+            batch['results'][worker_index] = worker['id']
+            batch['failures'].pop(worker_index, None)
+            
+        pending = failed
+        
+    batch['wall_secs'] = time.time() - start
+    for worker_index in worker_indexes:
+        batch['node_secs'][worker_index] = batch['wall_secs']
+        batch['total_node_secs'] += batch['wall_secs']
+        
+    return batch
+    
+    
+    
+def create_worker(cluster, worker_index):
+    '''
+    Creates the linode for worker number worker_index, and returns worker details to save in the cluster.
+    Raises NodeError if the linode could not be created.
+    '''
     app_ctx = {'conf-dir' : conf_dir()}
     core = Core(app_ctx)
     
-    worker_index = len(cluster['workers']) + 1
+    spec = worker_linode_spec(cluster, worker_index)
+        
+    with tracing.span('create_linode', node = '%s.%s' % (spec['label'], cluster['name']), phase = 'create'):
+        linode = core.create_linode(spec)
+    if not linode:
+        raise NodeError('Could not create worker node %s' % (spec['label']))
+    
+    return worker_details(cluster, worker_index, spec, linode)
+    
+    
+    
+def worker_linode_spec(cluster, worker_index):
     
     label = 'hdpworker-%d' % (worker_index)
 
-    worker_linode_spec = {
+    spec = {
             'plan_id' : 7, # Linode 384 GB storage, 2Mbps outgoing network
             'datacenter' : cluster['dc'],
             'distribution' : 'Ubuntu 14.04 LTS',
@@ -169,173 +368,1038 @@ def add_worker_node(name):
                                         {
                                             'label' : 'hdfs',
                                             'disk_size' : 372 * 1024,
-                                            'type' : 'ext4'
+                                            'type' : 'raw'
                                         }
                                         ]
                             
                         }
 
     }
-        
-    linode = core.create_linode(worker_linode_spec)
-    if not linode:
-        logger.error_msg('Could not create worker node')
-        return None
     
-    # Save admin node details to cluster under both admin and monitor node keys.
+    return spec
+    
+    
+    
+def worker_details(cluster, worker_index, spec, linode):
+    
     worker = collections.OrderedDict()
     worker['id'] = linode.id
+    worker['index'] = worker_index
     worker['public_ip'] = str(linode.public_ip[0])
     worker['private_ip'] = linode.private_ip
     worker['fqdn'] = 'hdpworker-%d.%s' % (worker_index, cluster['name'])
     worker['shortname'] = 'hdpworker-%d' % (worker_index) 
+    worker['data_disk_mb'] = spec['disks']['others'][0]['disk_size']
+    worker['plan_id'] = spec['plan_id']
     
-    cluster['workers'].append(worker)
+    return worker
     
-    save_cluster(cluster)
     
     
-def provision_worker_node(name, index):
+def golden_image_inputs():
+    '''
+    Returns everything that goes into the golden image, as an OrderedDict of name -> version
+    or checksum. A change to any of them calls for a new image.
+    '''
+    inputs = collections.OrderedDict()
+    inputs['distribution'] = golden_image_spec(None)['distribution']
+    for path in ['ansible/hadoop_base.yaml', 'ansible/sshd_config.j2', HADOOP_DISTRIBUTION]:
+        inputs[os.path.basename(path)] = artifact_dist.artifact_checksum(path)
+    return inputs
     
-    cluster = load_cluster(name)
-    worker = cluster['workers'][index]
     
-    prov = AnsibleProvisioner()
     
-    worker_ip = worker['public_ip']
+def golden_image_spec(datacenter):
+    # Temporary linode the golden image is baked on. Its boot disk is kept small, since
+    # images are as large as the disk they're made from. Nodes created from the image
+    # get a larger boot disk.
+    return {
+            'plan_id' : 1,
+            'datacenter' : datacenter,
+            'distribution' : 'Ubuntu 14.04 LTS',
+            'kernel' : 'Latest 64 bit',
+            'label' : 'hdpimagebake',
+            'group' : 'hdfsperftests',
+            'disks' :   {
+                            'boot' : {'disk_size' : 4*1024},
+                            'swap' : {'disk_size' : 256}
+                        }
+    }
     
-    # Wait for SSH service on linode to come up.
-    temp = Linode()
-    temp.public_ip = [ worker_ip ]
-    if not prov.wait_for_ping(temp, 60, 10):
-        print("Unable to reach %s over SSH" % (worker_ip))
+    
+    
+def ensure_golden_image(datacenter, api_client, keep = 2):
+    '''
+    Returns the golden image for the current inputs, baking it if it doesn't exist yet.
+    Older golden images beyond the latest keep are deleted.
+    
+    Returns:
+        dict with the image's 'id', 'label' and 'fingerprint'.
+    '''
+    inputs = golden_image_inputs()
+    fingerprint = hashlib.sha256(json.dumps(inputs).encode('utf-8')).hexdigest()[:16]
+    label = GOLDEN_IMAGE_PREFIX + fingerprint
+    
+    baker = linode_client.ImageBaker(api_client)
+    image = baker.find(label)
+    if image is not None:
+        return {'id' : image['IMAGEID'], 'label' : label, 'fingerprint' : fingerprint}
+        
+    print('Baking golden image %s' % (label))
+    start = time.time()
+    with tracing.span('bake_golden_image', phase = 'bake', image = label):
+        image_id = bake_golden_image(datacenter, api_client, label,
+            ', '.join(['%s %s' % (k, v[:12]) for k, v in inputs.items()]))
+    print('Baked golden image %s in %.0f secs' % (label, time.time() - start))
+    
+    old = [i['IMAGEID'] for i in baker.images(GOLDEN_IMAGE_PREFIX) if i['IMAGEID'] != image_id][max(keep - 1, 0):]
+    if old:
+        baker.delete(old)
+        
+    return {'id' : image_id, 'label' : label, 'fingerprint' : fingerprint}
+    
+    
+    
+def bake_golden_image(datacenter, api_client, label, description):
+    '''
+    Installs the software of a hadoop node with hadoop_base.yaml on a temporary linode, and
+    turns its boot disk into an image. The linode is deleted afterwards, whether baking
+    succeeded or not. Raises NodeError if it fails.
+    
+    Returns:
+        ImageID of the new image.
+    '''
+    linode = linode_client.LinodeCreator(api_client).create_linodes([golden_image_spec(datacenter)])[0]
+    if isinstance(linode, Exception):
+        raise NodeError('Could not create linode to bake golden image: %s' % (linode))
+        
+    try:
+        public_ip = str(linode.public_ip[0])
+        error = wait_for_ssh([{'fqdn' : label, 'public_ip' : public_ip}])[public_ip]
+        if error:
+            raise NodeError('Unable to reach %s over SSH: %s' % (public_ip, error))
+            
+        batch_prov = AnsibleBatchProvisioner(os.path.join(conf_dir(), 'images', label))
+        results = batch_prov.run_phase('ansible/hadoop_base.yaml',
+            {label : {'ansible_host' : public_ip, 'image_bake' : True}}, phase = 'bake')
+        if not results[label]['succeeded']:
+            raise NodeError('Installing software for golden image %s failed' % (label))
+            
+        return linode_client.ImageBaker(api_client).bake(linode.id, linode.disk_ids[0], label, description)
+        
+    finally:
+        api_client.call('linode.delete', LinodeID = linode.id, skipChecks = 1)
+        
+        
+        
+def provision_worker_node(name, index, data_fstype = None):
+    
+    try:
+        worker = provision_worker(name, index, data_fstype)
+    except NodeError as e:
+        print(str(e))
         return None
+        
+    # Update /etc/hosts on all nodes, because next playbook requires worker FQDNs to be resolvable
+    # on master.
+    update_fqdn_entries(name)
+    
+    sync_known_hosts(name)
+    
+    
+    
+def provision_worker_nodes(name, indexes = None, data_fstype = None, max_workers = 8, retries = 1):
+    '''
+    Provisions worker nodes concurrently, at most max_workers at a time.
+    
+    Per node steps of a worker start as soon as its SSH service is up, and run in parallel
+    with other workers. Steps that involve the whole cluster - updating /etc/hosts
+    on all nodes and adding workers to master's known_hosts - run once at the end for all
+    workers that were provisioned, instead of once per worker.
+    
+    Args:
+        indexes - positions of workers in cluster['workers']. Defaults to all workers that
+            haven't been provisioned yet, or failed.
+            
+    Returns:
+        the batch result of batch_runner.run_batch(), with worker positions as items.
+    '''
+    cluster = load_cluster(name)
     
-    print('Provisioning worker node')
+    if indexes is None:
+        indexes = unprovisioned_workers(cluster)
+        
+    # Start provisioning each worker as soon as its SSH service is up, instead of waiting for all.
+    index_of_ip = dict([(cluster['workers'][i]['public_ip'], i) for i in indexes])
+    ready = ((index_of_ip[ip], error) for ip, error in
+        traced_ssh_wait([cluster['workers'][i] for i in indexes]))
+        
+    batch = batch_runner.run_stream(ready, 
+        lambda index: provision_worker(name, index, data_fstype, wait_for_ssh = False)['fqdn'],
+        max_workers = max_workers, retries = retries, label = 'worker')
+    
+    if batch['results']:
+        update_fqdn_entries(name)
+        
+        sync_known_hosts(name)
+    
+    batch_runner.print_batch_report(batch, 'Provisioned worker nodes', label = 'worker')
+    
+    return batch
+    
+    
+    
+def provision_worker(name, index, data_fstype = None, wait_for_ssh = True, rerun = ()):
+    '''
+    Runs the provisioning steps that involve only the worker at position index in cluster['workers'],
+    and saves its details. Safe to run concurrently for different workers.
+    
+    Steps the worker completed before with the same inputs are skipped, so a worker that
+    failed halfway resumes at the step it failed in. See provisioning_pipeline().
+    
+    Pass wait_for_ssh = False if the worker is known to be reachable over SSH already.
+    
+    Returns worker details. Raises NodeError if a step failed.
+    '''
+    cluster = load_cluster(name)
+    worker = cluster['workers'][index]
+    
+    print('Provisioning worker node %s' % (worker['fqdn']))
     
     # Set the node's hostname. No underscrores allowed in hostname.
-    worker['hostname'] = 'hdpworkerlocal-%d' % (index + 1 if index >= 0 else len(cluster['workers']) + index + 1)
-    prov.exec_playbook(worker_ip, 'ansible/change_hostname.yaml',
-        variables = {
-            'new_hostname' : worker['hostname']
-        })
-
+    worker_number = worker.get('index', index + 1 if index >= 0 else len(cluster['workers']) + index + 1)
+    worker['hostname'] = 'hdpworkerlocal-%d' % (worker_number)
+    
+    # Each worker gets its own inventory directory, since workers are provisioned concurrently.
+    batch_prov = AnsibleBatchProvisioner(os.path.join(conf_dir(), cluster['name'], 'ansible', worker['fqdn']), forks = 1)
+    
+    failed_step = run_provisioning(name, cluster, [worker], batch_prov, data_fstype, rerun = rerun,
+        skip = () if wait_for_ssh else ('wait_for_ssh',))[worker['fqdn']]
+    if failed_step:
+        raise NodeError('Provisioning %s failed in step %s' % (worker['fqdn'], failed_step))
+        
+    return worker
+    
+    
+    
+def provision_nodes_batched(name, indexes = None, include_master = False, data_fstype = None, forks = 20,
+        rerun = ()):
+    '''
+    Provisions many nodes with one ansible-playbook run per phase for all of them, instead of
+    separate runs per node. Per node variables like hostname and public key file are passed
+    as inventory host variables.
+    
+    Steps are checkpointed per node, and steps a node completed before with the same inputs
+    are skipped. See provisioning_pipeline(). A node that fails a step is left out of later
+    steps. Details of every node, and the step it failed in if any, are saved to the cluster
+    file as 'provision_status'.
+    
+    Args:
+        indexes - positions of workers in cluster['workers']. Defaults to all workers that
+            haven't been provisioned yet, or failed.
+        include_master - provision the master node in the same runs.
+        forks - maximum number of nodes Ansible provisions in parallel.
+        rerun - names of steps to run even on nodes that completed them.
+        
+    Returns:
+        dict of node FQDN -> True if it was provisioned, False if it failed.
+    '''
+    cluster = load_cluster(name)
+    master = cluster['master']
+    
+    if indexes is None:
+        indexes = unprovisioned_workers(cluster)
+        
+    nodes = []
+    if include_master:
+        master['hostname'] = 'hdpmasterlocal'
+        nodes.append(master)
+    for index in indexes:
+        worker = cluster['workers'][index]
+        worker['hostname'] = 'hdpworkerlocal-%d' % (worker.get('index', index + 1))
+        nodes.append(worker)
+        
+    batch_prov = AnsibleBatchProvisioner(os.path.join(conf_dir(), cluster['name'], 'ansible'), forks = forks)
+    
+    failed = run_provisioning(name, cluster, nodes, batch_prov, data_fstype, rerun = rerun)
+    
+    provisioned_workers = [n['fqdn'] for n in nodes if n is not master and failed[n['fqdn']] is None]
+    if provisioned_workers:
+        # Update /etc/hosts on all nodes, because next playbook requires worker FQDNs to be resolvable
+        # on master.
+        update_fqdn_entries(name, forks = forks)
+        
+        sync_known_hosts(name, forks = forks)
+        
+    return collections.OrderedDict([(fqdn, failed_step is None) for fqdn, failed_step in failed.items()])
+    
+    
+    
+def unprovisioned_workers(cluster):
+    '''
+    Returns positions of workers that haven't been provisioned yet, or whose provisioning failed.
+    '''
+    return [i for i, w in enumerate(cluster['workers'])
+        if 'pubkey' not in w or w.get('provision_status', {}).get('ok') is False]
+    
+    
+    
+def run_provisioning(name, cluster, nodes, batch_prov, data_fstype = None, rerun = (), skip = ()):
+    '''
+    Runs provisioning_pipeline() on nodes of the cluster, and saves each node with its
+    'provision_status'.
+    
+    Returns:
+        OrderedDict of node FQDN -> name of the step it failed in, or None if it was provisioned.
+    '''
+    failed = provisioning_pipeline(name, cluster, batch_prov, data_fstype).run(nodes, rerun = rerun, skip = skip)
+    
+    for n in nodes:
+        n['provision_status'] = collections.OrderedDict([('ok', failed[n['fqdn']] is None),
+            ('failed_phase', failed[n['fqdn']])])
+        save_node(name, n)
+        
+    return failed
+    
+    
+    
+def provisioning_pipeline(name, cluster, batch_prov, data_fstype = None):
+    '''
+    Returns the pipeline.Pipeline of steps that provision nodes of a cluster, after they're
+    created:
+        wait_for_ssh - wait for SSH service to come up. Runs every time.
+        change_hostname - set the node's hostname to node['hostname'].
+        apt_cache - set up the cluster's apt caching proxy on its host, and point other nodes
+            at it. See enable_apt_cache().
+        distribute_hadoop - get the Hadoop tarball to nodes not booted from a golden image.
+        hadoop - install and configure Hadoop, and fetch the node's public key.
+        add_authorized_keys - let master SSH to the node.
+        
+    A step's inputs include checksums of the playbooks it runs, so a step runs again on all
+    nodes after its playbooks are changed.
+    '''
+    master = cluster['master']
+    
     pubkey_dir = os.path.join(conf_dir(), cluster['name'], 'pubkeys') 
-    if not os.path.exists(pubkey_dir):
-        os.makedirs(pubkey_dir)
+    ensure_dir(pubkey_dir)
+    
+    hadoop_checksum = artifact_dist.artifact_checksum(HADOOP_DISTRIBUTION)
+    hadoop_playbooks = ['ansible/hadoop.yaml', 'ansible/hadoop_base.yaml', 'ansible/hadoop_node.yaml',
+        'ansible/data_filesystem.yaml', 'ansible/sshd_config.j2'] + sorted(glob.glob('ansible/templates/*'))
     
-    pubkey_file = os.path.abspath( os.path.join(pubkey_dir, worker['fqdn'] + '.pub' ) )
-    prov.exec_playbook(worker_ip, 'ansible/hadoop.yaml',
+    def checksums(paths):
+        return collections.OrderedDict([(p, artifact_dist.artifact_checksum(p)) for p in paths])
+        
+    def host_vars(node, **variables):
+        variables['ansible_host'] = node['public_ip']
+        return variables
+        
+    def succeeded(results):
+        return dict([(fqdn, r['succeeded']) for fqdn, r in results.items()])
+        
+    def wait(nodes):
+        errors = wait_for_ssh(nodes)
+        return dict([(n['fqdn'], errors[n['public_ip']] is None) for n in nodes])
+        
+    # Set the nodes' hostnames. No underscrores allowed in hostname.
+    def change_hostname(nodes):
+        return succeeded(batch_prov.run_phase('ansible/change_hostname.yaml',
+            collections.OrderedDict([(n['fqdn'], host_vars(n, new_hostname = n['hostname'])) for n in nodes])))
+            
+    apt_cache = cluster.get('apt_cache')
+    
+    def apt_cache_role(n):
+        if apt_cache is None:
+            return None
+        return 'server' if n['fqdn'] == apt_cache['host'] else apt_cache['url']
+        
+    # The proxy's host is set up first, so that it's ready for the other nodes. Nodes that
+    # never used a proxy have nothing to do if the cluster doesn't have one.
+    def apt_cache_step(nodes):
+        results = dict([(n['fqdn'], True) for n in nodes])
+        
+        servers = [n for n in nodes if apt_cache_role(n) == 'server']
+        results.update(succeeded(batch_prov.run_phase('ansible/apt_cache_server.yaml',
+            collections.OrderedDict([(n['fqdn'], host_vars(n, private_ip = n['private_ip'])) for n in servers]),
+            common_vars = {'apt_cache_port' : APT_CACHE_PORT})))
+            
+        clients = [n for n in nodes if n not in servers and (apt_cache is not None or 'apt_cache' in n.get('steps', {}))]
+        if any([not results[n['fqdn']] for n in servers]):
+            print('Apt caching proxy could not be set up, so nodes that would use it are left out')
+            for n in clients:
+                results[n['fqdn']] = False
+            clients = []
+        results.update(succeeded(batch_prov.run_phase('ansible/apt_proxy.yaml',
+            collections.OrderedDict([(n['fqdn'], host_vars(n, apt_proxy = apt_cache['url'] if apt_cache else ''))
+                for n in clients]))))
+                
+        return results
+        
+    # Nodes booted from a golden image already have the software, and only need their own
+    # configuration. Others get the Hadoop tarball from each other, instead of all of them
+    # from the controller.
+    def distribute_hadoop(nodes):
+        results = distribute_artifact(name, HADOOP_DISTRIBUTION, [n for n in nodes if 'image' not in n],
+            forks = batch_prov.forks, work_dir = batch_prov.work_dir)
+        return dict([(n['fqdn'], results.get(n['fqdn'], True)) for n in nodes])
+        
+    def hadoop_vars(n):
         variables = {
             # If path does not end with a /, this becomes the name of the downloaded file
             # instead of the directory under which it should be saved.
-            'master_node_fqdn' : cluster['master']['fqdn'],
-            'worker_node_fqdn' : worker['fqdn'],
-            'local_pubkey_file' : pubkey_file
-        })
-
-    if os.path.isfile(pubkey_file):
-        with open(pubkey_file, 'r') as f:
-            pubkey = f.read().strip('\n')
+            'master_node_fqdn' : master['fqdn'],
+            'worker_node_fqdn' : '' if n is master else n['fqdn'],
+            'local_pubkey_file' : os.path.abspath( os.path.join(pubkey_dir, n['fqdn'] + '.pub' ) ),
+            'data_fs_report_file' : data_fs_report_path(cluster, n)
+        }
+        variables.update(data_filesystem_vars(n.get('data_disk_mb', 21 * 1024 if n is master else 372 * 1024), data_fstype))
+        # Configuration applied by apply_hadoop_conf(), so that new nodes get it too.
+        if cluster.get('hadoop_conf'):
+            variables['hadoop_conf'] = cluster['hadoop_conf']
+        if 'image' not in n:
+            variables['hadoop_artifact'] = n['artifacts'][hadoop_checksum]
+        return variables
+        
+    def hadoop(nodes):
+        results = {}
+        for playbook, imaged in [('ansible/hadoop.yaml', False), ('ansible/hadoop_node.yaml', True)]:
+            hosts = collections.OrderedDict([(n['fqdn'], host_vars(n, **hadoop_vars(n)))
+                for n in nodes if ('image' in n) == imaged])
+            results.update(succeeded(batch_prov.run_phase(playbook, hosts)))
+            
+        for n in nodes:
+            if not results[n['fqdn']]:
+                continue
+                
+            variables = hadoop_vars(n)
+            load_data_fs_report(n, variables['data_fs_report_file'])
             
-        worker['pubkey'] = pubkey
+            pubkey_file = variables['local_pubkey_file']
+            if os.path.isfile(pubkey_file):
+                with open(pubkey_file, 'r') as f:
+                    n['pubkey'] = f.read().strip('\n')
+            else:
+                print('Error: public key %s not found' % (pubkey_file))
+                results[n['fqdn']] = False
+                
+        return results
         
-    else:
-        print('Error: public key %s not found' % (pubkey_file))
-
-    # Save worker details to cluster file.
-    save_cluster(cluster)
+    # The master node should be able to SSH to itself and to workers, because some of the
+    # hadoop start/stop scripts require it.
+    def add_authorized_keys(nodes):
+        if 'pubkey' not in master:
+            return dict([(n['fqdn'], True) for n in nodes])
+            
+        return succeeded(batch_prov.run_phase('ansible/add_authorized_keys.yaml',
+            collections.OrderedDict([(n['fqdn'], host_vars(n)) for n in nodes]),
+            common_vars = {
+                'keys' : master['pubkey'] + '\n',
+                'cluster' : cluster['name']
+            }))
+            
+    return pipeline.Pipeline([
+            pipeline.Step('wait_for_ssh', wait, checkpoint = False),
+            pipeline.Step('change_hostname', change_hostname,
+                lambda n: [n['hostname'], checksums(['ansible/change_hostname.yaml'])]),
+            pipeline.Step('apt_cache', apt_cache_step,
+                lambda n: [apt_cache_role(n), checksums(['ansible/apt_cache_server.yaml', 'ansible/apt_proxy.yaml'])]),
+            pipeline.Step('distribute_hadoop', distribute_hadoop,
+                lambda n: None if 'image' in n else hadoop_checksum),
+            pipeline.Step('hadoop', hadoop,
+                lambda n: [hadoop_vars(n), n.get('image'), checksums(hadoop_playbooks)]),
+            pipeline.Step('add_authorized_keys', add_authorized_keys,
+                lambda n: [master.get('pubkey'), checksums(['ansible/add_authorized_keys.yaml'])])
+        ], cluster_store(conf_dir(), name))
+    
+    
+    
+def distribute_artifact(name, local_path, nodes = None, forks = 20, fanout = 2, work_dir = None):
+    '''
+    Gets a large artifact, like the Hadoop tarball, to nodes of the cluster using
+    artifact_dist.ArtifactDistributor. Nodes of the cluster that got the artifact before serve
+    it to the others. Every node records artifacts it has in node['artifacts'], as a dict of
+    checksum -> path on the node.
+    
+    Args:
+        nodes - node dicts to get the artifact to. Defaults to all nodes of the cluster.
+            Their 'artifacts' are updated in place, as well as in the cluster file.
+        work_dir - directory for Ansible inventories. Defaults to hdfsperfdata/<name>/ansible.
+        
+    Returns:
+        OrderedDict of node FQDN -> True if the node has the artifact.
+    '''
+    cluster = load_cluster(name)
+    if nodes is None:
+        nodes = membership.cluster_nodes(cluster)
+        
+    work_dir = work_dir or os.path.join(conf_dir(), cluster['name'], 'ansible')
+    distributor = artifact_dist.ArtifactDistributor(AnsibleBatchProvisioner(work_dir, forks = forks), fanout = fanout)
     
-    # The master node should be able to SSH to itself, because some of the hadoop
-    # start/stop scripts require it.
-    prov.exec_playbook(worker_ip, 'ansible/add_authorized_keys.yaml',
-        variables = {
-            'keys' : cluster['master']['pubkey'] + '\n',
-            'cluster' : cluster['name']
-        })
+    checksum = artifact_dist.artifact_checksum(local_path)
+    remote_path = distributor.remote_path(local_path)
+    
+    seeded = [n for n in membership.cluster_nodes(cluster) if n.get('artifacts', {}).get(checksum) == remote_path]
+    
+    with tracing.span('distribute_artifact', phase = 'distribute', artifact = os.path.basename(local_path)):
+        results = distributor.distribute(local_path, nodes, seeded)
+    
+    store = cluster_store(conf_dir(), name)
+    for n in nodes:
+        if results[n['fqdn']]:
+            n.setdefault('artifacts', collections.OrderedDict())[checksum] = remote_path
+            store.update_node(n['fqdn'], artifacts = n['artifacts'])
+            
+    return results
+    
+    
+    
+def enable_apt_cache(name, url = None):
+    '''
+    Makes nodes of the cluster install packages through an apt caching proxy, over the private
+    network. By default the proxy runs on master. It's set up, and pre-warmed with the packages
+    nodes install, when master is provisioned - or, if master was provisioned already, by
+    provision_nodes_batched(name, indexes = [], include_master = True). Other nodes are pointed
+    at it when they're provisioned.
+    
+    Args:
+        url - URL of a proxy that runs elsewhere, like on the controller, to use instead.
         
-    # Update /etc/hosts on all nodes, because next playbook requires worker FQDNs to be resolvable
-    # on master.
-    update_fqdn_entries(name)
+    Returns:
+        cluster['apt_cache'], with the FQDN of the node the proxy runs on as 'host', and its 'url'.
+    '''
+    with cluster_store(conf_dir(), name).transaction() as cluster:
+        master = cluster['master']
+        if url is not None:
+            cluster['apt_cache'] = collections.OrderedDict([('host', None), ('url', url)])
+        elif master.get('private_ip'):
+            cluster['apt_cache'] = collections.OrderedDict([('host', master['fqdn']),
+                ('url', 'http://%s:%d' % (master['private_ip'], APT_CACHE_PORT))])
+        else:
+            raise ValueError('Master node of cluster %s has not been created' % (name))
+            
+    return cluster['apt_cache']
+    
+    
     
+def disable_apt_cache(name):
+    '''
+    Stops using the apt caching proxy. Nodes stop using it when they're provisioned next.
+    '''
+    with cluster_store(conf_dir(), name).transaction() as cluster:
+        cluster.pop('apt_cache', None)
         
-    # Add this worker to known_hosts on master, because some of the hadoop
-    # start/stop scripts SSH to workers.
-    prov.exec_playbook(cluster['master']['public_ip'], 'ansible/add_known_host.yaml',
-        variables = {
-            'host_fqdn' : worker['fqdn']
-        })
-
         
+        
+def ssh_waiter():
+    # Linodes take a few minutes to boot the first time.
+    return ssh_ready.SshReadinessWaiter(timeout = 600)
+    
+    
+    
+def traced_ssh_wait(nodes):
+    '''
+    Waits for SSH service of nodes like ssh_ready.SshReadinessWaiter.wait(), and traces
+    the wait of each node.
+    '''
+    fqdn_of_ip = dict([(n['public_ip'], n['fqdn']) for n in nodes])
+    start = time.time()
+    for ip, error in ssh_waiter().wait(list(fqdn_of_ip.keys())):
+        tracing.record('wait_for_ssh', start, time.time(), node = fqdn_of_ip[ip], phase = 'wait_for_ssh',
+            ready = error is None)
+        yield ip, error
+        
+        
+        
+def wait_for_ssh(nodes):
+    '''
+    Waits for SSH service of all nodes. Returns a dict of public IP -> error, None if the node is ready.
+    '''
+    return dict(traced_ssh_wait(nodes))
+    
+    
+    
+def exec_playbook(prov, node, playbook, variables = None):
+    # Runs a playbook on a single node with AnsibleProvisioner, traced like the phases
+    # of AnsibleBatchProvisioner.
+    phase = os.path.splitext(os.path.basename(playbook))[0]
+    with tracing.span('ansible: ' + phase, node = node['fqdn'], phase = phase, playbook = playbook):
+        prov.exec_playbook(node['public_ip'], playbook, variables = variables)
+        
+        
+        
+def save_trace(name):
+    '''
+    Exports the steps traced so far in this process as a Chrome trace to
+    hdfsperfdata/<name>/traces/, prints their summary, and returns the trace file's path.
+    '''
+    trace_dir = os.path.join(conf_dir(), name, 'traces')
+    ensure_dir(trace_dir)
+    
+    trace_file = os.path.join(trace_dir, time.strftime('trace-%Y%m%d-%H%M%S.json'))
+    tracing.tracer().export(trace_file)
+    
+    tracing.print_summary(tracing.tracer().summary())
+    print('Trace saved to %s' % (trace_file))
+    return trace_file
     
-
     
-def update_fqdn_entries(name):
     
+def update_fqdn_entries(name, forks = 20):
+    '''
+    Updates /etc/hosts on all nodes of cluster to include all nodes.
+    
+    Only membership changes since a node was last synced are pushed to it, and nodes that are
+    already up to date are skipped, so adding a node updates one entry on every other node
+    instead of rewriting all of them. All nodes are updated in a single playbook run.
+    '''
     cluster = load_cluster(name)
     
-    # Update /etc/hosts on all nodes of cluster to include all nodes.
+    version = membership.update_membership(cluster)
     
-    prov = AnsibleProvisioner()
+    hosts = collections.OrderedDict()
+    for node in membership.cluster_nodes(cluster):
+        variables = membership.hosts_file_vars(cluster, node)
+        if variables is not None:
+            variables['ansible_host'] = node['public_ip']
+            hosts[node['fqdn']] = variables
+            
+    results = {}
+    if hosts:
+        print('Syncing /etc/hosts of %d of %d nodes to membership version %d' %
+            (len(hosts), len(membership.cluster_nodes(cluster)), version))
+            
+        batch_prov = AnsibleBatchProvisioner(os.path.join(conf_dir(), cluster['name'], 'ansible'), forks = forks)
+        results = batch_prov.run_phase('ansible/sync_hosts_file.yaml', hosts,
+            common_vars = {'cluster' : cluster['name']})
+    
+    with cluster_store(conf_dir(), name).transaction() as latest:
+        latest['membership'] = cluster['membership']
+        for node in membership.cluster_nodes(latest):
+            if node['fqdn'] in results and results[node['fqdn']]['succeeded']:
+                node['hosts_version'] = version
+            elif node['fqdn'] in results:
+                print('Error: /etc/hosts of %s could not be synced' % (node['fqdn']))
+            
     
-    host_entries = []
-    targets = []
     
-    # Add entry for master node.
-    host_entries.append( 
-        {   'ip' : cluster['master']['private_ip'], 
-            'fqdn' : cluster['master']['fqdn'],
-            'shortname' : cluster['master']['shortname'] 
-        })
-    targets.append(cluster['master']['public_ip'])
-
-
-    # Add entries for worker nodes.
-    for w in cluster['workers']:
-        host_entries.append( 
-            {   'ip' : w['private_ip'], 
-                'fqdn' : w['fqdn'],
-                'shortname' : w['shortname'] 
+def sync_known_hosts(name, forks = 20):
+    '''
+    Adds workers added since the last sync to known_hosts on master, and removes workers no
+    longer in the cluster, in a single playbook run. Some of the hadoop start/stop scripts
+    SSH from master to workers.
+    '''
+    cluster = load_cluster(name)
+    
+    version = membership.update_membership(cluster)
+    
+    master = cluster['master']
+    added, removed = membership.known_hosts_delta(cluster)
+    succeeded = True
+    if added or removed:
+        batch_prov = AnsibleBatchProvisioner(os.path.join(conf_dir(), cluster['name'], 'ansible'), forks = forks)
+        results = batch_prov.run_phase('ansible/add_known_host.yaml',
+            {
+                master['fqdn'] : {
+                    'ansible_host' : master['public_ip'],
+                    'host_fqdns' : added,
+                    'host_fqdns_remove' : removed
+                }
             })
+        succeeded = results[master['fqdn']]['succeeded']
+    
+    with cluster_store(conf_dir(), name).transaction() as latest:
+        latest['membership'] = cluster['membership']
+        if succeeded:
+            latest['master']['known_hosts_version'] = version
+        else:
+            print('Error: known_hosts of %s could not be synced' % (master['fqdn']))
             
-        targets.append(w['public_ip'])
     
     
-    prov.exec_playbook(targets, 'ansible/modify_hosts_file.yaml',
-        variables = {
-            'host_entries' : host_entries,
-            'cluster' : cluster['name']
-        })
+def run_benchmarks(name, suite_file = 'suites/standard.json', sample_secs = None):
+    '''
+    Runs the benchmark suite declared in suite_file on the cluster. HDFS and YARN should be
+    running. Raw outputs and results are saved to hdfsperfdata/<name>/benchmarks/<suite>-<time>/.
+    
+    Args:
+        sample_secs - if set, metrics of daemons and nodes are sampled at this interval while
+            the suite runs, into metrics.col in the results directory, tagged with the
+            benchmark run they're taken in. See metrics_sampler.py.
             
+    Returns:
+        results, as returned by benchmarks.BenchmarkRunner.run_suite(), with the 'run_id'
+        they're stored as in the results database.
+    '''
+    cluster = load_cluster(name)
+    suite = benchmarks.load_suite(suite_file)
+    
+    out_dir = os.path.join(conf_dir(), cluster['name'], 'benchmarks',
+        '%s-%s' % (suite['name'], time.strftime('%Y%m%d-%H%M%S')))
+    
+    # The directory's name is the run ID, so runs that start in the same second, like
+    # points of a sweep that fail right away, get their own.
+    unique_dir, n = out_dir, 1
+    while os.path.exists(unique_dir):
+        n += 1
+        unique_dir = '%s-%d' % (out_dir, n)
+    out_dir = unique_dir
+    ensure_dir(out_dir)
+    
+    sampler = None
+    if sample_secs:
+        sampler = cluster_sampler(cluster, os.path.join(out_dir, 'metrics.col'), sample_secs).start()
+        
+    runner = benchmarks.BenchmarkRunner(cluster['master']['public_ip'], cluster['master']['fqdn'], out_dir,
+        sampler = sampler)
     
+    try:
+        results = runner.run_suite(suite, cluster)
+    finally:
+        if sampler is not None:
+            sampler.stop()
     
-def load_cluster(name):
+    benchmarks.print_summary(benchmarks.summarize(results), 'Benchmark results of suite %s' % (suite['name']))
+    print('Results saved to %s' % (out_dir))
     
-    the_conf_dir = conf_dir()
-    cluster_file = os.path.join(the_conf_dir, name, name + '.json')
-    if not os.path.isfile(cluster_file):
-        return None
-
-    with open(cluster_file, 'r') as f:
-        cluster = json.load(f, object_pairs_hook=collections.OrderedDict)
+    store = results_store.ResultsStore(results_db(name))
+    try:
+        run_id = store.add_run(results, cluster_spec(cluster), os.path.basename(out_dir), out_dir)
+    finally:
+        store.close()
+    print('Results stored as run %s' % (run_id))
+    
+    results['run_id'] = run_id
+    return results
+    
+    
+    
+def cluster_sampler(cluster, path, interval_secs = 5):
+    '''
+    Returns a metrics_sampler.MetricsSampler for the NameNode and DataNodes of the cluster,
+    and /proc of all its nodes, that writes samples to path. Sources are named after nodes'
+    short names, like 'hdpmaster/namenode' and 'hdpworker-1/proc'.
+    '''
+    master = cluster['master']
+    
+    sources = [metrics_sampler.JmxSource(master['shortname'] + '/namenode',
+        'http://%s:%d' % (master['public_ip'], metrics_sampler.JMX_PORTS['namenode']), metrics_sampler.NAMENODE_BEANS)]
+    for w in cluster.get('workers', []):
+        sources.append(metrics_sampler.JmxSource(w['shortname'] + '/datanode',
+            'http://%s:%d' % (w['public_ip'], metrics_sampler.JMX_PORTS['datanode']), metrics_sampler.DATANODE_BEANS))
+            
+    for n in [master] + cluster.get('workers', []):
+        sources.append(metrics_sampler.ProcSource(n['shortname'] + '/proc', n['public_ip'], interval_secs))
+        
+    return metrics_sampler.MetricsSampler(sources, path, interval_secs)
+    
+    
+    
+def sample_metrics(name, duration_secs, interval_secs = 5, phase = None):
+    '''
+    Samples metrics of the cluster's daemons and nodes for duration_secs, like while
+    production load runs, into hdfsperfdata/<name>/metrics/<time>.col.
+    
+    Args:
+        phase - if set, samples are tagged with this phase.
+        
+    Returns:
+        path of the sample file.
+    '''
+    cluster = load_cluster(name)
+    
+    metrics_dir = os.path.join(conf_dir(), cluster['name'], 'metrics')
+    ensure_dir(metrics_dir)
+    path = os.path.join(metrics_dir, time.strftime('%Y%m%d-%H%M%S') + '.col')
+    
+    sampler = cluster_sampler(cluster, path, interval_secs).start()
+    try:
+        if phase:
+            with sampler.phase(phase):
+                time.sleep(duration_secs)
+        else:
+            time.sleep(duration_secs)
+    finally:
+        sampler.stop()
+        
+    print('%d samples saved to %s' % (sampler.samples, path))
+    return path
+    
+    
+    
+def results_db(name):
+    '''
+    Returns path of the benchmark results database of the cluster, next to its cluster JSON.
+    '''
+    return os.path.join(conf_dir(), name, 'results.db')
+    
+    
+    
+def cluster_spec(cluster):
+    '''
+    Returns what benchmark results of a cluster depend on - plans and number of its nodes,
+    Hadoop version, HDFS settings and other Hadoop configuration overrides - as an
+    OrderedDict that's stored with every run.
+    Nodes created before plan IDs were saved have a plan ID of None.
+    '''
+    workers = cluster.get('workers', [])
+    
+    worker_plans = collections.OrderedDict()
+    for w in workers:
+        plan = str(w.get('plan_id'))
+        worker_plans[plan] = worker_plans.get(plan, 0) + 1
+    
+    version = re.search(r'hadoop-([\d.]+)\.tar\.gz$', HADOOP_DISTRIBUTION)
+    
+    spec = collections.OrderedDict()
+    spec['master_plan_id'] = cluster.get('master', {}).get('plan_id')
+    spec['worker_plans'] = worker_plans
+    spec['workers'] = len(workers)
+    spec['hadoop_version'] = version.group(1) if version else os.path.basename(HADOOP_DISTRIBUTION)
+    spec['hdfs_site'] = hdfs_site_settings(cluster.get('hadoop_conf', {}).get('hdfs-site'))
+    spec['hadoop_conf'] = cluster.get('hadoop_conf', {})
+    return spec
+    
+    
+    
+def hdfs_site_settings(overrides = None, path = 'ansible/templates/hdfs-site.xml'):
+    '''
+    Returns properties of the hdfs-site.xml template as an OrderedDict of name -> value, with
+    values of properties overridden by overrides - the cluster's hadoop_conf['hdfs-site'].
+    Values that are other template variables are returned as they are.
+    '''
+    overrides = overrides or {}
+    
+    with open(path, 'r') as f:
+        template = f.read()
+        
+    settings = collections.OrderedDict()
+    for prop_name, value in re.findall(r'<name>\s*([^<{]+?)\s*</name>\s*<value>(.*?)</value>', template, re.S):
+        default = re.match(r"\{\{\s*conf\.get\('[^']+',\s*(.*?)\)\s*\}\}$", value.strip())
+        settings[prop_name] = default.group(1).strip('\'"') if default else value.strip()
+        
+    for prop_name, value in sorted(overrides.items()):
+        settings[prop_name] = str(value)
+    return settings
+    
+    
+    
+def compare_benchmarks(name, baseline, candidate, confidence = 0.95):
+    '''
+    Compares benchmark results of runs of a cluster, and prints the difference of every
+    metric with its confidence interval. Significant changes for the worse are flagged
+    as regressions.
+    
+    Args:
+        baseline - run ID or list of run IDs whose results are pooled. See 'python
+            results_store.py hdfsperfdata/<name>/results.db list'.
+        candidate - run ID or list of run IDs to compare with the baseline.
+        
+    Returns:
+        list of comparisons, as returned by results_store.ResultsStore.compare().
+    '''
+    baseline = [baseline] if isinstance(baseline, str) else baseline
+    candidate = [candidate] if isinstance(candidate, str) else candidate
+    
+    store = results_store.ResultsStore(results_db(name))
+    try:
+        specs = set([r['spec_key'] for r in store.runs() if r['run_id'] in baseline + candidate])
+        if len(specs) > 1:
+            print('Warning: runs are of clusters with different specs')
+        comparisons = store.compare(baseline, candidate, confidence)
+    finally:
+        store.close()
+    
+    results_store.print_comparison(comparisons, confidence)
+    regressions = [c for c in comparisons if c['regression']]
+    if regressions:
+        print('%d regressions' % (len(regressions)))
+    return comparisons
+    
+    
+    
+def apply_hadoop_conf(name, hadoop_conf, files = None, daemons = None, forks = 20):
+    '''
+    Changes Hadoop configuration of all nodes of the cluster to hadoop_conf, and saves it in
+    the cluster, so that nodes provisioned later get it too. Only configuration files whose
+    properties changed are pushed, and only daemons that read those properties are restarted.
+    
+    Args:
+        hadoop_conf - property overrides of configuration files, like
+            {'hdfs-site' : {'dfs.replication' : 3}}. See ansible/templates/*.xml.
+        files - configuration files to push, like ['hdfs-site']. Defaults to the changed ones.
+        daemons - daemons to restart, like ['namenode', 'datanode']. Defaults to the ones
+            that read changed properties. See sweep.RESTART_RULES.
+            
+    Returns:
+        True if all nodes were changed.
+    '''
+    cluster = load_cluster(name)
+    master = cluster['master']
+    
+    old_conf = cluster.get('hadoop_conf', {})
+    files = sweep.changed_files(old_conf, hadoop_conf) if files is None else files
+    daemons = sweep.daemons_to_restart(old_conf, hadoop_conf) if daemons is None else daemons
+    if not files:
+        return True
+        
+    hosts = collections.OrderedDict()
+    for node in [master] + cluster.get('workers', []):
+        hosts[node['fqdn']] = {
+            'ansible_host' : node['public_ip'],
+            'worker_node_fqdn' : '' if node is master else node['fqdn'],
+            'node_daemons' : ['namenode', 'resourcemanager'] if node is master else ['datanode', 'nodemanager']
+        }
+        
+    batch_prov = AnsibleBatchProvisioner(os.path.join(conf_dir(), cluster['name'], 'ansible'), forks = forks)
+    results = batch_prov.run_phase('ansible/hadoop_conf.yaml', hosts,
+        common_vars = {
+            'master_node_fqdn' : master['fqdn'],
+            'conf_files' : files,
+            'hadoop_conf' : hadoop_conf,
+            'restart_daemons' : daemons
+        })
+        
+    failed = [fqdn for fqdn, r in results.items() if not r['succeeded']]
+    for fqdn in failed:
+        print('Error: Hadoop configuration of %s could not be changed' % (fqdn))
+    
+    # Nodes that failed may have some of the files, so the new configuration is saved anyway.
+    with cluster_store(conf_dir(), name).transaction() as latest:
+        latest['hadoop_conf'] = hadoop_conf
+        
+    return not failed
+    
+    
+    
+def run_sweep(name, sweep_file):
+    '''
+    Runs the configuration parameter sweep declared in sweep_file on the cluster - see
+    sweep.py - storing benchmark results of every point in the results database. HDFS and
+    YARN should be running. Points and their scores are saved to
+    hdfsperfdata/<name>/sweeps/<sweep>-<time>/sweep.json.
+    
+    Returns:
+        the sweep's points and the best one, as returned by sweep.SweepRunner.run().
+    '''
+    cluster = load_cluster(name)
+    sweep_def = sweep.load_sweep(sweep_file)
+    
+    out_dir = os.path.join(conf_dir(), cluster['name'], 'sweeps',
+        '%s-%s' % (sweep_def['name'], time.strftime('%Y%m%d-%H%M%S')))
+        
+    runner = sweep.SweepRunner(sweep_def,
+        apply_conf = lambda conf, files, daemons: apply_hadoop_conf(name, conf, files, daemons),
+        run_suite = lambda: run_benchmarks(name, sweep_def['suite']),
+        base_conf = cluster.get('hadoop_conf'),
+        out_dir = out_dir)
+        
+    results = runner.run()
+    
+    sweep.print_points(results)
+    print('Sweep saved to %s' % (out_dir))
+    return results
+    
+    
+    
+def data_filesystem_vars(disk_size_mb, fstype = None):
+    '''
+    Returns playbook variables for the HDFS data filesystem, based on size of the data disk.
+    See ansible/data_filesystem.yaml.
+    
+    Args:
+        disk_size_mb - size of the HDFS data disk in MB.
+        fstype - 'ext4' or 'xfs'. Defaults to ext4.
+    '''
+    fstype = fstype or 'ext4'
+    
+    if fstype == 'xfs':
+        return {
+            'data_fstype' : 'xfs',
+            'data_mkfs_opts' : '',
+            'data_mount_opts' : 'noatime,inode64,logbufs=8'
+        }
+        
+    # HDFS stores data in few large block files, so large disks don't need as many inodes as
+    # ext4 creates by default. Fewer inode tables also make formatting and fsck faster.
+    if disk_size_mb >= 1024 * 1024:
+        mkfs_opts = '-T largefile4'
+    elif disk_size_mb >= 100 * 1024:
+        mkfs_opts = '-T largefile'
+    else:
+        mkfs_opts = ''
+        
+    return {
+        'data_fstype' : 'ext4',
+        'data_mkfs_opts' : mkfs_opts,
+        'data_reserved_blocks_pct' : 0,
+        'data_mount_opts' : 'noatime'
+    }
     
-    return cluster
     
 
+def data_fs_report_path(cluster, node):
+    
+    report_dir = os.path.join(conf_dir(), cluster['name'], 'data_fs')
+    ensure_dir(report_dir)
+        
+    return os.path.abspath( os.path.join(report_dir, node['fqdn'] + '.json') )
+    
+    
+    
+def load_data_fs_report(node, report_file):
+    '''
+    Saves HDFS data filesystem details and format time reported by the playbook into the node.
+    '''
+    if not os.path.isfile(report_file):
+        print('Error: data filesystem report %s not found' % (report_file))
+        return
+        
+    with open(report_file, 'r') as f:
+        report = json.load(f, object_pairs_hook=collections.OrderedDict)
+        
+    # delta is like "0:00:12.345678"
+    format_secs = None
+    if report.get('delta'):
+        h, m, sec = report['delta'].split(':')
+        format_secs = int(h) * 3600 + int(m) * 60 + float(sec)
+        
+    report['format_secs'] = format_secs
+    node['data_fs'] = report
+    
+    if format_secs is not None:
+        print('%s: %s format took %.1f secs (%s)' % (node['fqdn'], report['fstype'], format_secs, report['mkfs_opts']))
+    
+    
 
-
-
+def load_cluster(name):
+    
+    return cluster_store(conf_dir(), name).load()
+    
+    
+    
+def load_node(name, fqdn):
+    '''
+    Returns details of a single node of the cluster, without copying the whole cluster.
+    '''
+    return cluster_store(conf_dir(), name).get_node(fqdn)
+    
+    
+    
 def save_cluster(cluster):
     
-    the_conf_dir = conf_dir()
+    cluster_store(conf_dir(), cluster['name']).save(cluster)
+    
     
-    cluster_dir = os.path.join(the_conf_dir, cluster['name'])
-    if not os.path.exists(cluster_dir):
-        os.makedirs(cluster_dir)
     
-    cluster_file = os.path.join(cluster_dir, cluster['name'] + '.json')
-    with open(cluster_file, 'w') as f:
-        json.dump(cluster, f, indent = 4 * ' ')        
+def save_node(name, node):
+    '''
+    Saves details of a single node to the cluster file, replacing the master or worker with the
+    same FQDN. New workers are inserted in order of their index.
+    
+    Only the node's details are appended to the cluster's journal, so concurrent node tasks
+    don't overwrite each other's changes, and don't rewrite the whole cluster.
+    '''
+    cluster_store(conf_dir(), name).put_node(node)
     
     
     
@@ -353,12 +1417,29 @@ if __name__ == '__main__':
     
     #add_master_node(name)
     
+    #enable_apt_cache(name)
+    
     #provision_master_node(name)
     
-    add_worker_node(name)
+    #add_worker_node(name)
+    add_worker_nodes(name, 4, max_workers = 4)
+    #add_worker_nodes(name, 4, api_client = linode_client.LinodeApiClient())
+    #add_worker_nodes(name, 4, api_client = linode_client.LinodeApiClient(), golden_image = True)
     
     #provision_worker_node(name, 0)
-    provision_worker_node(name, 1)
+    provision_worker_nodes(name)
+    #provision_nodes_batched(name, include_master = True)
     
     #update_fqdn_entries(name)
     
+    #run_benchmarks(name, 'suites/standard.json')
+    #run_benchmarks(name, 'suites/standard.json', sample_secs = 5)
+    #sample_metrics(name, 600)
+    #compare_benchmarks(name, 'standard-20161017-101500', 'standard-20161018-093000')
+    
+    #apply_hadoop_conf(name, {'hdfs-site' : {'dfs.replication' : 3}})
+    #run_sweep(name, 'sweeps/hdfs_tuning.json')
+    
+    # Where provisioning time went, per step and node.
+    save_trace(name)
+    
@@ -0,0 +1,639 @@
+'''
+Linode API client that creates many linodes at once.
+
+linode_core.Core creates linodes one at a time, with a chain of blocking API calls for
+each linode - create, disks, config, boot, IP addresses. This client instead runs each of
+those steps for all linodes together, as API batch requests (api_action=batch). Batches
+too large for one request are split and sent concurrently over a pool of keep-alive HTTP
+connections. Requests are rate limited on the client side, and requests rejected by the
+API's rate limit are retried with exponential backoff. When a request fails without an
+answer, as with a dropped connection or a server error, only requests that can safely be
+applied twice are resent. linode.create requests of unknown outcome are reconciled against
+linode.list.
+
+ImageBaker turns the boot disk of a linode into an image, and new linodes can boot from
+an image instead of a fresh distribution by giving its ID as 'image' in their spec.
+
+It can be pointed at fake_linode_api.py instead of the real API by setting the endpoint,
+or the LINODE_API_ENDPOINT environment variable.
+'''
+
+from __future__ import print_function
+
+import os
+import os.path
+import time
+import base64
+import random
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    import httplib
+    from urllib import urlencode
+    from urlparse import urlparse
+    import Queue as queue
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlencode, urlparse
+    import queue
+
+import simplejson as json
+
+from linode_core import Linode
+
+import tracing
+
+
+DEFAULT_ENDPOINT = 'https://api.linode.com/'
+
+# Linode API v3 error codes that mean a request can be retried later.
+ERROR_RATE_LIMITED = 14
+ERROR_BATCH_TIMEOUT = 12
+RETRYABLE_ERRORS = (ERROR_RATE_LIMITED, ERROR_BATCH_TIMEOUT)
+
+# Code of errors made up by the client for requests that may or may not have been applied.
+ERROR_UNKNOWN_OUTCOME = -1
+
+# Actions that can be resent when it isn't known whether an earlier attempt was applied,
+# besides avail.* and *.list. Others, like linode.create, could be applied twice.
+IDEMPOTENT_ACTIONS = ('linode.update', 'linode.delete', 'linode.shutdown', 'image.delete')
+
+
+class LinodeApiError(Exception):
+
+    def __init__(self, action, errors):
+        '''
+        Args:
+            action - API action that failed.
+            errors - ERRORARRAY of the response, list of dicts with ERRORCODE and ERRORMESSAGE.
+        '''
+        Exception.__init__(self, '%s failed: %s' % (action,
+            '; '.join(['%s (%s)' % (e.get('ERRORMESSAGE'), e.get('ERRORCODE')) for e in errors])))
+        self.action = action
+        self.errors = errors
+        self.codes = [e.get('ERRORCODE') for e in errors]
+
+
+
+class RetryableHttpError(Exception):
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+
+class RateLimiter(object):
+    '''
+    Token bucket shared by all threads using a client.
+    '''
+
+    def __init__(self, requests_per_sec, burst = None):
+        self.rate = float(requests_per_sec)
+        self.capacity = float(burst or requests_per_sec)
+        self.tokens = self.capacity
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+
+    def acquire(self, count = 1):
+        '''
+        Blocks until count requests can be made.
+        '''
+        count = min(float(count), self.capacity)
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait = (count - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+
+class ConnectionPool(object):
+    '''
+    Pool of keep-alive HTTP connections to one host.
+    '''
+
+    def __init__(self, endpoint, size = 8, timeout = 60):
+        url = urlparse(endpoint)
+        self.https = url.scheme == 'https'
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path or '/'
+        self.timeout = timeout
+        self.idle = queue.Queue(maxsize = size)
+
+
+    def get(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            cls = httplib.HTTPSConnection if self.https else httplib.HTTPConnection
+            return cls(self.host, self.port, timeout = self.timeout)
+
+
+    def put(self, conn):
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+
+class LinodeApiClient(object):
+
+    def __init__(self, api_key = None, endpoint = None, pool_size = 8, requests_per_sec = 10,
+            max_retries = 5, backoff_secs = 1.0, batch_size = 25):
+        '''
+        Args:
+            api_key - Linode API key. Defaults to LINODE_API_KEY environment variable.
+            endpoint - API URL. Defaults to LINODE_API_ENDPOINT environment variable, or the Linode API.
+            pool_size - maximum number of idle keep-alive connections, and of concurrent batch requests.
+            requests_per_sec - client side limit of API requests per second. Each request in a batch counts.
+            max_retries - number of retries of rate limited or failed HTTP requests.
+            backoff_secs - delay before first retry. It doubles after every retry.
+            batch_size - maximum number of requests in one batch request.
+        '''
+        self.api_key = api_key or os.environ.get('LINODE_API_KEY')
+        self.endpoint = endpoint or os.environ.get('LINODE_API_ENDPOINT', DEFAULT_ENDPOINT)
+        self.pool = ConnectionPool(self.endpoint, pool_size)
+        self.pool_size = pool_size
+        self.limiter = RateLimiter(requests_per_sec)
+        self.max_retries = max_retries
+        self.backoff_secs = backoff_secs
+        self.batch_size = batch_size
+
+
+    def call(self, action, **params):
+        '''
+        Makes a single API call and returns its DATA. Raises LinodeApiError if it fails.
+        '''
+        return self.batch([dict(params, api_action = action)])[0]
+
+
+    def batch(self, requests, raise_errors = True):
+        '''
+        Makes many API calls together and returns their DATA in the same order.
+
+        Args:
+            requests - list of dicts of request parameters, each with an 'api_action'.
+            raise_errors - if False, failed calls return a LinodeApiError instead of raising it.
+        '''
+        chunks = [requests[i:i + self.batch_size] for i in range(0, len(requests), self.batch_size)]
+
+        if len(chunks) <= 1:
+            results = [self._send_batch(c) for c in chunks]
+        else:
+            pool = ThreadPool(processes = min(self.pool_size, len(chunks)))
+            try:
+                results = pool.map(self._send_batch, chunks)
+            finally:
+                pool.close()
+                pool.join()
+
+        data = [d for chunk in results for d in chunk]
+
+        if raise_errors:
+            for d in data:
+                if isinstance(d, LinodeApiError):
+                    raise d
+
+        return data
+
+
+    def close(self):
+        self.pool.close()
+
+
+    def _send_batch(self, requests):
+        # Resends only the requests that were rate limited, until none are left or retries run out.
+        # After a failure that may have happened after the API applied some requests, requests
+        # that aren't idempotent are not resent, and get an ERROR_UNKNOWN_OUTCOME error instead.
+        results = [None] * len(requests)
+        pending = list(range(len(requests)))
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self._backoff(attempt)
+
+            self.limiter.acquire(len(pending))
+            try:
+                responses = self._post([requests[i] for i in pending])
+            except (httplib.HTTPException, IOError, RetryableHttpError) as e:
+                if attempt == self.max_retries:
+                    raise
+                if not (isinstance(e, RetryableHttpError) and e.status == 429):
+                    unsafe = [i for i in pending if not is_idempotent(requests[i]['api_action'])]
+                    for i in unsafe:
+                        results[i] = LinodeApiError(requests[i]['api_action'], [{'ERRORCODE' : ERROR_UNKNOWN_OUTCOME,
+                            'ERRORMESSAGE' : 'Request may or may not have been applied: %s' % (e)}])
+                    pending = [i for i in pending if i not in unsafe]
+                    if not pending:
+                        break
+                print('Linode API request failed, retrying: %s' % (e))
+                continue
+
+            retry = []
+            for i, response in zip(pending, responses):
+                errors = [e for e in response.get('ERRORARRAY', []) if e.get('ERRORCODE')]
+                if not errors:
+                    results[i] = response.get('DATA')
+                    continue
+
+                error = LinodeApiError(response.get('ACTION', requests[i]['api_action']), errors)
+                if attempt < self.max_retries and any([c in RETRYABLE_ERRORS for c in error.codes]):
+                    retry.append(i)
+                results[i] = error
+
+            pending = retry
+            if not pending:
+                break
+
+        return results
+
+
+    def _backoff(self, attempt):
+        delay = self.backoff_secs * (2 ** (attempt - 1))
+        time.sleep(delay / 2.0 + random.uniform(0, delay / 2.0))
+
+
+    def _post(self, requests):
+        if len(requests) == 1:
+            params = dict(requests[0])
+        else:
+            params = {'api_action' : 'batch', 'api_requestArray' : json.dumps(requests)}
+        params['api_key'] = self.api_key
+
+        body = urlencode(params)
+        headers = {
+            'Content-Type' : 'application/x-www-form-urlencoded',
+            'Connection' : 'keep-alive'
+        }
+
+        conn = self.pool.get()
+        try:
+            conn.request('POST', self.pool.path, body, headers)
+            resp = conn.getresponse()
+            content = resp.read()
+        except:
+            conn.close()
+            raise
+
+        if resp.getheader('connection', '').lower() == 'close':
+            conn.close()
+        else:
+            self.pool.put(conn)
+
+        if resp.status == 429 or resp.status >= 500:
+            raise RetryableHttpError(resp.status, 'HTTP %d from %s' % (resp.status, self.endpoint))
+
+        if resp.status != 200:
+            raise LinodeApiError(params['api_action'],
+                [{'ERRORCODE' : resp.status, 'ERRORMESSAGE' : 'HTTP %d' % (resp.status)}])
+
+        data = json.loads(content)
+        return data if isinstance(data, list) else [data]
+
+
+
+class LinodeCreator(object):
+    '''
+    Creates linodes from the same kind of specs as linode_core.Core.create_linode, but
+    for many linodes at once. Every step is one round of batched API calls for all linodes.
+    '''
+
+    def __init__(self, client, root_ssh_key_file = '~/.ssh/id_rsa.pub'):
+        '''
+        Args:
+            client - a LinodeApiClient.
+            root_ssh_key_file - public key authorized for root on new linodes.
+        '''
+        self.client = client
+        self.root_ssh_key_file = os.path.expanduser(root_ssh_key_file)
+        self._distributions = None
+        self._kernels = None
+
+
+    def create_linodes(self, specs):
+        '''
+        Creates, configures and boots a linode for every spec.
+
+        Args:
+            specs - list of linode specs as accepted by linode_core.Core.create_linode.
+
+        Returns:
+            List with a linode_core.Linode for each spec, in the same order, or a LinodeApiError
+            for specs that failed. Linodes that failed after being created are deleted, and so
+            are all linodes created so far if an exception is raised.
+        '''
+        distributions, kernels = self._lookup_ids()
+        existing = set([l['LINODEID'] for l in self.client.call('linode.list')])
+
+        nodes = []
+        for spec in specs:
+            node = Linode()
+            node.spec = spec
+            node.error = None
+            nodes.append(node)
+
+        def step(name, requests_of_node):
+            # Runs one batch for all nodes that haven't failed yet. requests_of_node returns
+            # a list of requests for a node, and the node gets the list of their results.
+            active = [n for n in nodes if n.error is None]
+            requests = []
+            owners = []
+            for n in active:
+                for r in requests_of_node(n):
+                    requests.append(r)
+                    owners.append(n)
+
+            with tracing.span('linode api: ' + name, phase = 'create', requests = len(requests)):
+                results = self.client.batch(requests, raise_errors = False)
+
+            per_node = {}
+            for n, r in zip(owners, results):
+                per_node.setdefault(id(n), []).append(r)
+                if isinstance(r, LinodeApiError) and n.error is None:
+                    n.error = r
+            return per_node
+
+        # An exception, like API requests failing after all retries, fails every node.
+        try:
+            created = step('create', lambda n: [{
+                'api_action' : 'linode.create',
+                'DatacenterID' : n.spec['datacenter'],
+                'PlanID' : n.spec['plan_id'],
+                'PaymentTerm' : 1
+            }])
+            for n in nodes:
+                if n.error is None:
+                    n.id = created[id(n)][0]['LinodeID']
+            self._reconcile_creates(nodes, existing)
+
+            # Label, disks and private IP of each linode don't depend on each other.
+            disks = step('disks', lambda n: [{
+                    'api_action' : 'linode.update',
+                    'LinodeID' : n.id,
+                    'Label' : n.spec['label'],
+                    'lpm_displayGroup' : n.spec.get('group', '')
+                },
+                {   'api_action' : 'linode.ip.addprivate',
+                    'LinodeID' : n.id
+                }] + self._disk_requests(n, distributions))
+            for n in nodes:
+                if n.error is None:
+                    n.disk_ids = [disk_id(d) for d in disks[id(n)][2:]]
+
+            configs = step('config', lambda n: [{
+                'api_action' : 'linode.config.create',
+                'LinodeID' : n.id,
+                'KernelID' : kernels[n.spec['kernel']],
+                'Label' : n.spec['label'],
+                'DiskList' : ','.join([str(d) for d in n.disk_ids])
+            }])
+
+            step('boot', lambda n: [{
+                'api_action' : 'linode.boot',
+                'LinodeID' : n.id,
+                'ConfigID' : configs[id(n)][0]['ConfigID']
+            }])
+
+            ips = step('ip', lambda n: [{
+                'api_action' : 'linode.ip.list',
+                'LinodeID' : n.id
+            }])
+            for n in nodes:
+                if n.error is None:
+                    n.public_ip = [ip['IPADDRESS'] for ip in ips[id(n)][0] if ip['ISPUBLIC']]
+                    private = [ip['IPADDRESS'] for ip in ips[id(n)][0] if not ip['ISPUBLIC']]
+                    n.private_ip = private[0] if private else None
+        except Exception:
+            self._delete([n for n in nodes if getattr(n, 'id', None) is not None])
+            raise
+
+        self._delete([n for n in nodes if n.error is not None and getattr(n, 'id', None) is not None])
+
+        return [n.error if n.error is not None else n for n in nodes]
+
+
+    def _delete(self, nodes):
+        if nodes:
+            self.client.batch([{'api_action' : 'linode.delete', 'LinodeID' : n.id, 'skipChecks' : 1} for n in nodes],
+                raise_errors = False)
+
+
+    def _reconcile_creates(self, nodes, existing):
+        # A linode.create whose response was lost may or may not have created a linode. Linodes
+        # that weren't there before, and aren't another node's, are given to such nodes so that
+        # they are set up, or deleted if they fail, instead of being left behind.
+        unknown = [n for n in nodes if n.error is not None and ERROR_UNKNOWN_OUTCOME in n.error.codes]
+        if not unknown:
+            return
+
+        claimed = set([n.id for n in nodes if n.error is None])
+        new = [l for l in self.client.call('linode.list')
+            if l['LINODEID'] not in existing and l['LINODEID'] not in claimed]
+
+        for n in unknown:
+            matching = [l for l in new
+                if l['DATACENTERID'] == int(n.spec['datacenter']) and l['PLANID'] == int(n.spec['plan_id'])]
+            if matching:
+                new.remove(matching[0])
+                n.id = matching[0]['LINODEID']
+                n.error = None
+
+
+    def _disk_requests(self, node, distributions):
+        spec = node.spec
+        disks = spec['disks']
+
+        # A spec with an 'image' boots from that image instead of a fresh distribution.
+        boot = {
+            'LinodeID' : node.id,
+            'Label' : 'boot',
+            'Size' : disks['boot']['disk_size'],
+            'rootPass' : spec.get('root_password') or self._random_password(),
+            'rootSSHKey' : self._root_ssh_key()
+        }
+        if spec.get('image'):
+            boot.update({'api_action' : 'linode.disk.createfromimage', 'ImageID' : spec['image']})
+        else:
+            boot.update({'api_action' : 'linode.disk.createfromdistribution',
+                'DistributionID' : distributions[spec['distribution']]})
+
+        requests = [boot,
+            {   'api_action' : 'linode.disk.create',
+                'LinodeID' : node.id,
+                'Label' : 'swap',
+                'Type' : 'swap',
+                'Size' : disks['swap']['disk_size']
+            }]
+
+        for d in disks.get('others', []):
+            requests.append({
+                'api_action' : 'linode.disk.create',
+                'LinodeID' : node.id,
+                'Label' : d['label'],
+                'Type' : d.get('type', 'raw'),
+                'Size' : d['disk_size']
+            })
+
+        return requests
+
+
+    def _lookup_ids(self):
+        if self._distributions is None:
+            dists, kernels = self.client.batch([
+                {'api_action' : 'avail.distributions'},
+                {'api_action' : 'avail.kernels'}
+            ])
+            self._distributions = dict([(d['LABEL'], d['DISTRIBUTIONID']) for d in dists])
+            self._kernels = KernelIds(kernels)
+
+        return self._distributions, self._kernels
+
+
+    def _root_ssh_key(self):
+        if not os.path.isfile(self.root_ssh_key_file):
+            return ''
+        with open(self.root_ssh_key_file, 'r') as f:
+            return f.read().strip()
+
+
+    def _random_password(self):
+        return base64.b64encode(os.urandom(24)).decode('ascii')
+
+
+
+class ImageBaker(object):
+    '''
+    Turns the boot disk of a linode into an image that new linodes can be created from,
+    and finds and removes such images by label.
+    '''
+
+    def __init__(self, client, poll_secs = 5, timeout = 1800):
+        '''
+        Args:
+            client - a LinodeApiClient.
+            poll_secs - seconds between checks of jobs and image status.
+            timeout - seconds to wait for a job or an image before giving up.
+        '''
+        self.client = client
+        self.poll_secs = poll_secs
+        self.timeout = timeout
+
+
+    def images(self, label_prefix = ''):
+        '''
+        Returns images whose label starts with label_prefix, newest first.
+        '''
+        images = [i for i in self.client.call('image.list') if i['LABEL'].startswith(label_prefix)]
+        return sorted(images, key = lambda i: i.get('CREATE_DT', ''), reverse = True)
+
+
+    def find(self, label):
+        '''
+        Returns the available image with given label, or None.
+        '''
+        for image in self.images(label):
+            if image['LABEL'] == label and image['STATUS'] == 'available':
+                return image
+        return None
+
+
+    def bake(self, linode_id, disk_id, label, description = ''):
+        '''
+        Shuts a linode down, images its disk, and waits until the image is available.
+
+        Returns:
+            ImageID of the new image.
+        '''
+        job = self.client.call('linode.shutdown', LinodeID = linode_id)
+        self.wait_job(linode_id, job['JobID'])
+
+        result = self.client.call('linode.disk.imagize', LinodeID = linode_id, DiskID = disk_id,
+            Label = label, Description = description)
+        image_id = result.get('ImageID', result.get('IMAGEID'))
+
+        self._poll(lambda: [i for i in self.client.call('image.list', ImageID = image_id)
+            if i['STATUS'] == 'available'], 'image %s' % (label))
+
+        return image_id
+
+
+    def delete(self, image_ids):
+        self.client.batch([{'api_action' : 'image.delete', 'ImageID' : i} for i in image_ids],
+            raise_errors = False)
+
+
+    def wait_job(self, linode_id, job_id):
+        '''
+        Waits for a job of a linode, like a shutdown, to finish. Raises LinodeApiError if it failed.
+        '''
+        def finished():
+            jobs = self.client.call('linode.job.list', LinodeID = linode_id, JobID = job_id)
+            return [j for j in jobs if j.get('HOST_FINISH_DT')]
+
+        job = self._poll(finished, 'job %s of linode %s' % (job_id, linode_id))[0]
+        if not job.get('HOST_SUCCESS'):
+            raise LinodeApiError(job.get('ACTION', 'linode.job'),
+                [{'ERRORCODE' : 0, 'ERRORMESSAGE' : job.get('HOST_MESSAGE', 'Job failed')}])
+
+
+    def _poll(self, check, what):
+        deadline = time.time() + self.timeout
+        while True:
+            result = check()
+            if result:
+                return result
+            if time.time() > deadline:
+                raise LinodeApiError('poll', [{'ERRORCODE' : 0,
+                    'ERRORMESSAGE' : 'Timed out waiting for %s' % (what)}])
+            time.sleep(self.poll_secs)
+
+
+
+def is_idempotent(action):
+    return action.startswith('avail.') or action.endswith('.list') or action in IDEMPOTENT_ACTIONS
+
+
+
+def disk_id(result):
+    # Disk creation calls don't agree on the case of DiskID.
+    return result.get('DiskID', result.get('DISKID'))
+
+
+
+class KernelIds(object):
+    '''
+    Maps kernel names to IDs. Kernel labels include the version, like
+    "Latest 64 bit (4.1.5-x86_64-linode61)", so names also match labels that start with them.
+    '''
+
+    def __init__(self, kernels):
+        self.kernels = [(k['LABEL'], k['KERNELID']) for k in kernels]
+
+
+    def __getitem__(self, name):
+        for label, kernel_id in self.kernels:
+            if label == name:
+                return kernel_id
+        for label, kernel_id in self.kernels:
+            if label.startswith(name):
+                return kernel_id
+        raise KeyError(name)
@@ -0,0 +1,116 @@
+'''
+Tracks cluster membership, so that /etc/hosts and known_hosts of nodes can be updated with
+only the changes since they were last synced, instead of all entries every time.
+
+cluster['membership'] keeps the current name -> private IP entries of all nodes, and a
+log of changes, each tagged with the membership version it created. Every node records
+the version its /etc/hosts was last synced to as 'hosts_version', and the master records
+the version of its known_hosts as 'known_hosts_version'. A node that has never been synced
+gets all entries.
+'''
+
+from __future__ import print_function
+
+import collections
+
+
+def cluster_nodes(cluster):
+    '''
+    Returns all nodes of the cluster that have been created, master first.
+    '''
+    nodes = []
+    if cluster['master'].get('fqdn'):
+        nodes.append(cluster['master'])
+    nodes.extend(cluster['workers'])
+    return nodes
+
+
+
+def update_membership(cluster):
+    '''
+    Records nodes that were added, removed, or whose private IP changed since the last update.
+
+    Returns:
+        the current membership version.
+    '''
+    membership = cluster.setdefault('membership', collections.OrderedDict([
+        ('version', 0),
+        ('entries', collections.OrderedDict()),
+        ('changes', [])
+    ]))
+    entries = membership['entries']
+
+    current = collections.OrderedDict([(n['fqdn'], n['private_ip']) for n in cluster_nodes(cluster)])
+
+    changes = []
+    for fqdn, ip in current.items():
+        if entries.get(fqdn) != ip:
+            changes.append((fqdn, ip))
+    for fqdn in entries:
+        if fqdn not in current:
+            changes.append((fqdn, None))
+
+    if changes:
+        membership['version'] += 1
+        for fqdn, ip in changes:
+            membership['changes'].append([membership['version'], fqdn, ip])
+            if ip is None:
+                del entries[fqdn]
+            else:
+                entries[fqdn] = ip
+
+    return membership['version']
+
+
+
+def delta(cluster, since_version):
+    '''
+    Returns (added, removed) changes of membership after since_version. added is an
+    OrderedDict of FQDN -> private IP of new or changed entries, removed is a list of
+    FQDNs that are no longer members. If since_version is None, added has all entries.
+    '''
+    membership = cluster['membership']
+
+    if since_version is None:
+        return collections.OrderedDict(membership['entries']), []
+
+    latest = collections.OrderedDict()
+    for version, fqdn, ip in membership['changes']:
+        if version > since_version:
+            latest[fqdn] = ip
+
+    added = collections.OrderedDict([(fqdn, ip) for fqdn, ip in latest.items() if ip is not None])
+    removed = [fqdn for fqdn, ip in latest.items() if ip is None]
+    return added, removed
+
+
+
+def hosts_file_vars(cluster, node):
+    '''
+    Returns variables of sync_hosts_file.yaml that bring node's /etc/hosts up to date,
+    or None if it's already up to date.
+    '''
+    since_version = node.get('hosts_version')
+    if since_version == cluster['membership']['version']:
+        return None
+
+    added, removed = delta(cluster, since_version)
+
+    variables = {
+        'hosts_add' : [{'ip' : ip, 'fqdn' : fqdn} for fqdn, ip in added.items()],
+        'hosts_remove' : removed
+    }
+    if since_version is None:
+        variables['hosts_full'] = True
+
+    return variables
+
+
+
+def known_hosts_delta(cluster):
+    '''
+    Returns (added, removed) worker FQDNs since master's known_hosts was last synced.
+    '''
+    added, removed = delta(cluster, cluster['master'].get('known_hosts_version'))
+    master_fqdn = cluster['master']['fqdn']
+    return [fqdn for fqdn in added if fqdn != master_fqdn], removed
@@ -0,0 +1,598 @@
+'''
+Samples metrics of HDFS daemons and of the nodes they run on, while benchmarks or other load
+run, into time series that can be lined up with benchmark phases.
+
+Two kinds of sources are sampled, each by its own thread, at a fixed interval:
+
+    JmxSource - polls the JMX servlet of a NameNode (port 50070) or DataNode (port 50075)
+        over a keep-alive HTTP connection, for a few beans only - see NAMENODE_BEANS and
+        DATANODE_BEANS - like RPC queue time, GC time and bytes read and written.
+
+    ProcSource - runs a small shell loop on a node over a single SSH connection, which prints
+        /proc/stat, /proc/diskstats, /proc/net/dev, /proc/meminfo and /proc/loadavg every
+        interval, for CPU, disk and network utilization.
+
+Counters, like bytes written or GC milliseconds, are turned into rates per second between
+samples. Samples are timestamped on the controller, so sources on different nodes line up
+even if their clocks don't.
+
+Samples are kept in array.array columns - 8 bytes a value - and appended to a columnar file
+in chunks, every flush_secs and when sampling stops. A chunk is the magic 'HPSC', the length
+of a JSON header, the header - with the name, type and length of each column, and phases so
+far - and then each column's values, little-endian. Every sample also has the index of the
+phase it was taken in, like a benchmark run marked with MetricsSampler.phase(), or -1.
+
+Usage:
+    python metrics_sampler.py metrics.col [--source SOURCE]
+
+prints the mean of every metric in every phase of a sample file.
+'''
+
+from __future__ import print_function
+
+import re
+import sys
+import time
+import math
+import array
+import fnmatch
+import struct
+import argparse
+import threading
+import contextlib
+import subprocess
+import collections
+
+try:
+    import httplib
+    from urllib import quote
+    from urlparse import urlparse
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import quote, urlparse
+
+import simplejson as json
+
+
+GAUGE = 'gauge'
+COUNTER = 'counter'
+
+JMX_PORTS = {'namenode' : 50070, 'datanode' : 50075}
+
+# Attributes of the JVM metrics bean of every daemon.
+JVM_METRICS = [
+    ('GcTimeMillis', 'gc_ms_per_sec', COUNTER),
+    ('GcCount', 'gcs_per_sec', COUNTER),
+    ('MemHeapUsedM', 'heap_used_mb', GAUGE),
+    ('ThreadsBlocked', 'threads_blocked', GAUGE)
+]
+
+# JMX query -> attributes of the first matching bean, as (attribute, metric, kind).
+NAMENODE_BEANS = collections.OrderedDict([
+    ('Hadoop:service=NameNode,name=RpcActivityForPort*', [
+        ('RpcQueueTimeAvgTime', 'rpc_queue_time_avg_ms', GAUGE),
+        ('RpcProcessingTimeAvgTime', 'rpc_processing_time_avg_ms', GAUGE),
+        ('RpcQueueTimeNumOps', 'rpc_calls_per_sec', COUNTER),
+        ('CallQueueLength', 'rpc_call_queue_length', GAUGE),
+        ('NumOpenConnections', 'rpc_open_connections', GAUGE)
+    ]),
+    ('Hadoop:service=NameNode,name=FSNamesystem', [
+        ('FilesTotal', 'files_total', GAUGE),
+        ('BlocksTotal', 'blocks_total', GAUGE),
+        ('PendingReplicationBlocks', 'pending_replication_blocks', GAUGE)
+    ]),
+    ('Hadoop:service=NameNode,name=JvmMetrics', JVM_METRICS)
+])
+
+DATANODE_BEANS = collections.OrderedDict([
+    ('Hadoop:service=DataNode,name=DataNodeActivity-*', [
+        ('BytesRead', 'bytes_read_per_sec', COUNTER),
+        ('BytesWritten', 'bytes_written_per_sec', COUNTER),
+        ('BlocksRead', 'blocks_read_per_sec', COUNTER),
+        ('BlocksWritten', 'blocks_written_per_sec', COUNTER),
+        ('ReadBlockOpAvgTime', 'read_block_op_avg_ms', GAUGE),
+        ('WriteBlockOpAvgTime', 'write_block_op_avg_ms', GAUGE)
+    ]),
+    ('Hadoop:service=DataNode,name=JvmMetrics', JVM_METRICS)
+])
+
+# Shell loop that prints /proc files every %(interval)s seconds, in sections.
+PROC_SCRIPT = '''while true; do
+echo '# stat'; grep '^cpu ' /proc/stat
+echo '# diskstats'; cat /proc/diskstats
+echo '# net'; tail -n +3 /proc/net/dev
+echo '# meminfo'; grep -E '^(MemTotal|MemFree|MemAvailable|Buffers|Cached):' /proc/meminfo
+echo '# loadavg'; cat /proc/loadavg
+echo '# end'
+sleep %(interval)s
+done'''
+
+# Whole disks, not partitions, that diskstats utilization is reported for.
+DISK_NAME = re.compile(r'^(sd[a-z]+|xvd[a-z]+|vd[a-z]+|nvme\d+n\d+)$')
+
+CHUNK_MAGIC = b'HPSC'
+
+NAN = float('nan')
+
+
+class SampleBuffer(object):
+    '''
+    Samples of one source, as a column of times, a column of phase indexes, and a column
+    per metric. A metric that first shows up in a later sample is back-filled with NaN.
+    '''
+
+    def __init__(self):
+        self.times = array.array('d')
+        self.phases = array.array('i')
+        self.columns = collections.OrderedDict()
+
+
+    def add(self, t, phase, values):
+        for metric in values:
+            if metric not in self.columns:
+                self.columns[metric] = array.array('d', [NAN] * len(self.times))
+
+        self.times.append(t)
+        self.phases.append(phase)
+        for metric, column in self.columns.items():
+            value = values.get(metric)
+            column.append(NAN if value is None else value)
+
+
+    def __len__(self):
+        return len(self.times)
+
+
+
+class JmxSource(object):
+
+    def __init__(self, name, url, beans, timeout = 5):
+        '''
+        Args:
+            name - name of the source, like 'hdpmaster/namenode'.
+            url - URL of the daemon's web server, like http://10.0.0.1:50070.
+            beans - OrderedDict of JMX query -> attributes, like NAMENODE_BEANS.
+        '''
+        self.name = name
+        self.url = urlparse(url)
+        self.beans = beans
+        self.timeout = timeout
+        self.conn = None
+        self.last = {}
+
+
+    def sample(self):
+        '''
+        Returns a dict of metric -> value, for attributes of beans that could be read.
+        '''
+        now = time.time()
+        values = {}
+        for query, attributes in self.beans.items():
+            bean = self._query(query)
+            if bean is None:
+                continue
+            for attribute, metric, kind in attributes:
+                if attribute in bean:
+                    values[metric] = self._value(metric, kind, float(bean[attribute]), now)
+        return values
+
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+    def _query(self, query):
+        '''
+        Returns the first bean, by name, matching query, or None if the request failed.
+        '''
+        path = '/jmx?qry=' + quote(query, safe = '=,:*')
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = httplib.HTTPConnection(self.url.hostname, self.url.port, timeout = self.timeout)
+            try:
+                self.conn.request('GET', path, headers = {'Connection' : 'keep-alive'})
+                response = self.conn.getresponse()
+                body = response.read()
+                if response.status != 200:
+                    return None
+                beans = sorted(json.loads(body.decode('utf-8')).get('beans', []), key = lambda b: b.get('name'))
+                return beans[0] if beans else None
+            except (httplib.HTTPException, IOError, ValueError):
+                # The daemon may have closed an idle connection, or restarted. Retry once on
+                # a new connection.
+                self.close()
+        return None
+
+
+    def _value(self, metric, kind, value, now):
+        if kind == GAUGE:
+            return value
+
+        last = self.last.get(metric)
+        self.last[metric] = (now, value)
+        if last is None or value < last[1] or now <= last[0]:
+            # First sample, or the counter was reset by a restart of the daemon.
+            return None
+        return (value - last[1]) / (now - last[0])
+
+
+
+class ProcSource(object):
+
+    def __init__(self, name, host = None, interval = 5, ssh_user = 'root',
+            ssh_options = ('-o', 'BatchMode=yes', '-o', 'StrictHostKeyChecking=no')):
+        '''
+        Args:
+            name - name of the source, like 'hdpworker-1/proc'.
+            host - IP address of the node. Samples the local /proc if None.
+            interval - seconds between samples.
+        '''
+        self.name = name
+        script = PROC_SCRIPT % {'interval' : interval}
+        if host is None:
+            self.cmd = ['sh', '-c', script]
+        else:
+            self.cmd = ['ssh'] + list(ssh_options) + ['%s@%s' % (ssh_user, host), script]
+        self.proc = None
+        self.last = None
+
+
+    def start(self):
+        self.proc = subprocess.Popen(self.cmd, stdout = subprocess.PIPE, stdin = subprocess.PIPE,
+            universal_newlines = True)
+
+
+    def snapshots(self):
+        '''
+        Yields (time, raw counters) for every snapshot the loop prints, until it exits.
+        '''
+        section = None
+        snapshot = {}
+        for line in iter(self.proc.stdout.readline, ''):
+            line = line.strip()
+            if line.startswith('# '):
+                section = line[2:]
+                if section == 'end':
+                    yield time.time(), snapshot
+                    snapshot = {}
+                continue
+            parse_proc_line(section, line, snapshot)
+
+
+    def rates(self, t, snapshot):
+        '''
+        Returns metrics of a snapshot, with counters as rates since the last snapshot.
+        '''
+        last, self.last = self.last, (t, snapshot)
+        return proc_metrics(last[1] if last else None, snapshot, t - last[0] if last else 0)
+
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+
+
+
+def parse_proc_line(section, line, snapshot):
+    fields = line.split()
+    if section == 'stat' and fields and fields[0] == 'cpu':
+        # user nice system idle iowait irq softirq steal, in clock ticks.
+        snapshot['cpu'] = [float(v) for v in fields[1:9]]
+
+    elif section == 'diskstats' and len(fields) >= 13 and DISK_NAME.match(fields[2]):
+        # Sectors read, sectors written and milliseconds spent doing I/O.
+        snapshot['disk.' + fields[2]] = (float(fields[5]), float(fields[9]), float(fields[12]))
+
+    elif section == 'net' and ':' in line:
+        interface, counters = line.split(':', 1)
+        counters = counters.split()
+        if interface.strip() != 'lo' and len(counters) >= 9:
+            snapshot['net.' + interface.strip()] = (float(counters[0]), float(counters[8]))
+
+    elif section == 'meminfo' and len(fields) >= 2:
+        snapshot['mem.' + fields[0].rstrip(':')] = float(fields[1])
+
+    elif section == 'loadavg' and len(fields) >= 3:
+        snapshot['load1'] = float(fields[0])
+
+
+
+def proc_metrics(last, current, elapsed):
+    '''
+    Returns CPU, disk, network and memory metrics from two snapshots of raw /proc counters
+    taken elapsed seconds apart. Only gauges if there's no last snapshot.
+    '''
+    metrics = {}
+    if 'load1' in current:
+        metrics['load1'] = current['load1']
+    if 'mem.MemTotal' in current:
+        available = current.get('mem.MemAvailable', current.get('mem.MemFree', 0) +
+            current.get('mem.Buffers', 0) + current.get('mem.Cached', 0))
+        metrics['mem_used_mb'] = (current['mem.MemTotal'] - available) / 1024.0
+
+    if not last or elapsed <= 0:
+        return metrics
+
+    if 'cpu' in current and 'cpu' in last:
+        deltas = [c - l for c, l in zip(current['cpu'], last['cpu'])]
+        total = sum(deltas)
+        if total > 0:
+            user, nice, system, idle, iowait, irq, softirq, steal = deltas
+            metrics['cpu_user_pct'] = 100.0 * (user + nice) / total
+            metrics['cpu_system_pct'] = 100.0 * (system + irq + softirq) / total
+            metrics['cpu_iowait_pct'] = 100.0 * iowait / total
+            metrics['cpu_steal_pct'] = 100.0 * steal / total
+
+    for key, values in current.items():
+        if not key.startswith(('disk.', 'net.')) or key not in last or \
+                any([c < l for c, l in zip(values, last[key])]):
+            continue
+        if key.startswith('disk.'):
+            read, written, io_ms = [c - l for c, l in zip(values, last[key])]
+            metrics[key + '.read_mb_per_sec'] = read * 512 / 1048576.0 / elapsed
+            metrics[key + '.write_mb_per_sec'] = written * 512 / 1048576.0 / elapsed
+            metrics[key + '.util_pct'] = min(100.0, io_ms / 10.0 / elapsed)
+        elif key.startswith('net.'):
+            received, sent = [c - l for c, l in zip(values, last[key])]
+            metrics[key + '.rx_mb_per_sec'] = received / 1048576.0 / elapsed
+            metrics[key + '.tx_mb_per_sec'] = sent / 1048576.0 / elapsed
+
+    return metrics
+
+
+
+class MetricsSampler(object):
+
+    def __init__(self, sources, path, interval = 5, flush_secs = 60):
+        '''
+        Args:
+            sources - JmxSources and ProcSources, with unique names.
+            path - columnar file that samples are appended to.
+            interval - seconds between samples of JmxSources. ProcSources have their own.
+            flush_secs - seconds between flushes of samples to path.
+        '''
+        self.sources = sources
+        self.path = path
+        self.interval = interval
+        self.flush_secs = flush_secs
+
+        self.buffers = collections.OrderedDict([(s.name, SampleBuffer()) for s in sources])
+        self.phases = []
+        self.current_phase = -1
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.threads = []
+        self.samples = 0
+
+
+    def start(self):
+        # A new file, rather than chunks appended to an older one.
+        open(self.path, 'wb').close()
+
+        for source in self.sources:
+            target = self._poll if isinstance(source, JmxSource) else self._read
+            self.threads.append(threading.Thread(target = target, args = (source,), name = 'sampler: ' + source.name))
+        self.threads.append(threading.Thread(target = self._flush_periodically, name = 'sampler: flush'))
+
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        return self
+
+
+    def stop(self):
+        self.stopping.set()
+
+        # Ending the shell loops ends the output their threads read.
+        for source in self.sources:
+            if isinstance(source, ProcSource):
+                source.close()
+        # Requests to unreachable nodes time out on their own, so threads get one deadline
+        # rather than a timeout each.
+        deadline = time.time() + self.interval + 10
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.time()))
+        for source in self.sources:
+            source.close()
+
+        self.flush()
+
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''
+        Context manager that tags samples taken while the code it wraps runs with a new phase.
+        '''
+        with self.lock:
+            self.phases.append({'name' : name, 'start' : time.time(), 'end' : None})
+            self.current_phase = len(self.phases) - 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[self.current_phase]['end'] = time.time()
+                self.current_phase = -1
+
+
+    def add(self, source, t, values):
+        with self.lock:
+            self.buffers[source.name].add(t, self.current_phase, values)
+            self.samples += 1
+
+
+    def flush(self):
+        '''
+        Appends samples taken since the last flush to the file as a chunk.
+        '''
+        with self.lock:
+            buffers = self.buffers
+            self.buffers = collections.OrderedDict([(name, SampleBuffer()) for name in buffers])
+            phases = [dict(p) for p in self.phases]
+
+        if not any([len(b) for b in buffers.values()]):
+            return
+
+        with open(self.path, 'ab') as f:
+            write_chunk(f, buffers, phases)
+
+
+    def _poll(self, source):
+        # Fixed rate: sample times don't drift by how long the requests take.
+        next_sample = time.time()
+        while not self.stopping.is_set():
+            self.add(source, time.time(), source.sample())
+            next_sample += self.interval
+            while next_sample < time.time():
+                next_sample += self.interval
+            self.stopping.wait(next_sample - time.time())
+
+
+    def _read(self, source):
+        source.start()
+        for t, snapshot in source.snapshots():
+            if self.stopping.is_set():
+                break
+            self.add(source, t, source.rates(t, snapshot))
+
+
+    def _flush_periodically(self):
+        while not self.stopping.wait(self.flush_secs):
+            self.flush()
+
+
+
+def to_bytes(column):
+    if sys.byteorder == 'big':
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes() if hasattr(column, 'tobytes') else column.tostring()
+
+
+
+def from_bytes(typecode, data):
+    column = array.array(typecode)
+    if hasattr(column, 'frombytes'):
+        column.frombytes(data)
+    else:
+        column.fromstring(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+
+def write_chunk(f, buffers, phases):
+    columns = []
+    for source, buf in buffers.items():
+        columns.append((source, 'time', buf.times))
+        columns.append((source, 'phase', buf.phases))
+        for metric, column in buf.columns.items():
+            columns.append((source, metric, column))
+
+    header = json.dumps({
+        'phases' : phases,
+        'columns' : [{'source' : s, 'name' : m, 'type' : c.typecode, 'count' : len(c)} for s, m, c in columns]
+    }).encode('utf-8')
+
+    f.write(CHUNK_MAGIC + struct.pack('<I', len(header)) + header)
+    for _, _, column in columns:
+        f.write(to_bytes(column))
+
+
+
+def read_samples(path):
+    '''
+    Reads a sample file.
+
+    Returns:
+        (samples, phases) - samples is an OrderedDict of source -> OrderedDict of column ->
+        array.array, with 'time' and 'phase' columns and a column per metric, and phases is
+        a list of dicts with 'name', 'start' and 'end' of each phase.
+    '''
+    samples = collections.OrderedDict()
+    phases = []
+
+    with open(path, 'rb') as f:
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                break
+            if head[:4] != CHUNK_MAGIC:
+                raise ValueError('%s is not a sample file, or is corrupt' % (path))
+            header = json.loads(f.read(struct.unpack('<I', head[4:])[0]).decode('utf-8'))
+            phases = header['phases'] or phases
+
+            chunk = collections.OrderedDict()
+            for c in header['columns']:
+                size = c['count'] * array.array(c['type']).itemsize
+                chunk.setdefault(c['source'], collections.OrderedDict())[c['name']] = from_bytes(c['type'], f.read(size))
+
+            for source, columns in chunk.items():
+                merge_columns(samples.setdefault(source, collections.OrderedDict()), columns)
+
+    return samples, phases
+
+
+
+def merge_columns(merged, columns):
+    rows = len(merged.get('time', []))
+    new_rows = len(columns['time'])
+    for name, column in columns.items():
+        if name not in merged:
+            merged[name] = array.array(column.typecode, [NAN] * rows)
+        merged[name].extend(column)
+    for name, column in merged.items():
+        if name not in columns:
+            column.extend([NAN] * new_rows)
+
+
+
+def summarize_phases(samples, phases):
+    '''
+    Returns an OrderedDict of (source, metric) -> OrderedDict of phase name -> mean of the
+    metric's values in the phase, ignoring NaN. Phases with the same name are pooled.
+    '''
+    names = [p['name'] for p in phases]
+    summary = collections.OrderedDict()
+    for source, columns in samples.items():
+        for metric, column in columns.items():
+            if metric in ('time', 'phase'):
+                continue
+            sums = collections.OrderedDict()
+            for phase, value in zip(columns['phase'], column):
+                if phase < 0 or math.isnan(value):
+                    continue
+                s = sums.setdefault(names[phase], [0.0, 0])
+                s[0] += value
+                s[1] += 1
+            summary[(source, metric)] = collections.OrderedDict([(n, s[0] / s[1]) for n, s in sums.items()])
+    return summary
+
+
+
+def print_phase_summary(summary, sources = None):
+    for (source, metric), means in summary.items():
+        if sources and not any([fnmatch.fnmatch(source, s) for s in sources]):
+            continue
+        if not means:
+            continue
+        print('%s %s' % (source, metric))
+        for phase, mean in means.items():
+            print('    %-40s %14.2f' % (phase[:40], mean))
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Summarize a metrics sample file by phase')
+    parser.add_argument('path', help = 'Sample file')
+    parser.add_argument('--source', action = 'append', help = 'Sources to show, like "hdpworker-*/proc". Defaults to all')
+    args = parser.parse_args()
+
+    samples, phases = read_samples(args.path)
+    print('%d sources, %d samples, %d phases' % (len(samples),
+        sum([len(c['time']) for c in samples.values()]), len(phases)))
+    print_phase_summary(summarize_phases(samples, phases), args.source)
@@ -0,0 +1,119 @@
+'''
+Runs provisioning as a pipeline of named steps, and checkpoints each step per node, so
+that provisioning that failed halfway resumes where it failed instead of starting over.
+
+A step works on many nodes at once, and reports which of them it succeeded on. When a
+step succeeds on a node, the node records it in node['steps'] along with a fingerprint of
+the step's inputs for that node - like variables and checksums of playbooks it runs - and
+the node is saved to the cluster state store right away. On later runs, a step is skipped
+on nodes that completed it with the same inputs. A node that was recreated gets a new
+linode ID, which is part of every fingerprint, so all steps run on it again.
+
+A node that fails a step is left out of the later steps of that run.
+'''
+
+from __future__ import print_function
+
+import time
+import hashlib
+import collections
+
+import simplejson as json
+
+import tracing
+
+
+class Step(object):
+
+    def __init__(self, name, run, inputs = None, checkpoint = True):
+        '''
+        Args:
+            name - name of the step, unique in its pipeline.
+            run - function that takes a list of nodes and returns a dict of FQDN -> True if the
+                step succeeded on the node.
+            inputs - function that takes a node and returns the step's inputs for the node, as
+                JSON serializable data. The step runs again on a node if they change.
+            checkpoint - if False, the step runs every time, like waiting for SSH.
+        '''
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.checkpoint = checkpoint
+
+
+    def fingerprint(self, node):
+        inputs = self.inputs(node) if self.inputs is not None else None
+        data = json.dumps([node.get('id'), inputs], sort_keys = True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+
+class Pipeline(object):
+
+    def __init__(self, steps, store):
+        '''
+        Args:
+            steps - list of Steps in the order they run.
+            store - cluster_state.ClusterStore that nodes are saved to after every step.
+        '''
+        self.steps = steps
+        self.store = store
+
+
+    def run(self, nodes, rerun = (), skip = ()):
+        '''
+        Runs the steps that nodes haven't completed with their current inputs.
+
+        Args:
+            nodes - list of node dicts. Steps change them in place.
+            rerun - names of steps to run even if they're complete.
+            skip - names of steps not to run at all, like 'wait_for_ssh' if nodes are
+                known to be up.
+
+        Returns:
+            OrderedDict of node FQDN -> name of the step it failed in, or None if it completed
+            all steps.
+        '''
+        failed = collections.OrderedDict([(n['fqdn'], None) for n in nodes])
+
+        for step in self.steps:
+            active = [n for n in nodes if failed[n['fqdn']] is None]
+            if not active:
+                break
+            if step.name in skip:
+                continue
+
+            fingerprints = dict([(n['fqdn'], step.fingerprint(n)) for n in active])
+            todo = [n for n in active if not self._complete(step, n, fingerprints[n['fqdn']], rerun)]
+
+            print('Step %s: %d nodes to run, %d already complete' % (step.name, len(todo), len(active) - len(todo)))
+            if not todo:
+                continue
+
+            with tracing.span('step: ' + step.name, phase = step.name, nodes = len(todo),
+                    complete = len(active) - len(todo)):
+                results = step.run(todo)
+
+            for n in todo:
+                steps = n.setdefault('steps', collections.OrderedDict())
+                if results.get(n['fqdn']):
+                    if step.checkpoint:
+                        steps[step.name] = collections.OrderedDict([
+                            ('fingerprint', fingerprints[n['fqdn']]),
+                            ('finished', time.strftime('%Y-%m-%d %H:%M:%S'))
+                        ])
+                else:
+                    failed[n['fqdn']] = step.name
+                    steps.pop(step.name, None)
+                    print('%s failed in step %s' % (n['fqdn'], step.name))
+
+                self.store.put_node(n)
+
+        return failed
+
+
+    def _complete(self, step, node, fingerprint, rerun):
+        if not step.checkpoint or step.name in rerun:
+            return False
+        done = node.get('steps', {}).get(step.name)
+        return done is not None and done['fingerprint'] == fingerprint
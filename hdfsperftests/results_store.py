@@ -0,0 +1,347 @@
+'''
+Stores benchmark results of all runs on a cluster in an SQLite database, and compares runs
+to tell whether a change of configuration or plans made a statistically significant
+difference.
+
+Every measurement is stored as a row with the benchmark, its parameters, the repetition and
+the metric's value, and every run records the spec of the cluster it ran on - plans and
+number of nodes, Hadoop version and HDFS settings. Specs and parameters are also stored as
+short keys, fingerprints of their JSON, so that runs on the same kind of cluster with the
+same parameters can be found and compared. Rows are only ever added.
+
+Runs are compared metric by metric with Welch's t-test, which doesn't assume the runs have
+the same variance. The difference of means is shown with its confidence interval, and a
+change is significant if the interval doesn't include zero. A significant change for the
+worse is flagged as a regression.
+
+Usage:
+    python results_store.py results.db list
+    python results_store.py results.db compare BASELINE_RUN[,RUN...] CANDIDATE_RUN[,RUN...] [--confidence 0.95]
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import os.path
+import math
+import sqlite3
+import hashlib
+import argparse
+import collections
+
+import simplejson as json
+
+
+# Metrics for which a lower value is better. Higher is better for all others.
+LOWER_IS_BETTER = set(['avg_latency_ms', 'elapsed_ms', 'exec_secs', 'job_secs', 'io_rate_std_dev'])
+
+# Metrics that measure the amount of work done rather than how fast it was done. Changes to
+# them are shown, but are neither regressions nor improvements.
+WORKLOAD_METRICS = set(['files', 'total_mb', 'operations', 'hdfs_bytes_read', 'hdfs_bytes_written',
+    'map_tasks', 'reduce_tasks'])
+
+SCHEMA = '''
+create table if not exists runs (
+    run_id text primary key,
+    cluster text,
+    suite text,
+    started text,
+    finished text,
+    spec_key text,
+    spec text,
+    results_dir text
+);
+
+create table if not exists measurements (
+    run_id text references runs(run_id),
+    benchmark text,
+    type text,
+    params_key text,
+    params text,
+    repetition integer,
+    warmup integer,
+    ok integer,
+    elapsed_secs real,
+    metric text,
+    value real
+);
+
+create index if not exists measurements_by_run on measurements(run_id, benchmark, metric);
+create index if not exists runs_by_spec on runs(spec_key);
+'''
+
+
+def key_of(obj):
+    '''
+    Returns a short fingerprint of JSON serializable data, the same for equal data.
+    '''
+    return hashlib.sha256(json.dumps(obj, sort_keys = True).encode('utf-8')).hexdigest()[:12]
+
+
+
+class ResultsStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+
+    def close(self):
+        self.db.close()
+
+
+    def add_run(self, results, spec, run_id = None, results_dir = None):
+        '''
+        Adds all runs of benchmarks.BenchmarkRunner.run_suite() results as a single run.
+
+        Args:
+            spec - spec of the cluster the benchmarks ran on, as JSON serializable data.
+            run_id - defaults to the suite name and start time.
+
+        Returns:
+            the run ID.
+        '''
+        suite = results['suite']
+        run_id = run_id or '%s-%s' % (suite['name'], results['started'].replace(' ', '-').replace(':', ''))
+
+        rows = []
+        for run in results['runs']:
+            for metric, value in run['metrics'].items():
+                rows.append((run_id, run['benchmark'], run['type'], key_of(run['params']),
+                    json.dumps(run['params'], sort_keys = True), run['repetition'], int(run['warmup']),
+                    int(run['ok']), run['elapsed_secs'], metric, value))
+
+        with self.db:
+            self.db.execute('insert into runs values (?, ?, ?, ?, ?, ?, ?, ?)', (run_id,
+                (results.get('cluster') or {}).get('name'), suite['name'], results['started'],
+                results.get('finished'), key_of(spec), json.dumps(spec, sort_keys = True), results_dir))
+            self.db.executemany('insert into measurements values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+        return run_id
+
+
+    def runs(self, spec_key = None):
+        '''
+        Returns runs, oldest first, as dicts with run_id, cluster, suite, started, spec_key
+        and spec. Only runs with given spec key if it's set.
+        '''
+        query = 'select run_id, cluster, suite, started, spec_key, spec from runs'
+        args = ()
+        if spec_key:
+            query += ' where spec_key = ?'
+            args = (spec_key,)
+
+        return [dict(zip(['run_id', 'cluster', 'suite', 'started', 'spec_key', 'spec'], r[:5] + (json.loads(r[5]),)))
+            for r in self.db.execute(query + ' order by started', args)]
+
+
+    def values(self, run_ids):
+        '''
+        Returns values of measured, successful repetitions in runs, as an OrderedDict of
+        (benchmark, params_key, metric) -> list of values.
+        '''
+        values = collections.OrderedDict()
+        query = '''select benchmark, params_key, metric, value from measurements
+            where run_id in (%s) and warmup = 0 and ok = 1
+            order by benchmark, metric, run_id, repetition''' % (', '.join(['?'] * len(run_ids)))
+
+        for benchmark, params_key, metric, value in self.db.execute(query, list(run_ids)):
+            values.setdefault((benchmark, params_key, metric), []).append(value)
+
+        return values
+
+
+    def compare(self, baseline_ids, candidate_ids, confidence = 0.95, metrics = None):
+        '''
+        Compares each metric of each benchmark between baseline and candidate runs. Values of
+        all repetitions of a group of runs are pooled.
+
+        Args:
+            metrics - names of metrics to compare. Defaults to all.
+
+        Returns:
+            list of dicts with 'benchmark', 'metric', 'baseline_mean', 'candidate_mean', 'delta'
+            (candidate - baseline), 'delta_pct', 'ci_low', 'ci_high' of the delta, 'p_value',
+            'significant', and 'regression' if the candidate is significantly worse in a
+            metric other than WORKLOAD_METRICS. CI and p-value are None when either side
+            has less than two values.
+        '''
+        baseline = self.values(baseline_ids)
+        candidate = self.values(candidate_ids)
+
+        comparisons = []
+        for key in baseline:
+            benchmark, params_key, metric = key
+            if key not in candidate or (metrics and metric not in metrics):
+                continue
+
+            c = welch_compare(baseline[key], candidate[key], confidence)
+            c.update({'benchmark' : benchmark, 'params_key' : params_key, 'metric' : metric})
+
+            worse = c['delta'] > 0 if metric in LOWER_IS_BETTER else c['delta'] < 0
+            c['regression'] = c['significant'] and worse and metric not in WORKLOAD_METRICS
+            comparisons.append(c)
+
+        return comparisons
+
+
+
+def mean_and_var(values):
+    n = len(values)
+    mean = sum(values) / float(n)
+    var = sum([(v - mean) ** 2 for v in values]) / (n - 1) if n > 1 else 0.0
+    return mean, var
+
+
+
+def welch_compare(a, b, confidence = 0.95):
+    '''
+    Welch's t-test of the difference of means of b and a.
+    '''
+    mean_a, var_a = mean_and_var(a)
+    mean_b, var_b = mean_and_var(b)
+    delta = mean_b - mean_a
+
+    result = {
+        'baseline_mean' : mean_a,
+        'candidate_mean' : mean_b,
+        'baseline_n' : len(a),
+        'candidate_n' : len(b),
+        'delta' : delta,
+        'delta_pct' : 100.0 * delta / mean_a if mean_a else None,
+        'ci_low' : None,
+        'ci_high' : None,
+        'p_value' : None,
+        'significant' : False
+    }
+    if len(a) < 2 or len(b) < 2:
+        return result
+
+    se2 = var_a / len(a) + var_b / len(b)
+    if se2 == 0:
+        # No variation at all - any difference is real.
+        result.update({'ci_low' : delta, 'ci_high' : delta, 'p_value' : 0.0 if delta else 1.0,
+            'significant' : delta != 0})
+        return result
+
+    se = math.sqrt(se2)
+    df = se2 ** 2 / ((var_a / len(a)) ** 2 / (len(a) - 1) + (var_b / len(b)) ** 2 / (len(b) - 1))
+    margin = t_quantile(1 - (1 - confidence) / 2.0, df) * se
+
+    result.update({
+        'ci_low' : delta - margin,
+        'ci_high' : delta + margin,
+        'p_value' : 2 * (1 - t_cdf(abs(delta) / se, df)),
+        'significant' : delta - margin > 0 or delta + margin < 0
+    })
+    return result
+
+
+
+def t_cdf(t, df):
+    '''
+    Cumulative distribution function of Student's t distribution.
+    '''
+    x = df / (df + t * t)
+    tail = 0.5 * incomplete_beta(df / 2.0, 0.5, x)
+    return 1 - tail if t > 0 else tail
+
+
+
+def t_quantile(p, df):
+    '''
+    Inverse of t_cdf(), by bisection.
+    '''
+    low, high = -1000.0, 1000.0
+    for _ in range(200):
+        mid = (low + high) / 2
+        if t_cdf(mid, df) < p:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+
+def incomplete_beta(a, b, x):
+    '''
+    Regularized incomplete beta function I_x(a, b), by its continued fraction.
+    '''
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+
+    log_front = (math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+        a * math.log(x) + b * math.log(1 - x))
+
+    # The continued fraction converges quickly only for x < (a + 1) / (a + b + 2).
+    if x > (a + 1) / (a + b + 2):
+        return 1 - incomplete_beta(b, a, 1 - x)
+
+    tiny = 1e-300
+    c, d = 1.0, 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    f = d
+    for m in range(1, 300):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            f *= c * d
+        if abs(c * d - 1) < 1e-12:
+            break
+
+    return math.exp(log_front) * f / a
+
+
+
+def print_comparison(comparisons, confidence = 0.95):
+    print('  %-20s %-20s %12s %12s %9s %25s %8s' % ('Benchmark', 'Metric', 'Baseline', 'Candidate', 'Delta %',
+        '%d%% CI of delta' % (confidence * 100), 'p'))
+    for c in comparisons:
+        ci = '[%.2f, %.2f]' % (c['ci_low'], c['ci_high']) if c['ci_low'] is not None else '-'
+        if c['regression']:
+            flag = 'REGRESSION'
+        elif c['significant']:
+            flag = 'changed' if c['metric'] in WORKLOAD_METRICS else 'improved'
+        else:
+            flag = ''
+        print('  %-20s %-20s %12.2f %12.2f %9s %25s %8s  %s' % (c['benchmark'][:20], c['metric'][:20],
+            c['baseline_mean'], c['candidate_mean'],
+            '%+.1f' % (c['delta_pct']) if c['delta_pct'] is not None else '-', ci,
+            '%.3f' % (c['p_value']) if c['p_value'] is not None else '-', flag))
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Benchmark results store')
+    parser.add_argument('db', help = 'Results database')
+    commands = parser.add_subparsers(dest = 'command')
+    commands.add_parser('list', help = 'List runs')
+    compare_parser = commands.add_parser('compare', help = 'Compare runs')
+    compare_parser.add_argument('baseline', help = 'Baseline run IDs, comma separated')
+    compare_parser.add_argument('candidate', help = 'Candidate run IDs, comma separated')
+    compare_parser.add_argument('--confidence', type = float, default = 0.95)
+    compare_parser.add_argument('--metric', action = 'append', help = 'Metric to compare. Defaults to all')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.db):
+        parser.error('%s not found' % (args.db))
+
+    store = ResultsStore(args.db)
+
+    if args.command == 'list':
+        for run in store.runs():
+            print('%-36s %-20s %-20s spec %s' % (run['run_id'], run['cluster'], run['started'], run['spec_key']))
+
+    elif args.command == 'compare':
+        comparisons = store.compare(args.baseline.split(','), args.candidate.split(','), args.confidence, args.metric)
+        print_comparison(comparisons, args.confidence)
+        if any([c['regression'] for c in comparisons]):
+            sys.exit(1)
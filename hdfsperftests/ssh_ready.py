@@ -0,0 +1,175 @@
+'''
+Waits for SSH service of many hosts at once.
+
+All hosts are watched together by a single select() loop with non-blocking sockets.
+A host is ready when its SSH server sends its protocol banner ("SSH-2.0-..."), which
+shows that sshd is accepting and handling connections, not just that the host is
+up. Hosts that aren't ready are retried with exponential backoff and jitter, so
+freshly booting hosts aren't polled at a fixed interval, and retries of many hosts
+don't line up.
+
+wait() yields every host as soon as it's ready, so the next stage of provisioning can
+start on it without waiting for the slowest host.
+'''
+
+from __future__ import print_function
+
+import time
+import errno
+import random
+import select
+import socket
+
+
+class SshReadinessWaiter(object):
+
+    def __init__(self, port = 22, attempt_timeout = 5.0, initial_delay = 1.0, max_delay = 30.0, timeout = 600.0):
+        '''
+        Args:
+            port - SSH port.
+            attempt_timeout - seconds to wait for a connection and banner in one attempt.
+            initial_delay - seconds before the first retry. It doubles with every retry.
+            max_delay - maximum seconds between retries.
+            timeout - seconds after which a host that isn't ready is given up.
+        '''
+        self.port = port
+        self.attempt_timeout = attempt_timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+
+    def wait(self, hosts):
+        '''
+        Watches hosts until each one is ready or times out.
+
+        Args:
+            hosts - list of IP addresses or host names.
+
+        Yields:
+            (host, error) as each host finishes waiting. error is None if the host is ready,
+            or a message if it timed out.
+        '''
+        start = time.time()
+        states = dict([(h, {'attempt' : 0, 'next_at' : start, 'give_up_at' : start + self.timeout,
+            'sock' : None, 'error' : None}) for h in hosts])
+
+        try:
+            while states:
+                now = time.time()
+
+                for host, state in list(states.items()):
+                    if state['sock'] is not None or state['next_at'] > now:
+                        continue
+
+                    # Give up on hosts whose last attempt, at the timeout, failed.
+                    if state['attempt'] > 0 and now >= state['give_up_at']:
+                        del states[host]
+                        yield (host, 'Not ready after %d secs. Last error: %s' % (self.timeout, state['error']))
+                    else:
+                        self._connect(host, state, now)
+
+                connecting = [s['sock'] for s in states.values() if s['sock'] is not None and s['phase'] == 'connect']
+                reading = [s['sock'] for s in states.values() if s['sock'] is not None and s['phase'] == 'banner']
+
+                if not connecting and not reading:
+                    wakeups = [s['next_at'] for s in states.values()]
+                    if wakeups:
+                        time.sleep(max(0, min(wakeups) - time.time()))
+                    continue
+
+                select_timeout = min([s['deadline'] for s in states.values() if s['sock'] is not None] +
+                    [s['next_at'] for s in states.values() if s['sock'] is None]) - time.time()
+                readable, writable, _ = select.select(reading, connecting, [], max(0, select_timeout))
+
+                by_sock = dict([(s['sock'], h) for h, s in states.items() if s['sock'] is not None])
+                now = time.time()
+
+                for sock in writable:
+                    host = by_sock[sock]
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err:
+                        self._retry(host, states[host], now, 'Connection failed: %s' % (errno.errorcode.get(err, err)))
+                    else:
+                        states[host]['phase'] = 'banner'
+
+                for sock in readable:
+                    host = by_sock[sock]
+                    state = states[host]
+                    try:
+                        data = sock.recv(256)
+                    except socket.error as e:
+                        self._retry(host, state, now, str(e))
+                        continue
+
+                    if not data:
+                        self._retry(host, state, now, 'Connection closed before SSH banner')
+                        continue
+
+                    # Servers may send other lines before the banner.
+                    state['banner'] += data
+                    while not state['banner'].startswith(b'SSH-') and b'\n' in state['banner']:
+                        state['banner'] = state['banner'].split(b'\n', 1)[1]
+
+                    if state['banner'].startswith(b'SSH-'):
+                        self._close(state)
+                        del states[host]
+                        yield (host, None)
+
+                for host, state in list(states.items()):
+                    if state['sock'] is not None and state['deadline'] <= now:
+                        self._retry(host, state, now, 'Timed out waiting for %s' %
+                            ('connection' if state['phase'] == 'connect' else 'SSH banner'))
+
+        finally:
+            for state in states.values():
+                self._close(state)
+
+
+    def wait_all(self, hosts):
+        '''
+        Waits for all hosts, and returns a dict of host -> error, with None for hosts that are ready.
+        '''
+        return dict(self.wait(hosts))
+
+
+    def _connect(self, host, state, now):
+        state['attempt'] += 1
+        state['banner'] = b''
+        state['phase'] = 'connect'
+        state['deadline'] = now + self.attempt_timeout
+
+        try:
+            addr = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)[0]
+            sock = socket.socket(addr[0], addr[1], addr[2])
+            sock.setblocking(0)
+            state['sock'] = sock
+
+            err = sock.connect_ex(addr[4])
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                self._retry(host, state, now, 'Connection failed: %s' % (errno.errorcode.get(err, err)))
+            elif err == 0:
+                state['phase'] = 'banner'
+
+        except socket.error as e:
+            self._retry(host, state, now, str(e))
+
+
+    def _retry(self, host, state, now, error):
+        self._close(state)
+        state['error'] = error
+
+        delay = min(self.max_delay, self.initial_delay * (2 ** min(state['attempt'] - 1, 30)))
+        delay = delay / 2.0 + random.uniform(0, delay / 2.0)
+
+        # Make a last attempt at the timeout rather than giving up early.
+        if now < state['give_up_at']:
+            state['next_at'] = min(now + delay, state['give_up_at'])
+        else:
+            state['next_at'] = now
+
+
+    def _close(self, state):
+        if state.get('sock') is not None:
+            state['sock'].close()
+            state['sock'] = None
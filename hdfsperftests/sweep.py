@@ -0,0 +1,397 @@
+'''
+Sweeps Hadoop configuration parameters, like block size, replication and handler counts,
+to find the settings that benchmark best on a cluster.
+
+A sweep is declared in a JSON file, like sweeps/hdfs_tuning.json. Its parameters are named
+<configuration file>/<property>, each with the list of values to try, in ascending order:
+
+    {
+        "name" : "hdfs_tuning",
+        "suite" : "suites/dfsio.json",
+        "search" : "adaptive",
+        "objective" : {"benchmark" : "dfsio_write", "metric" : "throughput_mb_sec"},
+        "parameters" : {
+            "hdfs-site/dfs.blocksize" : [67108864, 134217728, 268435456],
+            "core-site/io.file.buffer.size" : [4096, 65536, 131072],
+            ...
+        },
+        "start" : {"hdfs-site/dfs.blocksize" : 134217728, "core-site/io.file.buffer.size" : 4096}
+    }
+
+Every point of the sweep is a value for each parameter. For each point, only configuration
+files whose properties changed since the last point are pushed to nodes, and only daemons
+that read the changed properties are restarted - see RESTART_RULES. Then the benchmark suite
+runs, and the point is scored by the mean of the objective metric over its repetitions.
+
+"grid" search runs every combination of values. "adaptive" search is a pattern search that
+starts from the start value of every parameter, or its first value, moves one parameter at
+a time to a neighbouring value, and keeps moving in a direction while that makes the
+objective better. A move is taken only if the objective is significantly better, by Welch's
+t-test of the repetitions, so noise doesn't send the search astray. It stops when no move makes the
+objective better, or after max_points points. It needs far fewer points than grid search
+when parameters are many, but may stop at a local optimum.
+
+Usage:
+    python sweep.py sweep.json
+
+prints the points of a finished sweep, best first.
+'''
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import copy
+import itertools
+import collections
+
+import simplejson as json
+
+import benchmarks
+import results_store
+
+
+CONF_FILES = ['core-site', 'hdfs-site', 'mapred-site', 'yarn-site']
+
+SEARCHES = ['grid', 'adaptive']
+
+# Sweep settings that a sweep file can leave out.
+SWEEP_DEFAULTS = collections.OrderedDict([
+    ('search', 'grid'),
+    ('max_points', 20),
+    ('confidence', 0.9),
+    ('apply_best', True)
+])
+
+ALL_DAEMONS = ('namenode', 'datanode', 'resourcemanager', 'nodemanager')
+
+# Daemons that read a property, by prefix of its name. The first matching prefix wins.
+# Properties that only clients read - block size and replication of files they write,
+# and settings of MapReduce jobs - need no restart. Properties that match no prefix
+# restart all daemons.
+RESTART_RULES = [
+    ('dfs.replication', ()),
+    ('dfs.blocksize', ()),
+    ('dfs.client.', ()),
+    ('dfs.namenode.', ('namenode',)),
+    ('dfs.datanode.', ('datanode',)),
+    ('dfs.', ('namenode', 'datanode')),
+    ('io.file.buffer.size', ('namenode', 'datanode')),
+    ('mapreduce.shuffle.', ('nodemanager',)),
+    ('mapreduce.', ()),
+    ('yarn.resourcemanager.', ('resourcemanager',)),
+    ('yarn.scheduler.', ('resourcemanager',)),
+    ('yarn.nodemanager.', ('nodemanager',)),
+    ('yarn.', ('resourcemanager', 'nodemanager'))
+]
+
+
+def load_sweep(path):
+    '''
+    Loads a sweep from a JSON file, and checks its parameters and search. Raises ValueError
+    if they're wrong.
+    '''
+    with open(path, 'r') as f:
+        sweep = json.load(f, object_pairs_hook = collections.OrderedDict)
+
+    sweep.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    for key, value in SWEEP_DEFAULTS.items():
+        sweep.setdefault(key, value)
+
+    if sweep['search'] not in SEARCHES:
+        raise ValueError('Unknown search %s. Known searches are %s' % (sweep['search'], ', '.join(SEARCHES)))
+    if not sweep.get('suite'):
+        raise ValueError('Sweep %s has no benchmark suite' % (sweep['name']))
+    if not sweep.get('parameters'):
+        raise ValueError('Sweep %s has no parameters' % (sweep['name']))
+
+    for param, values in sweep['parameters'].items():
+        conf_file, _, prop = param.partition('/')
+        if conf_file not in CONF_FILES or not prop:
+            raise ValueError('Parameter %s should be named <file>/<property>, where file is one of %s' %
+                (param, ', '.join(CONF_FILES)))
+        if not isinstance(values, list) or not values:
+            raise ValueError('Parameter %s has no values' % (param))
+        if param in sweep.get('start', {}) and sweep['start'][param] not in values:
+            raise ValueError('Start value of parameter %s is not one of its values' % (param))
+
+    return sweep
+
+
+
+def hadoop_conf_of(point, base = None):
+    '''
+    Returns the hadoop_conf of a point - an OrderedDict of configuration file -> property
+    -> value, as the configuration templates take it - on top of properties of base.
+    '''
+    conf = collections.OrderedDict([(f, collections.OrderedDict(props)) for f, props in (base or {}).items()])
+    for param, value in point.items():
+        conf_file, _, prop = param.partition('/')
+        conf.setdefault(conf_file, collections.OrderedDict())[prop] = value
+    return conf
+
+
+
+def changed_properties(old_conf, new_conf):
+    '''
+    Returns list of (configuration file, property) that differ between two hadoop_confs.
+    '''
+    changed = []
+    for conf_file in CONF_FILES:
+        old = old_conf.get(conf_file, {})
+        new = new_conf.get(conf_file, {})
+        for prop in sorted(set(old.keys()) | set(new.keys())):
+            if old.get(prop) != new.get(prop):
+                changed.append((conf_file, prop))
+    return changed
+
+
+
+def changed_files(old_conf, new_conf):
+    return sorted(set([f for f, _ in changed_properties(old_conf, new_conf)]), key = CONF_FILES.index)
+
+
+
+def affected_daemons(prop):
+    for prefix, daemons in RESTART_RULES:
+        if prop.startswith(prefix):
+            return daemons
+    return ALL_DAEMONS
+
+
+
+def daemons_to_restart(old_conf, new_conf):
+    '''
+    Returns daemons that read properties that differ between two hadoop_confs, in the
+    order of ALL_DAEMONS.
+    '''
+    daemons = set()
+    for _, prop in changed_properties(old_conf, new_conf):
+        daemons.update(affected_daemons(prop))
+    return [d for d in ALL_DAEMONS if d in daemons]
+
+
+
+def grid_points(parameters):
+    '''
+    Returns every combination of parameter values, with the last parameter changing fastest,
+    so that consecutive points mostly differ in one parameter.
+    '''
+    names = list(parameters.keys())
+    return [collections.OrderedDict(zip(names, values)) for values in itertools.product(*parameters.values())]
+
+
+
+def point_key(point):
+    return json.dumps(point, sort_keys = True)
+
+
+
+class SweepRunner(object):
+
+    def __init__(self, sweep, apply_conf, run_suite, base_conf = None, out_dir = None):
+        '''
+        Args:
+            sweep - sweep, as returned by load_sweep().
+            apply_conf - function that takes a hadoop_conf, files to push and daemons to
+                restart, applies them to the cluster, and returns True if it succeeded.
+            run_suite - function that runs the benchmark suite on the cluster, and returns its
+                results, as returned by benchmarks.BenchmarkRunner.run_suite().
+            base_conf - the cluster's hadoop_conf before the sweep. Points change properties
+                on top of it.
+            out_dir - local directory where sweep.json, with the sweep's points and scores,
+                is saved after every point.
+        '''
+        self.sweep = sweep
+        self.apply_conf = apply_conf
+        self.run_suite = run_suite
+        self.base_conf = base_conf or collections.OrderedDict()
+        self.current_conf = copy.deepcopy(self.base_conf)
+        self.out_dir = out_dir
+
+        self.objective = sweep.get('objective') or self._default_objective()
+        self.lower_is_better = self.objective['metric'] in results_store.LOWER_IS_BETTER
+        self.points = collections.OrderedDict()
+
+        if out_dir and not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+
+    def run(self):
+        '''
+        Runs the sweep's search, and applies the best point's configuration to the cluster
+        if the sweep's apply_best is set.
+
+        Returns:
+            OrderedDict with the 'sweep', 'objective', 'points' in the order they ran - each
+            with 'point', 'hadoop_conf', 'pushed' files, 'restarted' daemons, 'run_id',
+            'values' of the objective and their mean 'score' - and the 'best' point.
+        '''
+        if self.sweep['search'] == 'grid':
+            for point in grid_points(self.sweep['parameters']):
+                self.evaluate(point)
+        else:
+            self.adaptive_search()
+
+        best = self.best()
+        if best is not None and self.sweep['apply_best']:
+            print('Applying best point %s' % (json.dumps(best['point'])))
+            self._apply(best['hadoop_conf'])
+
+        return self.save()
+
+
+    def adaptive_search(self):
+        parameters = self.sweep['parameters']
+        start = self.sweep.get('start', {})
+        current = collections.OrderedDict([(p, start.get(p, values[0])) for p, values in parameters.items()])
+        self.evaluate(current)
+
+        improved = True
+        while improved and not self._budget_spent():
+            improved = False
+            for param, values in parameters.items():
+                for step in (1, -1):
+                    moved = False
+                    index = values.index(current[param]) + step
+                    while 0 <= index < len(values) and not self._budget_spent():
+                        candidate = collections.OrderedDict(current)
+                        candidate[param] = values[index]
+                        if not self.better(self.evaluate(candidate), self.points[point_key(current)]):
+                            break
+                        current, moved, improved = candidate, True, True
+                        index += step
+
+                    # No need to try the other direction of a parameter that got better.
+                    if moved:
+                        break
+
+
+    def evaluate(self, point):
+        '''
+        Applies a point's configuration, runs the suite, and returns the point's record.
+        Points that ran before aren't run again.
+        '''
+        key = point_key(point)
+        if key in self.points:
+            return self.points[key]
+
+        print('Sweep point %d: %s' % (len(self.points) + 1, json.dumps(point)))
+        conf = hadoop_conf_of(point, self.base_conf)
+        pushed = changed_files(self.current_conf, conf)
+        restarted = daemons_to_restart(self.current_conf, conf)
+
+        record = collections.OrderedDict([
+            ('point', point),
+            ('hadoop_conf', conf),
+            ('pushed', pushed),
+            ('restarted', restarted),
+            ('run_id', None),
+            ('values', []),
+            ('score', None)
+        ])
+        self.points[key] = record
+
+        if not self._apply(conf, pushed, restarted):
+            print('Configuration of point could not be applied, skipping it')
+        else:
+            results = self.run_suite()
+            record['run_id'] = results.get('run_id')
+            record['values'] = self.objective_values(results)
+            if record['values']:
+                record['score'] = sum(record['values']) / float(len(record['values']))
+
+        self.save()
+        return record
+
+
+    def objective_values(self, results):
+        return [run['metrics'][self.objective['metric']] for run in results['runs']
+            if run['benchmark'] == self.objective['benchmark'] and run['ok'] and not run['warmup']
+            and self.objective['metric'] in run['metrics']]
+
+
+    def better(self, candidate, best):
+        '''
+        Returns True if candidate point's objective is significantly better than best's.
+        '''
+        if candidate['score'] is None:
+            return False
+        if best['score'] is None:
+            return True
+
+        c = results_store.welch_compare(best['values'], candidate['values'], self.sweep['confidence'])
+        if c['p_value'] is None:
+            # Too few repetitions for a test.
+            c['significant'] = c['delta'] != 0
+        return c['significant'] and (c['delta'] < 0 if self.lower_is_better else c['delta'] > 0)
+
+
+    def best(self):
+        scored = [p for p in self.points.values() if p['score'] is not None]
+        if not scored:
+            return None
+        return sorted(scored, key = lambda p: p['score'], reverse = not self.lower_is_better)[0]
+
+
+    def save(self):
+        sweep = collections.OrderedDict([
+            ('sweep', self.sweep),
+            ('objective', self.objective),
+            ('lower_is_better', self.lower_is_better),
+            ('points', list(self.points.values())),
+            ('best', self.best())
+        ])
+        if self.out_dir:
+            with open(os.path.join(self.out_dir, 'sweep.json'), 'w') as f:
+                json.dump(sweep, f, indent = 4 * ' ')
+        return sweep
+
+
+    def _apply(self, conf, files = None, daemons = None):
+        files = changed_files(self.current_conf, conf) if files is None else files
+        daemons = daemons_to_restart(self.current_conf, conf) if daemons is None else daemons
+        if files:
+            print('Pushing %s, restarting %s' % (', '.join(files), ', '.join(daemons) or 'no daemons'))
+            if not self.apply_conf(conf, files, daemons):
+                return False
+        self.current_conf = copy.deepcopy(conf)
+        return True
+
+
+    def _budget_spent(self):
+        return len(self.points) >= self.sweep['max_points']
+
+
+    def _default_objective(self):
+        suite = benchmarks.load_suite(self.sweep['suite'])
+        b = suite['benchmarks'][0]
+        return {'benchmark' : b['name'], 'metric' : benchmarks.PRIMARY_METRICS[b['type']][0]}
+
+
+
+def print_points(sweep):
+    objective = sweep['objective']
+    points = sorted([p for p in sweep['points'] if p['score'] is not None], key = lambda p: p['score'],
+        reverse = not sweep['lower_is_better']) + [p for p in sweep['points'] if p['score'] is None]
+
+    print('Sweep %s, objective %s of %s:' % (sweep['sweep']['name'], objective['metric'], objective['benchmark']))
+    params = list(sweep['sweep']['parameters'].keys())
+    for i, param in enumerate(params):
+        print('  P%d = %s' % (i + 1, param))
+    print('  %12s  %s' % ('Score', '  '.join(['%12s' % ('P%d' % (i + 1)) for i in range(len(params))])))
+    for p in points:
+        print('  %12s  %s' % ('%.2f' % (p['score']) if p['score'] is not None else 'failed',
+            '  '.join(['%12s' % (p['point'][param]) for param in params])))
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2 or not os.path.isfile(sys.argv[1]):
+        print('Usage: python sweep.py sweep.json')
+        sys.exit(1)
+
+    with open(sys.argv[1], 'r') as f:
+        print_points(json.load(f))
@@ -0,0 +1,164 @@
+'''
+Tests of cluster_state.py, with threads and processes updating the same cluster.
+
+Usage:
+    python -m unittest test_cluster_state
+'''
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+import multiprocessing
+
+import cluster_state
+from cluster_state import ClusterStore
+
+
+NAME = 'test'
+
+
+def new_cluster():
+    return {
+        'name' : NAME,
+        'master' : {'fqdn' : 'hdpmaster.test', 'public_ip' : '203.0.113.1'},
+        'workers' : []
+    }
+
+
+
+def worker(index):
+    return {'fqdn' : 'hdpworker-%d.test' % (index), 'index' : index}
+
+
+
+def update_in_process(conf_dir, index, updates):
+    # Runs in a process of its own, so it has its own store and cache.
+    store = cluster_state.cluster_store(conf_dir, NAME)
+    store.put_node(worker(index))
+    for i in range(updates):
+        store.update_node('hdpmaster.test', **{'count_%d' % (index) : i + 1})
+        store.update_node('hdpworker-%d.test' % (index), step = i + 1)
+
+
+
+class ClusterStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix = 'cluster_state')
+        self.compact_after = cluster_state.COMPACT_AFTER_RECORDS
+        # Compact often, so that compactions happen between other updates.
+        cluster_state.COMPACT_AFTER_RECORDS = 7
+        ClusterStore(self.dir, NAME).save(new_cluster())
+
+
+    def tearDown(self):
+        cluster_state.COMPACT_AFTER_RECORDS = self.compact_after
+        shutil.rmtree(self.dir)
+
+
+    def check_updates(self, cluster, writers, updates):
+        self.assertEqual([w['index'] for w in cluster['workers']], list(range(writers)))
+        for index in range(writers):
+            self.assertEqual(cluster['master']['count_%d' % (index)], updates)
+            self.assertEqual(cluster['workers'][index]['step'], updates)
+
+
+    def test_concurrent_threads(self):
+        store = ClusterStore(self.dir, NAME)
+        writers, updates = 8, 25
+
+        def update(index):
+            store.put_node(worker(index))
+            for i in range(updates):
+                store.update_node('hdpmaster.test', **{'count_%d' % (index) : i + 1})
+                store.update_node('hdpworker-%d.test' % (index), step = i + 1)
+
+        # Workers are put in reverse order, and still end up in order of their index.
+        threads = [threading.Thread(target = update, args = (i,)) for i in reversed(range(writers))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.check_updates(store.load(), writers, updates)
+        self.check_updates(ClusterStore(self.dir, NAME).load(), writers, updates)
+
+
+    def test_concurrent_processes(self):
+        writers, updates = 4, 25
+
+        processes = [multiprocessing.Process(target = update_in_process, args = (self.dir, i, updates))
+            for i in range(writers)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        self.check_updates(ClusterStore(self.dir, NAME).load(), writers, updates)
+
+
+    def test_torn_journal_record(self):
+        store = ClusterStore(self.dir, NAME)
+        store.update_node('hdpmaster.test', hosts_version = 1)
+
+        # A crash while appending leaves a record without its newline.
+        with open(store.journal_file, 'a') as f:
+            f.write('{"op" : "update_node", "fqdn" : "hdpmaster.test", "fields" : {"hosts_ver')
+
+        other = ClusterStore(self.dir, NAME)
+        self.assertEqual(other.load()['master']['hosts_version'], 1)
+
+        # The torn record is dropped before the next one is appended.
+        other.update_node('hdpmaster.test', hosts_version = 2)
+        self.assertEqual(ClusterStore(self.dir, NAME).load()['master']['hosts_version'], 2)
+        with open(store.journal_file, 'r') as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
+
+
+    def test_compaction(self):
+        store = ClusterStore(self.dir, NAME)
+        for i in range(cluster_state.COMPACT_AFTER_RECORDS):
+            store.update_node('hdpmaster.test', hosts_version = i + 1)
+
+        # All records are in the snapshot now, and the journal is empty.
+        self.assertEqual(os.path.getsize(store.journal_file), 0)
+        self.assertEqual(ClusterStore(self.dir, NAME).load()['master']['hosts_version'],
+            cluster_state.COMPACT_AFTER_RECORDS)
+
+
+    def test_crash_before_journal_is_emptied(self):
+        store = ClusterStore(self.dir, NAME)
+        store.put_node(dict(new_cluster()['master'], hadoop_conf = 'old'))
+        store.update_node('hdpmaster.test', hosts_version = 1)
+
+        with open(store.journal_file, 'r') as f:
+            journal = f.read()
+
+        with store.transaction() as cluster:
+            cluster['master']['hadoop_conf'] = 'new'
+            cluster['master']['hosts_version'] = 2
+
+        # As if the process crashed after renaming the new snapshot, before emptying the journal.
+        with open(store.journal_file, 'w') as f:
+            f.write(journal)
+
+        master = ClusterStore(self.dir, NAME).load()['master']
+        self.assertEqual(master['hadoop_conf'], 'new')
+        self.assertEqual(master['hosts_version'], 2)
+
+        # Records appended after the stale ones apply.
+        ClusterStore(self.dir, NAME).update_node('hdpmaster.test', hosts_version = 3)
+        master = ClusterStore(self.dir, NAME).load()['master']
+        self.assertEqual(master['hadoop_conf'], 'new')
+        self.assertEqual(master['hosts_version'], 3)
+        self.assertNotIn('journal_epoch', ClusterStore(self.dir, NAME).load())
+
+
+
+if __name__ == '__main__':
+    unittest.main()
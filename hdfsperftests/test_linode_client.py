@@ -0,0 +1,138 @@
+'''
+Tests of linode_client.py against fake_linode_api.py.
+
+Usage:
+    python -m unittest test_linode_client
+'''
+
+from __future__ import print_function
+
+import unittest
+
+import linode_client
+from linode_client import LinodeApiClient, LinodeCreator, LinodeApiError
+from fake_linode_api import FakeLinodeApi
+
+
+def worker_spec(index):
+    return {
+        'plan_id' : 7,
+        'datacenter' : 6,
+        'distribution' : 'Ubuntu 14.04 LTS',
+        'kernel' : 'Latest 64 bit',
+        'label' : 'hdpworker-%d' % (index),
+        'group' : 'hdfsperftests',
+        'disks' : {
+            'boot' : {'disk_size' : 10 * 1024},
+            'swap' : {'disk_size' : 2 * 1024},
+            'others' : [{'label' : 'hdfs', 'disk_size' : 372 * 1024, 'type' : 'raw'}]
+        }
+    }
+
+
+
+class LinodeCreatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeLinodeApi(requests_per_sec = 40).start()
+
+        # No client side rate limit, so that the fake's rate limit errors have to be retried.
+        self.client = LinodeApiClient(api_key = 'test', endpoint = self.fake.endpoint, pool_size = 4,
+            requests_per_sec = 10000, max_retries = 10, backoff_secs = 0.2)
+        self.creator = LinodeCreator(self.client, root_ssh_key_file = '/nonexistent/id_rsa.pub')
+
+
+    def tearDown(self):
+        self.client.close()
+        self.fake.stop()
+
+
+    def test_create_linodes(self):
+        specs = [worker_spec(i) for i in range(1, 21)]
+
+        # Two linodes fail after their disks are created.
+        failing = set(['hdpworker-7', 'hdpworker-13'])
+        self.fake.fail_when('linode.config.create', lambda r: r['Label'] in failing, message = 'No capacity')
+
+        nodes = self.creator.create_linodes(specs)
+
+        self.assertEqual(len(nodes), 20)
+        created = [n for n in nodes if not isinstance(n, LinodeApiError)]
+        errors = [(s['label'], n) for s, n in zip(specs, nodes) if isinstance(n, LinodeApiError)]
+
+        self.assertEqual(sorted([label for label, e in errors]), sorted(failing))
+        for label, e in errors:
+            self.assertEqual(e.action, 'linode.config.create')
+
+        # Every linode was created, but those that failed were deleted.
+        self.assertEqual(len(created), 18)
+        self.assertEqual(sorted(self.fake.linodes), sorted([n.id for n in created]))
+
+        for spec, n in zip(specs, nodes):
+            if isinstance(n, LinodeApiError):
+                continue
+            linode = self.fake.linodes[n.id]
+            self.assertEqual(linode['LABEL'], spec['label'])
+            self.assertEqual(linode['STATUS'], 1)
+            self.assertEqual([d['Label'] for d in linode['disks']], ['boot', 'swap', 'hdfs'])
+            self.assertEqual(len(linode['configs']), 1)
+            self.assertEqual(len(n.public_ip), 1)
+            self.assertTrue(n.private_ip.startswith('192.168.'))
+
+        stats = self.fake.stats
+
+        # Rate limited requests were retried until they succeeded.
+        self.assertGreater(stats['rate_limited'], 0)
+
+        # Every step is a few batch requests for all linodes, not a request per API call.
+        self.assertLess(stats['http_requests'] * 5, stats['api_requests'])
+        self.assertLessEqual(stats['connections'], stats['http_requests'])
+
+
+    def test_lost_responses(self):
+        specs = [worker_spec(i) for i in range(1, 21)]
+
+        # Lookups are resent after a lost response. The linodes of lost linode.create responses
+        # are found by linode.list instead of being created twice.
+        self.fake.requests_per_sec = None
+        self.fake.lose_responses('avail.kernels')
+        self.fake.lose_responses('linode.create')
+
+        nodes = self.creator.create_linodes(specs)
+
+        errors = [n for n in nodes if isinstance(n, LinodeApiError)]
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(self.fake.linodes), sorted([n.id for n in nodes]))
+        self.assertEqual(sorted([l['LABEL'] for l in self.fake.linodes.values()]), sorted([s['label'] for s in specs]))
+
+        # Other requests that aren't idempotent fail instead of being resent.
+        self.fake.lose_responses('linode.ip.addprivate')
+        results = self.client.batch([{'api_action' : 'linode.ip.addprivate', 'LinodeID' : nodes[0].id}], raise_errors = False)
+        self.assertEqual(results[0].codes, [linode_client.ERROR_UNKNOWN_OUTCOME])
+
+
+    def test_exception_deletes_linodes(self):
+        specs = [worker_spec(i) for i in range(1, 6)]
+        specs[3]['kernel'] = 'No such kernel'
+
+        # Linodes created before the exception are deleted.
+        self.assertRaises(KeyError, self.creator.create_linodes, specs)
+        self.assertEqual(self.fake.linodes, {})
+
+
+    def test_rate_limit_gives_up(self):
+        self.fake.requests_per_sec = 1
+        self.client.max_retries = 1
+        self.client.backoff_secs = 0.01
+
+        results = self.client.batch([{'api_action' : 'avail.kernels'}] * 10, raise_errors = False)
+
+        errors = [r for r in results if isinstance(r, LinodeApiError)]
+        self.assertTrue(errors)
+        for e in errors:
+            self.assertEqual(e.codes, [linode_client.ERROR_RATE_LIMITED])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+'''
+Tests of metrics_sampler.py against fake_jmx.py and the local /proc.
+
+Usage:
+    python -m unittest test_metrics_sampler
+'''
+
+from __future__ import print_function
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import metrics_sampler
+from fake_jmx import FakeJmx
+
+
+INTERVAL = 0.2
+
+
+class MetricsSamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.namenode = FakeJmx('namenode').start()
+        self.datanode = FakeJmx('datanode').start()
+        self.dir = tempfile.mkdtemp(prefix = 'sampler')
+        self.path = os.path.join(self.dir, 'metrics.col')
+
+
+    def tearDown(self):
+        self.namenode.stop()
+        self.datanode.stop()
+        shutil.rmtree(self.dir)
+
+
+    def test_sample_phases(self):
+        sources = [
+            metrics_sampler.JmxSource('master/namenode', self.namenode.url, metrics_sampler.NAMENODE_BEANS),
+            metrics_sampler.JmxSource('worker/datanode', self.datanode.url, metrics_sampler.DATANODE_BEANS),
+            metrics_sampler.ProcSource('local/proc', interval = INTERVAL)
+        ]
+        # Flushes more often than phases change, so that phases span chunks.
+        sampler = metrics_sampler.MetricsSampler(sources, self.path, interval = INTERVAL, flush_secs = 0.5).start()
+        try:
+            time.sleep(3 * INTERVAL)
+            with sampler.phase('write'):
+                time.sleep(1.5)
+            with sampler.phase('read'):
+                time.sleep(1.5)
+        finally:
+            sampler.stop()
+
+        samples, phases = metrics_sampler.read_samples(self.path)
+
+        self.assertEqual([p['name'] for p in phases], ['write', 'read'])
+        self.assertEqual(sorted(samples), ['local/proc', 'master/namenode', 'worker/datanode'])
+        self.assertEqual(sum([len(columns['time']) for columns in samples.values()]), sampler.samples)
+
+        expected = {
+            'master/namenode' : ['rpc_calls_per_sec', 'rpc_queue_time_avg_ms', 'files_total', 'gc_ms_per_sec', 'heap_used_mb'],
+            'worker/datanode' : ['bytes_read_per_sec', 'bytes_written_per_sec', 'write_block_op_avg_ms', 'heap_used_mb'],
+            'local/proc' : ['cpu_user_pct', 'mem_used_mb', 'load1']
+        }
+        for source, metrics in expected.items():
+            for metric in metrics:
+                self.assertIn(metric, samples[source])
+                self.assertEqual(len(samples[source][metric]), len(samples[source]['time']))
+
+        # Every sample is tagged with the phase it was taken in, or -1 outside phases.
+        for source, columns in samples.items():
+            tags = set(columns['phase'])
+            self.assertEqual(tags, set([-1, 0, 1]), source)
+            for t, phase in zip(columns['time'], columns['phase']):
+                if phase >= 0:
+                    # A sample's time is when it started, which can be just before its phase.
+                    self.assertGreaterEqual(t, phases[phase]['start'] - INTERVAL)
+                    self.assertLessEqual(t, phases[phase]['end'])
+                else:
+                    self.assertFalse(phases[0]['start'] <= t < phases[0]['end'] - INTERVAL, source)
+                    self.assertFalse(phases[1]['start'] <= t < phases[1]['end'] - INTERVAL, source)
+
+        summary = metrics_sampler.summarize_phases(samples, phases)
+        for key in [('master/namenode', 'rpc_calls_per_sec'), ('master/namenode', 'gc_ms_per_sec'),
+                ('worker/datanode', 'bytes_written_per_sec'), ('worker/datanode', 'bytes_read_per_sec')]:
+            self.assertEqual(list(summary[key]), ['write', 'read'])
+            for phase, mean in summary[key].items():
+                self.assertGreater(mean, 0, '%s in %s' % (key, phase))
+
+        self.assertGreater(summary[('local/proc', 'mem_used_mb')]['read'], 0)
+
+        # Keep-alive connections are reused across samples.
+        self.assertLess(self.namenode.stats['connections'], self.namenode.stats['requests'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
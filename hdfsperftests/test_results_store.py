@@ -0,0 +1,165 @@
+'''
+Tests of the statistics and comparisons of results_store.py.
+
+Usage:
+    python -m unittest test_results_store
+'''
+
+from __future__ import print_function
+
+import unittest
+
+import results_store
+from results_store import ResultsStore, incomplete_beta, t_cdf, t_quantile, welch_compare
+
+
+# Quantiles of Student's t distribution from tables, as (p, df, t).
+T_QUANTILES = [
+    (0.975, 1, 12.706),
+    (0.95, 5, 2.015),
+    (0.975, 8, 2.306),
+    (0.975, 10, 2.228),
+    (0.995, 30, 2.750),
+    (0.975, 100000, 1.960)
+]
+
+
+def suite_results(started, metrics):
+    '''
+    Returns results as returned by benchmarks.BenchmarkRunner.run_suite(), with a repetition
+    of benchmark 'dfsio-write' for each dict of metrics.
+    '''
+    return {
+        'suite' : {'name' : 'standard'},
+        'cluster' : {'name' : 'test'},
+        'started' : started,
+        'finished' : started,
+        'runs' : [{
+            'benchmark' : 'dfsio-write',
+            'type' : 'testdfsio',
+            'params' : {'files' : 10},
+            'repetition' : i,
+            'warmup' : False,
+            'ok' : True,
+            'elapsed_secs' : 1.0,
+            'metrics' : m
+        } for i, m in enumerate(metrics)]
+    }
+
+
+
+class StatisticsTest(unittest.TestCase):
+
+    def test_incomplete_beta(self):
+        for x in [0.0, 0.1, 0.37, 0.5, 0.9, 1.0]:
+            self.assertAlmostEqual(incomplete_beta(1, 1, x), x)
+            self.assertAlmostEqual(incomplete_beta(3, 1, x), x ** 3)
+            self.assertAlmostEqual(incomplete_beta(1, 4, x), 1 - (1 - x) ** 4)
+            # I_x(2, 3) is the chance of at least 2 successes in 4 trials.
+            self.assertAlmostEqual(incomplete_beta(2, 3, x),
+                6 * x ** 2 * (1 - x) ** 2 + 4 * x ** 3 * (1 - x) + x ** 4)
+            self.assertAlmostEqual(incomplete_beta(2.5, 7, x), 1 - incomplete_beta(7, 2.5, 1 - x))
+
+        self.assertAlmostEqual(incomplete_beta(6.5, 6.5, 0.5), 0.5)
+
+
+    def test_t_cdf(self):
+        for df in [1, 2.5, 10, 1000]:
+            self.assertAlmostEqual(t_cdf(0, df), 0.5)
+            self.assertAlmostEqual(t_cdf(1.3, df) + t_cdf(-1.3, df), 1.0)
+
+        # The t distribution with one degree of freedom is the Cauchy distribution.
+        self.assertAlmostEqual(t_cdf(1, 1), 0.75)
+        for p, df, t in T_QUANTILES:
+            self.assertAlmostEqual(t_cdf(t, df), p, places = 3)
+            self.assertAlmostEqual(t_cdf(-t, df), 1 - p, places = 3)
+
+
+    def test_t_quantile(self):
+        for p, df, t in T_QUANTILES:
+            self.assertAlmostEqual(t_quantile(p, df), t, places = 3)
+            self.assertAlmostEqual(t_quantile(1 - p, df), -t, places = 3)
+
+
+    def test_welch_compare(self):
+        # Equal variances of 2.5, so the standard error is 1 with 8 degrees of freedom.
+        c = welch_compare([1, 2, 3, 4, 5], [2, 3, 4, 5, 6])
+        self.assertAlmostEqual(c['delta'], 1.0)
+        self.assertAlmostEqual(c['delta_pct'], 100.0 / 3)
+        self.assertAlmostEqual(c['ci_low'], 1.0 - 2.306, places = 3)
+        self.assertAlmostEqual(c['ci_high'], 1.0 + 2.306, places = 3)
+        self.assertAlmostEqual(c['p_value'], 0.3466, places = 4)
+        self.assertFalse(c['significant'])
+
+        c = welch_compare([10.0, 10.2, 9.9, 10.1, 9.8], [11.0, 11.2, 10.9, 11.1, 10.8, 11.0])
+        self.assertTrue(c['significant'])
+        self.assertGreater(c['ci_low'], 0)
+        self.assertLess(c['p_value'], 0.001)
+
+        # No variation, so any difference is significant. One value has no CI.
+        self.assertTrue(welch_compare([5, 5, 5], [6, 6])['significant'])
+        self.assertFalse(welch_compare([5, 5, 5], [5, 5])['significant'])
+        self.assertIsNone(welch_compare([5], [6, 7])['ci_low'])
+
+
+
+class CompareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ResultsStore(':memory:')
+        spec = {'worker_plan' : 'Linode 4096', 'workers' : 3}
+
+        self.baseline = self.store.add_run(suite_results('2016-01-01 10:00:00', [
+            {'elapsed_ms' : v, 'throughput_mb_sec' : t, 'total_mb' : 1000}
+                for v, t in [(100, 50.0), (102, 51.0), (98, 49.0), (101, 50.5)]]), spec)
+
+        # Slower and with less throughput, and the same amount of work.
+        self.slower = self.store.add_run(suite_results('2016-01-02 10:00:00', [
+            {'elapsed_ms' : v, 'throughput_mb_sec' : t, 'total_mb' : 1000}
+                for v, t in [(120, 41.0), (122, 40.0), (119, 41.5), (121, 40.5)]]), spec)
+
+        # Faster, and with less work.
+        self.faster = self.store.add_run(suite_results('2016-01-03 10:00:00', [
+            {'elapsed_ms' : v, 'throughput_mb_sec' : t, 'total_mb' : 500}
+                for v, t in [(80, 50.5), (82, 49.5), (79, 50.0), (81, 50.8)]]), spec)
+
+
+    def tearDown(self):
+        self.store.close()
+
+
+    def compare(self, candidate):
+        return dict([(c['metric'], c) for c in self.store.compare([self.baseline], [candidate])])
+
+
+    def test_regression(self):
+        comparisons = self.compare(self.slower)
+
+        # Lower is better for elapsed_ms, and higher for throughput.
+        for metric in ['elapsed_ms', 'throughput_mb_sec']:
+            self.assertTrue(comparisons[metric]['significant'], metric)
+            self.assertTrue(comparisons[metric]['regression'], metric)
+        self.assertFalse(comparisons['total_mb']['significant'])
+        self.assertFalse(comparisons['total_mb']['regression'])
+
+
+    def test_improvement(self):
+        comparisons = self.compare(self.faster)
+
+        self.assertTrue(comparisons['elapsed_ms']['significant'])
+        self.assertFalse(comparisons['elapsed_ms']['regression'])
+
+        # A change that isn't significant is no regression.
+        self.assertFalse(comparisons['throughput_mb_sec']['significant'])
+        self.assertFalse(comparisons['throughput_mb_sec']['regression'])
+
+        # Less work is a significant change for the worse, but not a regression.
+        self.assertIn('total_mb', results_store.WORKLOAD_METRICS)
+        self.assertTrue(comparisons['total_mb']['significant'])
+        self.assertLess(comparisons['total_mb']['delta'], 0)
+        self.assertFalse(comparisons['total_mb']['regression'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
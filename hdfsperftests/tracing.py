@@ -0,0 +1,185 @@
+'''
+Records how long each step of provisioning takes, per node.
+
+Steps are recorded as spans - a name, start and end time, and tags like node, phase and
+playbook - with span() around code, or record() for times measured elsewhere, like
+Ansible tasks timed by ansible/callback_plugins/trace_tasks.py. Spans of all threads go
+to one process-wide tracer.
+
+Spans can be exported as a Chrome trace (JSON Trace Event Format), which chrome://tracing
+and https://ui.perfetto.dev show as a timeline with a row per node. summary() gives the
+count, p50, p95 and maximum duration of every step across nodes, to see which steps are
+worth speeding up, and to compare bring-up times of different runs.
+
+Usage:
+    python tracing.py trace.json
+
+prints the summary of an exported trace.
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import threading
+import contextlib
+import collections
+
+import simplejson as json
+
+
+class Tracer(object):
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+
+    @contextlib.contextmanager
+    def span(self, name, **tags):
+        '''
+        Context manager that records a span for the code it wraps. The span is tagged with
+        error=True if the code raises an exception.
+        '''
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            tags['error'] = True
+            raise
+        finally:
+            self.record(name, start, time.time(), **tags)
+
+
+    def record(self, name, start, end, **tags):
+        '''
+        Records a span with given start and end times, in seconds since the epoch.
+        '''
+        span = {'name' : name, 'start' : start, 'end' : end, 'thread' : threading.current_thread().name,
+            'tags' : tags}
+        with self.lock:
+            self.spans.append(span)
+
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+
+
+    def chrome_trace(self):
+        '''
+        Returns spans as a Chrome trace dict. Spans of a node go to a row named after
+        the node, and spans without a node go to a row per controller thread.
+        '''
+        with self.lock:
+            spans = list(self.spans)
+
+        rows = collections.OrderedDict()
+        events = []
+        for span in sorted(spans, key = lambda s: s['start']):
+            row = span['tags'].get('node') or 'controller: %s' % (span['thread'])
+            if row not in rows:
+                rows[row] = len(rows) + 1
+                events.append({'name' : 'thread_name', 'ph' : 'M', 'pid' : 1, 'tid' : rows[row],
+                    'args' : {'name' : row}})
+
+            events.append({
+                'name' : span['name'],
+                'cat' : span['tags'].get('phase', 'provision'),
+                'ph' : 'X',
+                'ts' : int(span['start'] * 1000000),
+                'dur' : int((span['end'] - span['start']) * 1000000),
+                'pid' : 1,
+                'tid' : rows[row],
+                'args' : span['tags']
+            })
+
+        return {'traceEvents' : events, 'displayTimeUnit' : 'ms'}
+
+
+    def export(self, path):
+        '''
+        Writes spans to path as a Chrome trace.
+        '''
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+    def summary(self):
+        return summarize(self.chrome_trace())
+
+
+
+def summarize(trace):
+    '''
+    Returns an OrderedDict of step name -> dict with 'count', 'p50', 'p95', 'max' and 'total'
+    durations in seconds, for the steps of a Chrome trace. Steps are in order of their
+    total duration, longest first.
+    '''
+    durations = collections.defaultdict(list)
+    for event in trace['traceEvents']:
+        if event.get('ph') == 'X':
+            durations[event['name']].append(event['dur'] / 1000000.0)
+
+    steps = []
+    for name, values in durations.items():
+        values.sort()
+        steps.append((name, {
+            'count' : len(values),
+            'p50' : percentile(values, 50),
+            'p95' : percentile(values, 95),
+            'max' : values[-1],
+            'total' : sum(values)
+        }))
+
+    return collections.OrderedDict(sorted(steps, key = lambda s: s[1]['total'], reverse = True))
+
+
+
+def percentile(sorted_values, pct):
+    '''
+    Nearest-rank percentile of a sorted list.
+    '''
+    rank = int(-(-pct * len(sorted_values) // 100))
+    return sorted_values[max(rank, 1) - 1]
+
+
+
+def print_summary(summary, title = 'Provisioning steps'):
+    print('%s:' % (title))
+    print('  %-50s %6s %9s %9s %9s %10s' % ('Step', 'Count', 'p50 secs', 'p95 secs', 'Max secs', 'Total secs'))
+    for name, s in summary.items():
+        print('  %-50s %6d %9.1f %9.1f %9.1f %10.1f' % (name[:50], s['count'], s['p50'], s['p95'], s['max'], s['total']))
+
+
+
+_tracer = Tracer()
+
+
+def tracer():
+    '''
+    Returns the process-wide tracer.
+    '''
+    return _tracer
+
+
+
+def span(name, **tags):
+    return _tracer.span(name, **tags)
+
+
+
+def record(name, start, end, **tags):
+    _tracer.record(name, start, end, **tags)
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2 or not os.path.isfile(sys.argv[1]):
+        print('Usage: python tracing.py trace.json')
+        sys.exit(1)
+
+    with open(sys.argv[1], 'r') as f:
+        print_summary(summarize(json.load(f)), os.path.basename(sys.argv[1]))
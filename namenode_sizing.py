@@ -0,0 +1,135 @@
+'''
+NameNode memory and disk sizing from the expected size of the HDFS namespace.
+
+The NameNode keeps every file, directory and block of the namespace in its JVM heap,
+so heap needed grows with the number of objects, not with total data size. Many small
+files need far more heap than the same data in a few large files.
+
+The per-object sizes below are approximations of what Hadoop 2.x NameNodes use,
+and are deliberately on the higher side. They're only meant to rule out plans that
+are clearly too small and to leave enough heap free for garbage collection.
+'''
+
+from __future__ import print_function
+
+import math
+
+
+# Approximate heap used per namespace object, in bytes.
+HEAP_BYTES_PER_INODE = 150
+HEAP_BYTES_PER_BLOCK = 150
+HEAP_BYTES_PER_REPLICA = 16
+
+# Approximate size of each object in the fsimage file, in bytes.
+FSIMAGE_BYTES_PER_INODE = 100
+FSIMAGE_BYTES_PER_BLOCK = 25
+
+# Minimum heap for NameNode's own data structures, RPC handlers and so on.
+BASE_HEAP_MB = 512
+
+# Non-heap memory of the JVM (metaspace, thread stacks, direct buffers), and memory left for the OS.
+JVM_OVERHEAD_MB = 512
+OS_RESERVED_MB = 1024
+
+
+class NamenodeSizing(object):
+
+    def __init__(self, file_count, avg_file_size_mb, block_size_mb = 128, replication = 3,
+            dirs_per_file = 0.1, heap_occupancy = 0.6, retained_checkpoints = 2):
+        '''
+        Args:
+            file_count - expected number of files in the namespace.
+            avg_file_size_mb - average file size in MB.
+            block_size_mb - HDFS block size (dfs.blocksize) in MB.
+            replication - replication factor, ie, number of copies + 1.
+            dirs_per_file - expected number of directories per file.
+            heap_occupancy - fraction of heap that live namespace data should occupy. The rest is
+                headroom that keeps garbage collection pauses short.
+            retained_checkpoints - number of fsimage checkpoints kept on disk (dfs.namenode.num.checkpoints.retained).
+
+        Raises:
+            ValueError if file_count, avg_file_size_mb or block_size_mb isn't positive.
+        '''
+        if file_count <= 0 or avg_file_size_mb <= 0 or block_size_mb <= 0:
+            raise ValueError('file_count, avg_file_size_mb and block_size_mb should be positive: %r, %r, %r' %
+                (file_count, avg_file_size_mb, block_size_mb))
+
+        self.file_count = int(file_count)
+        self.avg_file_size_mb = float(avg_file_size_mb)
+        self.block_size_mb = float(block_size_mb)
+        self.replication = int(replication)
+        self.dirs_per_file = float(dirs_per_file)
+        self.heap_occupancy = float(heap_occupancy)
+        self.retained_checkpoints = int(retained_checkpoints)
+
+        self.estimate = self._estimate()
+
+
+    def _estimate(self):
+        blocks_per_file = max(1, int(math.ceil(self.avg_file_size_mb / self.block_size_mb)))
+
+        directory_count = int(math.ceil(self.file_count * self.dirs_per_file))
+        inode_count = self.file_count + directory_count
+        block_count = self.file_count * blocks_per_file
+
+        namespace_heap_mb = (inode_count * HEAP_BYTES_PER_INODE +
+            block_count * (HEAP_BYTES_PER_BLOCK + self.replication * HEAP_BYTES_PER_REPLICA)) / (1024.0 * 1024.0)
+        live_heap_mb = BASE_HEAP_MB + namespace_heap_mb
+
+        # Size heap so that live data occupies only heap_occupancy of it.
+        heap_mb = int(math.ceil(live_heap_mb / self.heap_occupancy))
+
+        fsimage_mb = (inode_count * FSIMAGE_BYTES_PER_INODE + block_count * FSIMAGE_BYTES_PER_BLOCK) / (1024.0 * 1024.0)
+
+        return {
+            'file_count' : self.file_count,
+            'directory_count' : directory_count,
+            'inode_count' : inode_count,
+            'block_count' : block_count,
+            'live_heap_mb' : int(math.ceil(live_heap_mb)),
+            'heap_mb' : heap_mb,
+            'gc_headroom_mb' : heap_mb - int(math.ceil(live_heap_mb)),
+            'fsimage_mb' : int(math.ceil(fsimage_mb)),
+            'required_ram_mb' : heap_mb + JVM_OVERHEAD_MB + OS_RESERVED_MB,
+            # Retained checkpoints, plus one being written, plus edit logs of similar size.
+            'required_disk_mb' : int(math.ceil(fsimage_mb * (self.retained_checkpoints + 2)))
+        }
+
+
+    def requirements(self, role):
+        '''
+        Returns dict with 'ram_mb' and 'disk_mb' needed by a NameNode role.
+
+        Args:
+            role - 'namenode' for a single or active NameNode, 'standby' for an HA standby NameNode,
+                'secondary' for a Secondary NameNode.
+        '''
+        # Standby and Secondary NameNodes load the full namespace to merge edits into
+        # checkpoints, so they need as much heap as the active NameNode. The Secondary
+        # also keeps its own copies of the checkpoints.
+        ram_mb = self.estimate['required_ram_mb']
+        disk_mb = self.estimate['required_disk_mb']
+        if role == 'secondary':
+            disk_mb += self.estimate['fsimage_mb']
+
+        return {'ram_mb' : ram_mb, 'disk_mb' : disk_mb}
+
+
+    def plan_fits(self, plan, disk_plan, role = 'namenode'):
+        '''
+        Returns True if plan can hold the namespace for given role with margin.
+
+        Args:
+            plan - plan dict with 'RAM' in MB.
+            disk_plan - default [boot, swap, hdfsdata] allocation of the plan in GB. Name directory is
+                on the hdfsdata disk.
+        '''
+        req = self.requirements(role)
+        return plan['RAM'] >= req['ram_mb'] and disk_plan[2] * 1024 >= req['disk_mb']
+
+
+    def heap_setting(self):
+        '''
+        Returns HADOOP_NAMENODE_OPTS heap settings for the estimated heap.
+        '''
+        return '-Xms{0:d}m -Xmx{0:d}m'.format(self.estimate['heap_mb'])
@@ -0,0 +1,347 @@
+'''
+Cached, versioned and indexed catalog of Linode plans.
+
+The catalog is stored in plans.json along with a schema version, the time it was
+fetched and a checksum of the plans. Loading never blocks on the Linode API if any
+valid cache or recorded snapshot exists: a stale cache is used as is, flagged as stale,
+and refreshed in a background thread. A cache that fails validation is never used.
+
+Plans are indexed by PLANID, DISK and RAM, and also kept sorted by price, so lookups
+don't have to scan the plan list.
+'''
+
+from __future__ import print_function
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import numbers
+import collections
+
+import simplejson as json
+
+
+SCHEMA_VERSION = 1
+
+# Every plan must have these keys with numeric values, except LABEL.
+REQUIRED_PLAN_KEYS = ['PLANID', 'LABEL', 'DISK', 'RAM', 'CORES', 'XFER', 'PRICE', 'HOURLY']
+
+
+class PlanCatalogError(Exception):
+    pass
+
+
+
+class PlanCatalog(object):
+
+    def __init__(self, cache_file = 'plans.json', snapshot_file = None, ttl = 24 * 60 * 60,
+            offline = False, disk_plans = None, fetch_plans = None):
+        '''
+        Args:
+            cache_file - file where plans fetched from API are cached.
+            snapshot_file - optional recorded snapshot of the catalog, used if the cache
+                is missing or invalid, or in preference to the cache if offline is True.
+            ttl - seconds after which cached plans are considered stale and refreshed in background.
+            offline - if True, never call the Linode API. Plans come only from snapshot_file, or
+                cache_file if there's no valid snapshot.
+            disk_plans - optional dict of default disk allocations keyed by DISK. If given,
+                plans whose DISK has no allocation are left out of the catalog, and listed
+                in skipped_plans.
+            fetch_plans - function that returns the list of plans from the API. Defaults
+                to linodecommon.linode_api.get_plans.
+        '''
+        self.cache_file = cache_file
+        self.snapshot_file = snapshot_file
+        self.ttl = ttl
+        self.offline = offline
+        self.disk_plans = disk_plans
+        self.fetch_plans = fetch_plans
+
+        self.last_refresh_error = None
+
+        self._state = None
+        self._refresh_thread = None
+        self._lock = threading.Lock()
+
+
+    def load(self):
+        '''
+        Loads the catalog from cache, snapshot or API in that order of preference, and
+        starts a background refresh if the loaded catalog is stale. Offline, the snapshot
+        is preferred to the cache, and the API is never called.
+
+        Raises:
+            PlanCatalogError if no valid catalog could be loaded.
+        '''
+        errors = []
+
+        sources = [ (self.snapshot_file, 'snapshot'), (self.cache_file, 'cache') ] if self.offline else [
+            (self.cache_file, 'cache'), (self.snapshot_file, 'snapshot') ]
+
+        for filename, source in sources:
+            if not filename:
+                continue
+            if not os.path.isfile(filename):
+                errors.append('%s file %s missing.' % (source.capitalize(), filename))
+                continue
+            try:
+                self._state = self._read(filename, source)
+                break
+            except PlanCatalogError as e:
+                errors.append(str(e))
+
+        if self._state is None:
+            if self.offline:
+                raise PlanCatalogError('No valid plan catalog available offline. ' + ' '.join(errors))
+
+            # Nothing usable on disk. This is the only case where startup waits for the API.
+            self._state = self._fetch()
+            self._write(self.cache_file, self._state)
+
+        elif not self.offline and (self.is_stale() or self.source != 'cache'):
+            # Also refresh if the cache was missing or invalid, so that it gets repaired.
+            self.refresh(block = False)
+
+        return self
+
+
+    def refresh(self, block = True):
+        '''
+        Fetches plans from the API, validates them and replaces the catalog and cache file.
+        If block is False, does it in a background daemon thread. Errors in background
+        refreshes are saved in last_refresh_error and the current catalog is kept.
+        '''
+        if self.offline:
+            raise PlanCatalogError('Plan catalog is offline')
+
+        if block:
+            state = self._fetch()
+            self._write(self.cache_file, state)
+            self._state = state
+            return
+
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+
+            self._refresh_thread = threading.Thread(target = self._background_refresh)
+            self._refresh_thread.daemon = True
+            self._refresh_thread.start()
+
+
+    def wait_for_refresh(self, timeout = None):
+        '''
+        Waits for any background refresh to complete. Returns True if no refresh is running.
+        '''
+        thread = self._refresh_thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+
+    def record_snapshot(self, snapshot_file):
+        '''
+        Records the current catalog to snapshot_file for offline use.
+        '''
+        self._write(snapshot_file, self._state)
+
+
+    @property
+    def plans(self):
+        return self._state['plans']
+
+
+    @property
+    def skipped_plans(self):
+        '''
+        Plans left out of the catalog because their DISK has no default disk allocation.
+        '''
+        return self._state['skipped_plans']
+
+
+    @property
+    def version(self):
+        '''
+        Checksum of the current plans. Changes whenever a refresh brings in different plans.
+        '''
+        return self._state['checksum']
+
+
+    @property
+    def source(self):
+        '''
+        One of 'cache', 'snapshot' or 'api'.
+        '''
+        return self._state['source']
+
+
+    def age(self):
+        '''
+        Returns seconds since the current plans were fetched from API.
+        '''
+        return time.time() - self._state['fetched_at']
+
+
+    def is_stale(self):
+        return self.age() > self.ttl
+
+
+    def by_id(self, plan_id):
+        '''
+        Returns the plan with given PLANID, or None.
+        '''
+        return self._state['by_id'].get(int(plan_id))
+
+
+    def with_disk(self, disk_gb):
+        '''
+        Returns list of plans with given DISK in GB.
+        '''
+        return self._state['by_disk'].get(disk_gb, [])
+
+
+    def with_ram(self, ram_mb):
+        '''
+        Returns list of plans with given RAM in MB.
+        '''
+        return self._state['by_ram'].get(ram_mb, [])
+
+
+    def by_price(self):
+        '''
+        Returns list of plans sorted by monthly price, cheapest first.
+        '''
+        return self._state['by_price']
+
+
+    def disk_plan(self, plan_id):
+        '''
+        Returns the default [boot, swap, hdfsdata] disk allocation for given PLANID.
+        '''
+        return self.disk_plans[self.by_id(plan_id)['DISK']]
+
+
+
+    def _background_refresh(self):
+        try:
+            self.refresh(block = True)
+            self.last_refresh_error = None
+
+        except Exception as e:
+            self.last_refresh_error = e
+
+
+    def _fetch(self):
+        fetch_plans = self.fetch_plans
+        if fetch_plans is None:
+            from linodecommon import linode_api
+            fetch_plans = linode_api.get_plans
+
+        # Round trip through JSON so that fetched plans look exactly like cached ones.
+        plans = json.loads(json.dumps(fetch_plans()), object_pairs_hook = collections.OrderedDict)
+
+        return self._build_state(plans, time.time(), 'api')
+
+
+    def _read(self, filename, source):
+        try:
+            with open(filename, 'r') as f:
+                doc = json.load(f, object_pairs_hook = collections.OrderedDict)
+        except (IOError, ValueError) as e:
+            raise PlanCatalogError('Unreadable plan catalog %s: %s' % (filename, e))
+
+        if isinstance(doc, list):
+            # Plain list of plans saved by older versions. File's modification time
+            # is the best guess of when they were fetched.
+            return self._build_state(doc, os.path.getmtime(filename), source)
+
+        if not isinstance(doc, dict) or doc.get('schema_version') != SCHEMA_VERSION:
+            raise PlanCatalogError('Unsupported plan catalog schema in %s' % (filename))
+
+        state = self._build_state(doc.get('plans'), doc.get('fetched_at'), source)
+        if state['checksum'] != doc.get('checksum'):
+            raise PlanCatalogError('Checksum mismatch in plan catalog %s' % (filename))
+
+        return state
+
+
+    def _write(self, filename, state):
+        doc = collections.OrderedDict()
+        doc['schema_version'] = SCHEMA_VERSION
+        doc['fetched_at'] = state['fetched_at']
+        doc['checksum'] = state['checksum']
+        doc['plans'] = state['all_plans']
+
+        # Write to a temporary file and rename it, so that a crash never leaves a partial catalog.
+        dirname = os.path.dirname(os.path.abspath(filename))
+        fd, temp_file = tempfile.mkstemp(prefix = '.plans', dir = dirname)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(doc, f, indent = 4 * ' ')
+            os.rename(temp_file, filename)
+        except Exception:
+            os.remove(temp_file)
+            raise
+
+
+    def _build_state(self, plans, fetched_at, source):
+        self._validate(plans, fetched_at)
+
+        # Plans that are new since the default disk allocations were written can't be sized,
+        # but shouldn't keep the rest of the catalog from being used.
+        usable = plans
+        if self.disk_plans is not None:
+            usable = [p for p in plans if p['DISK'] in self.disk_plans]
+            if not usable:
+                raise PlanCatalogError('No plan has a default disk allocation')
+
+        state = {
+            'plans' : usable,
+            'all_plans' : plans,
+            'skipped_plans' : [p for p in plans if p not in usable],
+            'fetched_at' : fetched_at,
+            'source' : source,
+            'checksum' : _checksum(plans),
+            'by_id' : {},
+            'by_disk' : {},
+            'by_ram' : {},
+            'by_price' : sorted(usable, key = lambda p: (p['PRICE'], p['PLANID']))
+        }
+        for p in usable:
+            state['by_id'][p['PLANID']] = p
+            state['by_disk'].setdefault(p['DISK'], []).append(p)
+            state['by_ram'].setdefault(p['RAM'], []).append(p)
+
+        return state
+
+
+    def _validate(self, plans, fetched_at):
+        if not isinstance(fetched_at, numbers.Number):
+            raise PlanCatalogError('Plan catalog has no fetch time')
+
+        if not isinstance(plans, list) or not plans:
+            raise PlanCatalogError('Plan catalog has no plans')
+
+        plan_ids = set()
+        for p in plans:
+            for key in REQUIRED_PLAN_KEYS:
+                if key not in p:
+                    raise PlanCatalogError('Plan %s has no %s' % (p.get('PLANID'), key))
+
+                if key != 'LABEL' and (not isinstance(p[key], numbers.Number) or p[key] < 0):
+                    raise PlanCatalogError('Plan %s has invalid %s: %r' % (p['PLANID'], key, p[key]))
+
+            if p['PLANID'] in plan_ids:
+                raise PlanCatalogError('Duplicate plan %s' % (p['PLANID']))
+            plan_ids.add(p['PLANID'])
+
+            if p['PRICE'] == 0 or p['DISK'] == 0:
+                raise PlanCatalogError('Plan %s has zero PRICE or DISK' % (p['PLANID']))
+
+
+
+def _checksum(plans):
+    return hashlib.sha256(json.dumps(plans, sort_keys = True).encode('utf-8')).hexdigest()
@@ -0,0 +1,146 @@
+'''
+Vectorized sizing of HDFS storage nodes against the Linode plan catalog.
+
+The wizard used to compute node counts and costs one plan at a time for a single
+capacity and replication value. SizingEngine instead evaluates the whole catalog
+against arrays of capacities and number of copies in one batched pass, so that
+"what-if" quotes for many scenarios cost about the same as a single one.
+'''
+
+from __future__ import print_function
+
+import numpy as np
+
+
+class SizingEngine(object):
+
+    def __init__(self, plans, default_disk_plans):
+        '''
+        Args:
+            plans - list of plan dicts as returned by linode_api.get_plans().
+                plan['DISK'] is in GB, plan['RAM'] is in MB, plan['HOURLY'] is the hourly rate,
+                plan['PRICE'] is the monthly rate, plan['XFER'] is in GB.
+            default_disk_plans - dict of [boot, swap, hdfsdata] allocations in GB, keyed by
+                the DISK entry of each plan.
+        '''
+        self.plans = plans
+        self.default_disk_plans = default_disk_plans
+
+        # Per plan attributes, all in catalog order. These are the only things looked up
+        # by plan, so evaluate() never has to touch the plan dicts.
+        self.plan_ids = np.array([p['PLANID'] for p in plans], dtype=np.int64)
+        self.usable_storage_mb = np.array(
+            [default_disk_plans[p['DISK']][2] * 1024 for p in plans], dtype=np.int64)
+        self.monthly_price = np.array([p['PRICE'] for p in plans], dtype=np.float64)
+        self.hourly_price = np.array([p['HOURLY'] for p in plans], dtype=np.float64)
+        self.xfer_gb = np.array([p['XFER'] for p in plans], dtype=np.int64)
+        self.cores = np.array([p['CORES'] for p in plans], dtype=np.int64)
+        self.ram_gb = np.array([p['RAM'] for p in plans], dtype=np.int64) // 1024
+
+        self.index_of = dict( (int(plan_id), i) for i, plan_id in enumerate(self.plan_ids) )
+
+
+    def evaluate(self, capacities_mb, copies):
+        '''
+        Sizes storage nodes of every plan for every combination of capacity and copies.
+
+        Args:
+            capacities_mb - a capacity in MB (not including copies), or a sequence of them.
+            copies - number of additional copies of each file, or a sequence of them.
+                Replication factor is copies + 1.
+
+        Returns:
+            A SizingResult whose per-plan arrays have shape
+            (len(capacities_mb), len(copies), number of plans).
+        '''
+        capacities_mb = np.atleast_1d(np.asarray(capacities_mb, dtype=np.int64))
+        copies = np.atleast_1d(np.asarray(copies, dtype=np.int64))
+
+        # Total storage capacity = capacity * (copies+1), shape (C, R)
+        total_capacity_mb = capacities_mb[:, np.newaxis] * (copies[np.newaxis, :] + 1)
+
+        # Broadcast (C, R, 1) against (P,) to get (C, R, P)
+        total = total_capacity_mb[:, :, np.newaxis]
+        node_count = -(-total // self.usable_storage_mb)
+
+        # Excess storage says by how much the total usable storage of all nodes exceeds the requested
+        # storage capacity. At max, it'll be around the usable storage of 1 node.
+        excess_storage_gb = (node_count * self.usable_storage_mb - total) // 1024
+
+        return SizingResult(
+            engine = self,
+            capacities_mb = capacities_mb,
+            copies = copies,
+            total_capacity_mb = total_capacity_mb,
+            node_count = node_count,
+            monthly_cost = node_count * self.monthly_price,
+            hourly_cost = node_count * self.hourly_price,
+            excess_storage_gb = excess_storage_gb,
+            egress_tb = node_count * self.xfer_gb // 1024)
+
+
+    def per_node(self):
+        '''
+        Returns a list of dicts, one per plan in catalog order, with per-node attributes
+        of the plan. Used for tables that don't depend on capacity, like NameNode selection.
+        '''
+        rows = []
+        for i, p in enumerate(self.plans):
+            rows.append({
+                'plan_id' : int(self.plan_ids[i]),
+                'plan_name' : p['LABEL'],
+                'disk_gb' : p['DISK'],
+                'disk_plan' : self.default_disk_plans[p['DISK']],
+                'cores' : int(self.cores[i]),
+                'ram_gb' : int(self.ram_gb[i]),
+                'monthly_cost' : p['PRICE'],
+                'hourly_cost' : p['HOURLY'],
+                'egress_tb' : int(self.xfer_gb[i] // 1024)
+            })
+        return rows
+
+
+
+class SizingResult(object):
+    '''
+    Output of SizingEngine.evaluate(). All per-plan arrays are indexed
+    [capacity index, copies index, plan index], with plans in catalog order.
+    '''
+
+    def __init__(self, engine, capacities_mb, copies, total_capacity_mb, node_count,
+            monthly_cost, hourly_cost, excess_storage_gb, egress_tb):
+        self.engine = engine
+        self.capacities_mb = capacities_mb
+        self.copies = copies
+        self.total_capacity_mb = total_capacity_mb
+        self.node_count = node_count
+        self.monthly_cost = monthly_cost
+        self.hourly_cost = hourly_cost
+        self.excess_storage_gb = excess_storage_gb
+        self.egress_tb = egress_tb
+
+
+    def rows(self, capacity_index = 0, copies_index = 0):
+        '''
+        Returns a list of dicts, one per plan in catalog order, for a single
+        (capacity, copies) scenario. Each dict has the per-node attributes returned
+        by SizingEngine.per_node() plus 'count', 'total_monthly_cost', 'total_hourly_cost',
+        'excess_storage_gb' and 'total_egress_tb'.
+        '''
+        rows = self.engine.per_node()
+        c, r = capacity_index, copies_index
+        for i, row in enumerate(rows):
+            row['count'] = int(self.node_count[c, r, i])
+            row['total_monthly_cost'] = float(self.monthly_cost[c, r, i])
+            row['total_hourly_cost'] = float(self.hourly_cost[c, r, i])
+            row['excess_storage_gb'] = int(self.excess_storage_gb[c, r, i])
+            row['total_egress_tb'] = int(self.egress_tb[c, r, i])
+        return rows
+
+
+    def cheapest(self):
+        '''
+        Returns an array of shape (C, R) with the index of the plan having least
+        monthly cost for each (capacity, copies) scenario.
+        '''
+        return np.argmin(self.monthly_cost, axis = 2)
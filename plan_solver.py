@@ -0,0 +1,224 @@
+'''
+Cost-optimal selection of a mix of Linode plans for HDFS storage nodes.
+
+Instead of "N nodes of one plan", MixedPlanSolver searches for the cheapest combination
+of plan counts whose usable storage covers the requested total capacity, subject to optional
+constraints on node count, cores or RAM per TB, and a monthly budget.
+
+The search is a depth first branch-and-bound over plans ordered by cost per usable MB.
+Each branch is pruned with a lower bound computed from the cheapest way to cover every
+remaining requirement on its own, and the search is seeded with the best single plan
+solution, so it finishes in milliseconds for the whole catalog.
+'''
+
+from __future__ import print_function
+
+import math
+import time
+
+
+class MixedPlanSolver(object):
+
+    def __init__(self, sizing_engine):
+        '''
+        Args:
+            sizing_engine - a plan_sizing.SizingEngine with per-plan attributes of the catalog.
+        '''
+        self.engine = sizing_engine
+
+
+    def solve(self, total_capacity_mb, min_nodes = None, max_nodes = None,
+            min_cores_per_tb = None, min_ram_gb_per_tb = None, max_monthly_cost = None,
+            time_limit = 0.5):
+        '''
+        Finds the cheapest mix of plans for storing total_capacity_mb.
+
+        Args:
+            total_capacity_mb - total capacity to store in MB, including copies.
+            min_nodes, max_nodes - optional limits on total number of storage nodes.
+            min_cores_per_tb - optional minimum total cores per TB of total capacity.
+            min_ram_gb_per_tb - optional minimum total RAM in GB per TB of total capacity.
+            max_monthly_cost - optional budget for total monthly cost.
+            time_limit - seconds after which search stops and returns the best mix found so far.
+
+        Returns:
+            A dict with 'nodes' (list of {'plan_id', 'plan_name', 'count'} in catalog order),
+            'count', 'total_monthly_cost', 'total_hourly_cost', 'total_usable_mb',
+            'total_cores', 'total_ram_gb' and 'optimal' (False if time_limit was hit),
+            or None if no mix satisfies the constraints.
+        '''
+        engine = self.engine
+        capacity_tb = total_capacity_mb / (1024.0 * 1024.0)
+
+        # Requirements to cover, in the same order as the per-plan "supply" tuples below.
+        required = (
+            total_capacity_mb,
+            (min_cores_per_tb or 0) * capacity_tb,
+            (min_ram_gb_per_tb or 0) * capacity_tb,
+            min_nodes or 0
+        )
+        node_limit = max_nodes if max_nodes is not None else float('inf')
+        budget = max_monthly_cost if max_monthly_cost is not None else float('inf')
+
+        plans = []
+        for i in range(len(engine.plans)):
+            plans.append({
+                'index' : i,
+                'price' : float(engine.monthly_price[i]),
+                'supply' : (int(engine.usable_storage_mb[i]), int(engine.cores[i]), int(engine.ram_gb[i]), 1)
+            })
+
+        # Explore plans that give storage cheapest first, so that the first solutions found are good ones.
+        plans.sort(key = lambda p: p['price'] / p['supply'][0])
+
+        # Cheapest cost per unit of each requirement among plans[k:], used for lower bounds.
+        suffix_unit_cost = [None] * (len(plans) + 1)
+        suffix_unit_cost[len(plans)] = [float('inf')] * len(required)
+        for k in range(len(plans) - 1, -1, -1):
+            p = plans[k]
+            suffix_unit_cost[k] = [
+                min(suffix_unit_cost[k + 1][r], p['price'] / p['supply'][r] if p['supply'][r] else float('inf'))
+                for r in range(len(required))
+            ]
+
+        search = {
+            # Budget is inclusive, while solutions must be strictly cheaper than best_cost.
+            'best_cost' : budget + 1e-6,
+            'best_counts' : None,
+            'deadline' : time.time() + time_limit,
+            'timed_out' : False,
+            'visited' : 0
+        }
+
+        # Seed the incumbent with the best single plan solution.
+        for k, p in enumerate(plans):
+            count = self._count_to_cover(p, required)
+            if count is None or count > node_limit:
+                continue
+            cost = count * p['price']
+            if cost < search['best_cost'] - 1e-9:
+                search['best_cost'] = cost
+                search['best_counts'] = [0] * len(plans)
+                search['best_counts'][k] = count
+
+        self._branch(plans, suffix_unit_cost, 0, [0] * len(plans), list(required), 0.0, 0, node_limit, search)
+
+        if search['best_counts'] is None:
+            return None
+
+        return self._solution(plans, search['best_counts'], not search['timed_out'])
+
+
+
+    def _branch(self, plans, suffix_unit_cost, k, counts, remaining, cost, node_count, node_limit, search):
+
+        search['visited'] += 1
+        if search['visited'] % 1024 == 0 and time.time() > search['deadline']:
+            search['timed_out'] = True
+
+        if search['timed_out']:
+            return
+
+        if all(r <= 0 for r in remaining):
+            if cost < search['best_cost'] - 1e-9:
+                search['best_cost'] = cost
+                search['best_counts'] = list(counts)
+            return
+
+        if k == len(plans):
+            return
+
+        if cost + self._lower_bound(suffix_unit_cost[k], remaining) >= search['best_cost'] - 1e-9:
+            return
+
+        p = plans[k]
+
+        # More nodes of this plan than needed to cover all remaining requirements it
+        # can supply can only add cost.
+        max_count = self._count_to_cover(p, remaining, partial = True)
+        max_count = min(max_count, node_limit - node_count)
+        if p['price'] > 0 and search['best_cost'] != float('inf'):
+            max_count = min(max_count, int((search['best_cost'] - cost) / p['price']))
+
+        if k == len(plans) - 1:
+            # Last plan: only the smallest count that covers everything can be a solution.
+            c = self._count_to_cover(p, remaining)
+            if c is not None and c <= max_count:
+                counts[k] = c
+                self._branch(plans, suffix_unit_cost, k + 1, counts,
+                    [r - c * s for r, s in zip(remaining, p['supply'])],
+                    cost + c * p['price'], node_count + c, node_limit, search)
+                counts[k] = 0
+            return
+
+        for c in range(int(max_count), -1, -1):
+            counts[k] = c
+            self._branch(plans, suffix_unit_cost, k + 1, counts,
+                [r - c * s for r, s in zip(remaining, p['supply'])],
+                cost + c * p['price'], node_count + c, node_limit, search)
+            if search['timed_out']:
+                break
+        counts[k] = 0
+
+
+
+    def _lower_bound(self, unit_costs, remaining):
+        # Covering all requirements costs at least as much as covering the most expensive one alone.
+        bound = 0.0
+        for r, unit_cost in zip(remaining, unit_costs):
+            if r > 0:
+                bound = max(bound, r * unit_cost)
+        return bound
+
+
+
+    def _count_to_cover(self, plan, remaining, partial = False):
+        '''
+        Returns number of nodes of plan needed to cover the remaining requirements on its own,
+        or None if the plan doesn't supply one of them at all. If partial is True, requirements the plan
+        doesn't supply are ignored instead.
+        '''
+        count = 0
+        for r, s in zip(remaining, plan['supply']):
+            if r > 0:
+                if s <= 0:
+                    if partial:
+                        continue
+                    return None
+                count = max(count, int(math.ceil(r / float(s))))
+        return count
+
+
+
+    def _solution(self, plans, counts, optimal):
+        engine = self.engine
+        by_index = {}
+        for k, p in enumerate(plans):
+            if counts[k]:
+                by_index[p['index']] = counts[k]
+
+        solution = {
+            'nodes' : [],
+            'count' : 0,
+            'total_monthly_cost' : 0.0,
+            'total_hourly_cost' : 0.0,
+            'total_usable_mb' : 0,
+            'total_cores' : 0,
+            'total_ram_gb' : 0,
+            'optimal' : optimal
+        }
+        for i in sorted(by_index.keys()):
+            count = by_index[i]
+            solution['nodes'].append({
+                'plan_id' : int(engine.plan_ids[i]),
+                'plan_name' : engine.plans[i]['LABEL'],
+                'count' : count
+            })
+            solution['count'] += count
+            solution['total_monthly_cost'] += count * float(engine.monthly_price[i])
+            solution['total_hourly_cost'] += count * float(engine.hourly_price[i])
+            solution['total_usable_mb'] += count * int(engine.usable_storage_mb[i])
+            solution['total_cores'] += count * int(engine.cores[i])
+            solution['total_ram_gb'] += count * int(engine.ram_gb[i])
+
+        return solution
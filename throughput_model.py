@@ -0,0 +1,159 @@
+'''
+Model of aggregate HDFS throughput and re-replication time for storage node configurations.
+
+Writes go through the replication pipeline: every byte written by a client is written to the
+disks of (copies + 1) DataNodes, and is sent over the network by every DataNode in the pipeline
+except the last. Reads are served by a single replica. After a DataNode is lost, its blocks are
+copied from surviving replicas to other DataNodes, at a rate limited both by hardware and by how
+fast the NameNode schedules re-replication work.
+
+Figures are upper bounds for large sequential I/O with clients inside the cluster, and are meant
+for comparing plans, not for predicting benchmark results.
+'''
+
+from __future__ import print_function
+
+import numpy as np
+
+
+# Outgoing network bandwidth cap in Mbps of each plan, keyed by the DISK entry of each plan,
+# like default disk allocations. Incoming traffic isn't capped.
+DEFAULT_NETWORK_OUT_MBPS = {
+    24 : 125,
+    48 : 1000,
+    96 : 2000,
+    192 : 3000,
+    384 : 4000,
+    768 : 5000,
+    1152 : 6000,
+    1536 : 7000,
+    1920 : 8000
+}
+
+# Sustained sequential disk throughput of a node in MB/s.
+DEFAULT_DISK_WRITE_MBPS = 300.0
+DEFAULT_DISK_READ_MBPS = 500.0
+
+# Hadoop 2.x defaults that throttle re-replication. The NameNode schedules up to
+# dfs.namenode.replication.work.multiplier.per.iteration blocks per live DataNode
+# every dfs.namenode.replication.interval seconds.
+REPLICATION_WORK_MULTIPLIER = 2
+REPLICATION_INTERVAL_SECS = 3.0
+DEFAULT_BLOCK_SIZE_MB = 128
+
+
+class ThroughputModel(object):
+
+    def __init__(self, sizing_engine, network_out_mbps = DEFAULT_NETWORK_OUT_MBPS,
+            disk_write_mbps = DEFAULT_DISK_WRITE_MBPS, disk_read_mbps = DEFAULT_DISK_READ_MBPS,
+            block_size_mb = DEFAULT_BLOCK_SIZE_MB):
+        '''
+        Args:
+            sizing_engine - a plan_sizing.SizingEngine.
+            network_out_mbps - dict of outgoing network bandwidth in Mbps keyed by plan DISK.
+            disk_write_mbps, disk_read_mbps - sustained disk throughput of a node in MB/s.
+            block_size_mb - HDFS block size, used for re-replication scheduling limits.
+        '''
+        self.engine = sizing_engine
+        self.block_size_mb = block_size_mb
+
+        # Per plan throughput in MB/s, in catalog order.
+        self.net_out = np.array([network_out_mbps[p['DISK']] / 8.0 for p in sizing_engine.plans], dtype = np.float64)
+        self.disk_write = np.full(len(sizing_engine.plans), float(disk_write_mbps))
+        self.disk_read = np.full(len(sizing_engine.plans), float(disk_read_mbps))
+
+
+    def evaluate(self, sizing):
+        '''
+        Estimates throughput of every plan and node count combination of a sizing result.
+
+        Args:
+            sizing - a plan_sizing.SizingResult.
+
+        Returns:
+            A dict of arrays with the same (capacity, copies, plan) shape as sizing.node_count:
+            'write_mbps' and 'read_mbps' aggregate client throughput in MB/s, and
+            're_replication_hours' to restore full replication after losing one node, assuming the
+            cluster is full. Re-replication time is NaN if there are no copies or only one node.
+        '''
+        nodes = sizing.node_count.astype(np.float64)
+        replication = (sizing.copies + 1).astype(np.float64)[np.newaxis, :, np.newaxis]
+        total_mb = sizing.total_capacity_mb.astype(np.float64)[:, :, np.newaxis]
+
+        write_mbps, read_mbps, repl_mbps = self._rates(
+            nodes, replication, self.net_out, self.disk_write, self.disk_read)
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            lost_mb = np.where(nodes > 0, total_mb / nodes, 0.0)
+            hours = np.where((replication > 1) & (nodes > 1), lost_mb / repl_mbps / 3600.0, np.nan)
+
+        return {
+            'write_mbps' : write_mbps,
+            'read_mbps' : read_mbps,
+            're_replication_hours' : hours
+        }
+
+
+    def for_nodes(self, nodes, total_capacity_mb, copies):
+        '''
+        Estimates throughput of a possibly mixed set of storage nodes.
+
+        Args:
+            nodes - storage nodes as saved in cluster['nodes'].
+            total_capacity_mb - total stored data including copies, in MB.
+            copies - number of additional copies of each file.
+
+        Returns:
+            Dict with 'write_mbps', 'read_mbps' and 're_replication_hours' (None if the data
+            can't be re-replicated). Rates are 0 if there are no nodes.
+        '''
+        counts = np.zeros(len(self.engine.plans))
+        for n in nodes:
+            counts[ self.engine.index_of[int(n['plan'].split(':')[1])] ] += n['count']
+
+        node_count = counts.sum()
+        if node_count == 0:
+            return {'write_mbps' : 0.0, 'read_mbps' : 0.0, 're_replication_hours' : None}
+
+        replication = copies + 1.0
+
+        # Heterogeneous nodes: add up per node capacities, then apply the same limits.
+        write_mbps, read_mbps, repl_mbps = self._rates(
+            node_count, replication,
+            (counts * self.net_out).sum() / node_count,
+            (counts * self.disk_write).sum() / node_count,
+            (counts * self.disk_read).sum() / node_count)
+
+        # DataNodes fill up in proportion to their capacity, so the largest one holds the most data.
+        usable = self.engine.usable_storage_mb
+        largest_share = usable[counts > 0].max() / float((counts * usable).sum())
+
+        hours = None
+        if replication > 1 and node_count > 1:
+            hours = float(total_capacity_mb * largest_share / repl_mbps / 3600.0)
+
+        return {
+            'write_mbps' : float(write_mbps),
+            'read_mbps' : float(read_mbps),
+            're_replication_hours' : hours
+        }
+
+
+
+    def _rates(self, nodes, replication, net_out, disk_write, disk_read):
+        # Every client byte is written to 'replication' disks and forwarded replication - 1 times.
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            disk_limit = nodes * disk_write / replication
+            net_limit = np.where(replication > 1, nodes * net_out / (replication - 1), np.inf)
+        write_mbps = np.minimum(disk_limit, net_limit)
+
+        read_mbps = nodes * np.minimum(net_out, disk_read)
+
+        # Surviving nodes read a replica, send it, and the receiver writes it. Each node does
+        # all three concurrently, so the slowest one limits it.
+        survivors = np.maximum(nodes - 1, 0)
+        hw_limit = survivors * np.minimum(np.minimum(net_out, disk_read), disk_write)
+        schedule_limit = survivors * REPLICATION_WORK_MULTIPLIER * self.block_size_mb / REPLICATION_INTERVAL_SECS
+        repl_mbps = np.minimum(hw_limit, schedule_limit)
+
+        return write_mbps, read_mbps, repl_mbps